@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Medicine, Manufacturer, ProductionBatch, Location, Inventory, ResupplyRequest, StockMovement, DemandForecast, UserProfile
+from .models import Medicine, Manufacturer, ProductionBatch, Location, LocationEdge, Inventory, ResupplyRequest, ResupplyPlanRun, StockMovement, DemandForecast, UserProfile
 
 @admin.register(Medicine)
 class MedicineAdmin(admin.ModelAdmin):
@@ -19,10 +19,16 @@ class ProductionBatchAdmin(admin.ModelAdmin):
 
 @admin.register(Location)
 class LocationAdmin(admin.ModelAdmin):
-    list_display = ['name', 'location_type', 'created_at']
-    list_filter = ['location_type']
+    list_display = ['name', 'location_type', 'organization', 'created_at']
+    list_filter = ['location_type', 'organization']
     search_fields = ['name']
 
+@admin.register(LocationEdge)
+class LocationEdgeAdmin(admin.ModelAdmin):
+    list_display = ['from_location', 'to_location', 'transit_hours', 'cost', 'bidirectional', 'is_active']
+    list_filter = ['bidirectional', 'is_active']
+    search_fields = ['from_location__name', 'to_location__name']
+
 @admin.register(Inventory)
 class InventoryAdmin(admin.ModelAdmin):
     list_display = ['batch', 'location', 'quantity', 'status', 'last_updated']
@@ -33,4 +39,16 @@ class InventoryAdmin(admin.ModelAdmin):
 class ResupplyRequestAdmin(admin.ModelAdmin):
     list_display = ['medicine', 'requesting_location', 'requested_quantity', 'urgency', 'status', 'created_at']
     list_filter = ['urgency', 'status', 'created_at']
-    search_fields = ['medicine__name', 'requesting_location__name']
\ No newline at end of file
+    search_fields = ['medicine__name', 'requesting_location__name']
+
+@admin.register(ResupplyPlanRun)
+class ResupplyPlanRunAdmin(admin.ModelAdmin):
+    list_display = ['started_at', 'full', 'series_checked', 'created_count', 'merged_count', 'run_by']
+    list_filter = ['full']
+
+@admin.register(UserProfile)
+class UserProfileAdmin(admin.ModelAdmin):
+    list_display = ['user', 'role', 'organization', 'created_at']
+    list_filter = ['role', 'organization']
+    search_fields = ['user__username', 'organization']
+    filter_horizontal = ['locations']
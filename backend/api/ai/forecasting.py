@@ -1,20 +1,104 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
 import pandas as pd
 from prophet import Prophet
 from io import StringIO
 
-def generate_forecast_from_csv(csv_data, periods=7):
+FREQUENCIES = {'daily': 'D', 'weekly': 'W-MON'}
+MAX_CACHED_MODELS = 32
+
+_models = OrderedDict()
+_lock = threading.Lock()
+
+def generate_forecast_from_csv(csv_data, periods=7, frequency='daily', interval_width=0.95):
     """
-    Accepts CSV content and returns forecasted demand for next 'periods' days.
+    Accepts CSV content and returns forecasted demand for the next 'periods'
+    days or weeks, with the bounds of the 'interval_width' uncertainty interval.
     Expected CSV columns: date, demand
     """
     df = pd.read_csv(StringIO(csv_data))
     df.rename(columns={"date": "ds", "demand": "y"}, inplace=True)
-    
-    model = Prophet()
+    return _forecast_frame(df, periods, frequency, interval_width)
+
+def generate_forecast_from_series(series, periods=7, frequency='daily', interval_width=0.95):
+    """
+    Accepts a daily demand series as (date, units) pairs, such as the one
+    `api.rollups.demand_series` returns, and forecasts it like
+    `generate_forecast_from_csv`.
+    """
+    df = pd.DataFrame(series, columns=["ds", "y"])
+    return _forecast_frame(df, periods, frequency, interval_width)
+
+class FittedForecast:
+    """
+    A fitted model plus the predictions made with it so far. Asking for a
+    longer horizon only predicts the dates not yet in the frame. Each model
+    has its own lock, so a slow prediction only holds up requests for the
+    same model.
+    """
+
+    def __init__(self, model, last_ds, freq):
+        self.model = model
+        self.last_ds = last_ds
+        self.freq = freq
+        self.predictions = pd.DataFrame(columns=['ds', 'yhat', 'yhat_lower', 'yhat_upper'])
+        self._lock = threading.Lock()
+
+    def predict(self, periods):
+        with self._lock:
+            have = len(self.predictions)
+            if have < periods:
+                dates = pd.date_range(self.last_ds, periods=periods + 1, freq=self.freq)[1:]
+                frame = self.model.predict(pd.DataFrame({'ds': dates[have:]}))
+                frame = frame[['ds', 'yhat', 'yhat_lower', 'yhat_upper']]
+                self.predictions = frame if have == 0 else pd.concat([self.predictions, frame], ignore_index=True)
+            return self.predictions.head(periods).copy()
+
+def _prepare(df, frequency):
+    df = df[['ds', 'y']].copy()
+    df['ds'] = pd.to_datetime(df['ds'])
+    if frequency == 'weekly':
+        # Weeks start on Monday and are labelled by that Monday. Partial
+        # weeks at either end of the history would read as dips in demand.
+        first = df['ds'].min().normalize()
+        last = df['ds'].max().normalize()
+        first += pd.Timedelta(days=(7 - first.weekday()) % 7)
+        last -= pd.Timedelta(days=(last.weekday() + 1) % 7)
+        df = df[(df['ds'] >= first) & (df['ds'] < last + pd.Timedelta(days=1))]
+        df = df.set_index('ds').resample('W-MON', label='left', closed='left')['y'].sum().reset_index()
+    return df.sort_values('ds').reset_index(drop=True)
+
+def get_fitted_forecast(df, frequency='daily', interval_width=0.95):
+    """
+    Fit a model on the history in `df` (columns ds, y), or reuse the one
+    fitted earlier on identical history and settings in this process.
+    """
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"frequency must be one of {', '.join(FREQUENCIES)}")
+    df = _prepare(df, frequency)
+    digest = hashlib.blake2b(pd.util.hash_pandas_object(df, index=False).values.tobytes(), digest_size=16).hexdigest()
+    key = (digest, frequency, interval_width)
+    with _lock:
+        fitted = _models.get(key)
+        if fitted is not None:
+            _models.move_to_end(key)
+            return fitted
+
+    model = Prophet(interval_width=interval_width)
     model.fit(df)
-    future = model.make_future_dataframe(periods=periods)
-    forecast = model.predict(future)
+    fitted = FittedForecast(model, df['ds'].iloc[-1], FREQUENCIES[frequency])
+    with _lock:
+        _models[key] = fitted
+        while len(_models) > MAX_CACHED_MODELS:
+            _models.popitem(last=False)
+    return fitted
+
+def _forecast_frame(df, periods, frequency='daily', interval_width=0.95):
+    fitted = get_fitted_forecast(df, frequency, interval_width)
+    forecasted = fitted.predict(periods)
 
-    forecasted = forecast[['ds', 'yhat']].tail(periods)
-    forecasted['yhat'] = forecasted['yhat'].apply(lambda x: max(int(x), 0))
+    for column in ('yhat', 'yhat_lower', 'yhat_upper'):
+        forecasted[column] = forecasted[column].apply(lambda x: max(int(x), 0))
     return forecasted.to_dict(orient='records')
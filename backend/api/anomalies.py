@@ -0,0 +1,197 @@
+"""
+Streaming demand anomaly detection.
+
+Every (medicine, location) demand series, the units distributed per day as
+in `api.rollups.demand_series`, keeps exponentially weighted running
+statistics in a few NumPy arrays indexed by series slot: the mean and
+variance of its daily totals, the days of demand seen, and the next day to
+fold in. As movements are recorded (see `api.signals`), each touched series
+first folds in the days closed since it was last seen, then compares the
+current day's running total, read from the daily rollups, against
+
+    threshold = mean + Z_THRESHOLD * max(std, MIN_STD)
+
+A day above it, of at least `MIN_UNITS`, once the series has `MIN_DAYS` of
+demand behind it, is stored as a `DemandAnomaly`. Every day is folded in
+winsorized to the threshold, so a spike does not inflate the baseline the
+following days are judged against.
+
+A batch costs at most three queries and, per series, at most `WARMUP_DAYS`
+folding steps, whatever the length of its history. The statistics live per
+process and are seeded from the last `WARMUP_DAYS` of rollups the first time a
+series is seen; since closed days are always read back from the shared
+rollups, processes that see different writes still agree on them.
+
+`clean_series()` applies the stored flags to a series before forecasting:
+flagged days, unless dismissed, are clipped to their threshold or dropped.
+"""
+import math
+import threading
+from datetime import date
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Inventory, DailyMovementRollup, DemandAnomaly
+
+DEFAULTS = {
+    'ALPHA': 0.1,
+    'Z_THRESHOLD': 4.0,
+    'MIN_STD': 1.0,
+    'MIN_DAYS': 14,
+    'MIN_UNITS': 10,
+    'WARMUP_DAYS': 56,
+    'FORECAST_CLEANING': 'winsorize',
+}
+
+DEMAND_TYPES = ('distribution',)
+CLEANING_MODES = ('winsorize', 'exclude', 'keep')
+
+_lock = threading.Lock()
+
+
+def get_setting(name):
+    return getattr(settings, 'ANOMALIES', {}).get(name, DEFAULTS[name])
+
+
+class SeriesStats:
+    """Running statistics per (medicine, location), one array slot per series."""
+
+    ARRAYS = {'mean': np.float64, 'var': np.float64, 'days': np.int32, 'next_day': np.int32}
+
+    def __init__(self, capacity=1024):
+        self.slots = {}
+        for name, dtype in self.ARRAYS.items():
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+
+    def slot(self, key):
+        index = self.slots.get(key)
+        if index is None:
+            index = len(self.slots)
+            if index == len(self.mean):
+                for name in self.ARRAYS:
+                    array = getattr(self, name)
+                    setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+            self.slots[key] = index
+        return index
+
+    def next_day_of(self, key):
+        """Ordinal of the first day not folded into `key`'s statistics, 0 for an unseen series."""
+        index = self.slots.get(key)
+        return 0 if index is None else int(self.next_day[index])
+
+    def threshold(self, index, z, min_std):
+        return self.mean[index] + z * max(math.sqrt(self.var[index]), min_std)
+
+    def fold(self, index, units, alpha, z, min_std, min_days):
+        days = self.days[index]
+        if days == 0:
+            # Days before a series' first demand say nothing about it.
+            if units:
+                self.mean[index], self.var[index], self.days[index] = units, 0.0, 1
+            return
+        if days >= min_days:
+            units = min(units, self.threshold(index, z, min_std))
+        diff = units - self.mean[index]
+        increment = alpha * diff
+        self.mean[index] += increment
+        self.var[index] = (1 - alpha) * (self.var[index] + diff * increment)
+        self.days[index] = days + 1
+
+
+_stats = SeriesStats()
+
+
+def observe(movements):
+    """
+    Fold newly recorded StockMovement instances into the series statistics
+    and store the days they make anomalous. Returns the anomalies written.
+    """
+    movements = [
+        movement for movement in movements
+        if movement.movement_type in DEMAND_TYPES and movement.inventory_id is not None and movement.created_at is not None
+    ]
+    if not movements:
+        return []
+    placement = {
+        pk: (medicine, location)
+        for pk, medicine, location in Inventory.objects.filter(
+            pk__in={movement.inventory_id for movement in movements}
+        ).values_list('id', 'batch__medicine_id', 'location_id')
+    }
+    touched = {
+        (*placement[movement.inventory_id], timezone.localdate(movement.created_at))
+        for movement in movements if movement.inventory_id in placement
+    }
+    if not touched:
+        return []
+
+    warmup = get_setting('WARMUP_DAYS')
+    start = min(
+        max(_stats.next_day_of((medicine, location)), day.toordinal() - warmup)
+        for medicine, location, day in touched
+    )
+    totals = {
+        (medicine, location, day.toordinal()): units
+        for medicine, location, day, units in DailyMovementRollup.objects.filter(
+            medicine_id__in={key[0] for key in touched},
+            location_id__in={key[1] for key in touched},
+            day__gte=date.fromordinal(start),
+            day__lte=max(key[2] for key in touched),
+            movement_type__in=DEMAND_TYPES,
+        ).values_list('medicine_id', 'location_id', 'day').annotate(units=Sum('units_out')).order_by()
+    }
+
+    alpha, z, min_std = get_setting('ALPHA'), get_setting('Z_THRESHOLD'), get_setting('MIN_STD')
+    min_days, min_units = get_setting('MIN_DAYS'), get_setting('MIN_UNITS')
+    anomalies = []
+    with _lock:
+        for medicine, location, day in sorted(touched, key=lambda key: key[2]):
+            index = _stats.slot((medicine, location))
+            today = day.toordinal()
+            if today < _stats.next_day[index]:
+                # A late row for a day already folded in.
+                continue
+            for ordinal in range(max(int(_stats.next_day[index]), today - warmup), today):
+                _stats.fold(index, totals.get((medicine, location, ordinal), 0), alpha, z, min_std, min_days)
+            _stats.next_day[index] = today
+
+            units = totals.get((medicine, location, today), 0)
+            threshold = _stats.threshold(index, z, min_std)
+            if _stats.days[index] < min_days or units < min_units or units <= threshold:
+                continue
+            mean = float(_stats.mean[index])
+            anomalies.append(DemandAnomaly(
+                medicine_id=medicine, location_id=location, day=day, units=units,
+                expected=round(mean, 2), threshold=round(float(threshold), 2),
+                score=round((units - mean) / max(math.sqrt(_stats.var[index]), min_std), 2),
+            ))
+
+    # Later movements on a flagged day raise its units and score, never its status.
+    DemandAnomaly.objects.bulk_create(
+        anomalies, update_conflicts=True,
+        unique_fields=['medicine', 'location', 'day'],
+        update_fields=['units', 'expected', 'threshold', 'score', 'updated_at'],
+    )
+    return anomalies
+
+
+def clean_series(medicine, location, series, mode=None):
+    """
+    `series` of (day, units) with its flagged days, other than dismissed
+    ones, clipped to their threshold ('winsorize'), dropped ('exclude') or
+    left alone ('keep'). Defaults to `FORECAST_CLEANING`.
+    """
+    mode = mode or get_setting('FORECAST_CLEANING')
+    if mode == 'keep' or not series:
+        return series
+    flagged = dict(DemandAnomaly.objects.filter(
+        medicine_id=medicine, location_id=location, day__range=(series[0][0], series[-1][0])
+    ).exclude(status='dismissed').values_list('day', 'threshold'))
+    if not flagged:
+        return series
+    if mode == 'exclude':
+        return [(day, units) for day, units in series if day not in flagged]
+    return [(day, min(units, math.floor(flagged[day])) if day in flagged else units) for day, units in series]
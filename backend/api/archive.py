@@ -0,0 +1,215 @@
+"""
+Archival of old StockMovement rows into per-month shards.
+
+`archive_movements()` moves every movement from months wholly older than
+`HORIZON_DAYS` out of the hot table into one SQLite file per month under
+`DIRECTORY`, recorded in `MovementArchive`. The shards hold the rows as
+`movement_history` serves them, with location, medicine and user names
+resolved at archive time, so they stay readable after the rows they refer
+to are gone. Each chunk is written to its shard before it is deleted from
+the hot table, and re-archiving a row replaces it, so an interrupted run
+can simply be repeated.
+
+The daily and weekly rollups stay online and keep covering archived
+months; `api.rollups.rebuild()` never re-aggregates days before
+`archived_until()`, since their raw rows are no longer in the table.
+`archived_movements()` reads archived ranges back, opening only the shards
+that overlap the requested period.
+"""
+import sqlite3
+from contextlib import closing
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import StockMovement, MovementArchive
+
+DEFAULTS = {
+    'DIRECTORY': None,
+    'HORIZON_DAYS': 365,
+    'CHUNK_SIZE': 5000,
+}
+
+# Filter columns stored alongside the served ones.
+FILTER_COLUMNS = {
+    'batch': F('inventory__batch_id'),
+    'location': F('inventory__location_id'),
+    'medicine': F('inventory__batch__medicine_id'),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS movements (
+    id INTEGER PRIMARY KEY,
+    movement_type TEXT NOT NULL,
+    quantity_change INTEGER NOT NULL,
+    notes TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    inventory INTEGER,
+    from_location INTEGER,
+    to_location INTEGER,
+    created_by INTEGER,
+    from_location_name TEXT,
+    to_location_name TEXT,
+    created_by_username TEXT,
+    medicine_name TEXT,
+    batch INTEGER,
+    location INTEGER,
+    medicine INTEGER
+);
+CREATE INDEX IF NOT EXISTS movements_created_at ON movements (created_at);
+"""
+
+
+def get_setting(name):
+    value = getattr(settings, 'ARCHIVE', {}).get(name, DEFAULTS[name])
+    if name == 'DIRECTORY' and value is None:
+        value = settings.BASE_DIR / 'archive'
+    return value
+
+
+def columns():
+    """Served columns, in StockMovementValuesSerializer order."""
+    # Imported here: the rollups import this module while signals load.
+    from .fast_serializers import StockMovementValuesSerializer
+    return (*StockMovementValuesSerializer.fields, *StockMovementValuesSerializer(None).get_expressions())
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (month_start(day) + timedelta(days=32)).replace(day=1)
+
+
+def _local_midnight(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _stamp(value):
+    # UTC ISO strings sort in time order, so range filters work on text.
+    return value.astimezone(dt_timezone.utc).isoformat()
+
+
+def shard_path(month):
+    return Path(get_setting('DIRECTORY')) / f"stock-movements-{month:%Y-%m}.sqlite3"
+
+
+def archived_until():
+    """The first day whose movements are still in the hot table, or None if nothing is archived."""
+    latest = MovementArchive.objects.order_by('-month').values_list('month', flat=True).first()
+    return next_month(latest) if latest else None
+
+
+def _open_shard(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def archive_month(month, chunk_size=None):
+    """Move one month's movements into its shard. Returns the number of rows moved."""
+    from .fast_serializers import StockMovementValuesSerializer
+
+    chunk_size = chunk_size or get_setting('CHUNK_SIZE')
+    names = columns()
+    queryset = StockMovement.objects.filter(
+        created_at__gte=_local_midnight(month), created_at__lt=_local_midnight(next_month(month))
+    )
+    rows = StockMovementValuesSerializer(queryset).get_values_queryset().annotate(**FILTER_COLUMNS)
+    keys = (*names, *FILTER_COLUMNS)
+    insert = f"INSERT OR REPLACE INTO movements ({', '.join(keys)}) VALUES ({', '.join('?' * len(keys))})"
+
+    path = shard_path(month)
+    moved = 0
+    last_id = 0
+    with closing(_open_shard(path)) as shard:
+        while True:
+            chunk = list(rows.filter(id__gt=last_id).order_by('id')[:chunk_size])
+            if not chunk:
+                break
+            with shard:
+                shard.executemany(insert, [
+                    tuple(_stamp(row[key]) if key == 'created_at' else row[key] for key in keys)
+                    for row in chunk
+                ])
+            ids = [row['id'] for row in chunk]
+            with transaction.atomic():
+                MovementArchive.objects.update_or_create(month=month, defaults={'path': path.name})
+                StockMovement.objects.filter(pk__in=ids).delete()
+            moved += len(ids)
+            last_id = ids[-1]
+        total = shard.execute("SELECT COUNT(*) FROM movements").fetchone()[0]
+    if total:
+        MovementArchive.objects.update_or_create(month=month, defaults={'path': path.name, 'row_count': total})
+    return moved
+
+
+def archivable_months(horizon_days=None):
+    """Months with movements that lie wholly before the archive horizon."""
+    horizon_days = get_setting('HORIZON_DAYS') if horizon_days is None else horizon_days
+    cutoff = month_start(timezone.localdate() - timedelta(days=horizon_days))
+    months = StockMovement.objects.filter(created_at__lt=_local_midnight(cutoff)).dates('created_at', 'month')
+    return list(months)
+
+
+def archive_movements(horizon_days=None, chunk_size=None):
+    """Archive every month before the horizon. Returns {month: rows moved}."""
+    return {month: archive_month(month, chunk_size) for month in archivable_months(horizon_days)}
+
+
+def archived_movements(start=None, end=None, batch=None, location=None, scope=None, fields=None):
+    """
+    Archived movements created in [start, end), oldest first, filtered like
+    `movement_history`: by batch, by `location` as source or destination,
+    and by a location `scope` (see `api.scoping`). Returns dicts with the
+    given `fields` (default: all served columns).
+    """
+    shards = MovementArchive.objects.order_by('month')
+    if start is not None:
+        shards = shards.filter(month__gte=month_start(timezone.localdate(start)))
+    if end is not None:
+        shards = shards.filter(month__lte=timezone.localdate(end))
+    fields = list(fields or columns())
+
+    conditions, params = [], []
+    if start is not None:
+        conditions.append("created_at >= ?")
+        params.append(_stamp(start))
+    if end is not None:
+        conditions.append("created_at < ?")
+        params.append(_stamp(end))
+    if batch is not None:
+        conditions.append("batch = ?")
+        params.append(int(batch))
+    if location is not None:
+        conditions.append("(from_location = ? OR to_location = ?)")
+        params.extend([int(location)] * 2)
+    if scope is not None:
+        scope = sorted(scope)
+        marks = ', '.join('?' * len(scope))
+        conditions.append(f"(location IN ({marks}) OR from_location IN ({marks}) OR to_location IN ({marks}))")
+        params.extend(scope * 3)
+    sql = f"SELECT {', '.join(fields)} FROM movements"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY created_at, id"
+
+    results = []
+    directory = Path(get_setting('DIRECTORY'))
+    for shard in shards:
+        path = directory / shard.path
+        if not path.exists():
+            continue
+        with closing(sqlite3.connect(f'file:{path}?mode=ro', uri=True)) as connection:
+            for values in connection.execute(sql, params):
+                row = dict(zip(fields, values))
+                if 'created_at' in row:
+                    row['created_at'] = datetime.fromisoformat(row['created_at'])
+                results.append(row)
+    return results
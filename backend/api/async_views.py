@@ -0,0 +1,228 @@
+"""
+Async variants of the hot read endpoints, served natively under ASGI.
+
+Under WSGI each of these ties up a worker thread for the whole request. The
+async versions use Django's async ORM and await their independent queries
+together with asyncio.gather, so the event loop keeps serving other requests
+while the database work is in flight. Django still executes async ORM calls
+on its shared sync thread, so the gain is in worker occupancy rather than in
+per-request query parallelism. The response payloads match the synchronous
+DRF actions they mirror.
+"""
+import asyncio
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, F
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed, TokenError
+
+from .models import Medicine, Inventory, UserProfile
+from .scoping import location_scope, scope_queryset
+from . import dashboard
+from .push import KINDS as PUSH_KINDS, ROLE_KINDS, Subscription, get_broadcaster, get_setting as push_setting
+
+
+async def _authenticate(request):
+    """Resolve the user from a Bearer token, falling back to the session."""
+    try:
+        result = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    if result is not None:
+        return result[0]
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+def async_api_view(view):
+    """Restrict an async view to authenticated GET requests, like the DRF defaults."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+        user = await _authenticate(request)
+        if user is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+        request.user = user
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def _page_url(request, number):
+    url = request.build_absolute_uri()
+    return remove_query_param(url, 'page') if number == 1 else replace_query_param(url, 'page', number)
+
+
+async def _rows(queryset):
+    return [row async for row in queryset]
+
+
+async def _paginate(request, queryset):
+    """
+    One page of `queryset` as DRF's PageNumberPagination would serve it:
+    (envelope without `results`, rows), or (None, None) for an invalid page.
+    """
+    page_size = api_settings.PAGE_SIZE
+    count = await queryset.acount()
+    pages = max(1, -(-count // page_size))
+    number = request.GET.get('page', 1)
+    try:
+        number = pages if number == 'last' else int(number)
+    except ValueError:
+        return None, None
+    if not 1 <= number <= pages:
+        return None, None
+    rows = [row async for row in queryset[(number - 1) * page_size:number * page_size]]
+    return {
+        'count': count,
+        'next': _page_url(request, number + 1) if number < pages else None,
+        'previous': _page_url(request, number - 1) if number > 1 else None,
+    }, rows
+
+
+@async_api_view
+async def dashboard_stats(request):
+    scope = await sync_to_async(location_scope)(request.user)
+    # The four queries are independent, so they are awaited together rather
+    # than one after another.
+    total_medicines, low_stock_count, in_transit_count, activity = await asyncio.gather(
+        Medicine.objects.acount(),
+        dashboard.low_stock(scope).acount(),
+        dashboard.in_transit(scope).acount(),
+        _rows(dashboard.recent_activity(scope)),
+    )
+    return JsonResponse(dashboard.stats(total_medicines, low_stock_count, in_transit_count, activity))
+
+
+@async_api_view
+async def low_stock_alerts(request):
+    scope = await sync_to_async(location_scope)(request.user)
+    alerts = [dashboard.alert_row(row) async for row in dashboard.low_stock_alerts(scope)]
+    return JsonResponse(alerts, safe=False)
+
+
+@async_api_view
+async def expiring_soon(request):
+    try:
+        days = int(request.GET.get('days', dashboard.EXPIRING_DAYS))
+    except ValueError:
+        return JsonResponse({'error': 'days must be an integer'}, status=400)
+
+    today = timezone.now().date()
+    scope = await sync_to_async(location_scope)(request.user)
+    envelope, items = await _paginate(request, dashboard.expiring(scope, today, days))
+    if envelope is None:
+        return JsonResponse({'detail': 'Invalid page.'}, status=404)
+    return JsonResponse({**envelope, 'results': [dashboard.expiring_row(item, today) for item in items]})
+
+
+@async_api_view
+async def search(request):
+    query = request.GET.get('q', '')
+
+    if not query:
+        return JsonResponse({'error': 'Search query is required'}, status=400)
+
+    today = timezone.now().date()
+    scope = await sync_to_async(location_scope)(request.user)
+    results = scope_queryset(Inventory.objects.all(), scope, 'location').filter(
+        Q(batch__medicine__name__icontains=query) |
+        Q(batch__batch_number__icontains=query) |
+        Q(location__name__icontains=query)
+    ).values(
+        'id', 'quantity', 'status', 'last_updated', 'created_at', 'batch', 'location',
+        medicine_name=F('batch__medicine__name'),
+        batch_number=F('batch__batch_number'),
+        location_name=F('location__name'),
+        expiry_date=F('batch__expiry_date'),
+    )
+
+    items = []
+    async for item in results:
+        item['days_to_expiry'] = (item['expiry_date'] - today).days
+        items.append(item)
+
+    return JsonResponse(items, safe=False)
+
+
+async def _authenticate_stream(request):
+    """
+    Like `_authenticate`, but also accepts the access token as
+    `?access_token=`, since browsers' EventSource cannot set headers.
+    """
+    raw_token = request.GET.get('access_token')
+    if not raw_token:
+        return await _authenticate(request)
+    authentication = JWTAuthentication()
+    try:
+        validated = await sync_to_async(authentication.get_validated_token)(raw_token)
+        return await sync_to_async(authentication.get_user)(validated)
+    except (InvalidToken, AuthenticationFailed, TokenError):
+        return None
+
+
+def _sse(event):
+    data = json.dumps({'id': event.id, 'kind': event.kind, **event.payload}, cls=DjangoJSONEncoder)
+    return f"id: {event.id}\nevent: {event.kind}\ndata: {data}\n\n"
+
+
+async def _event_stream(broadcaster, subscription):
+    try:
+        yield f"retry: {int(push_setting('POLL_SECONDS') * 5000)}\n\n"
+        while True:
+            try:
+                await asyncio.wait_for(subscription.wakeup.wait(), push_setting('HEARTBEAT_SECONDS'))
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            await asyncio.sleep(push_setting('COALESCE_SECONDS'))
+            yield ''.join(_sse(event) for event in subscription.drain())
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+async def events(request):
+    """
+    Server-sent stream of stock_change, low_stock and expiry events (see
+    `api.push`). `?kinds=` and `?location=` take comma-separated filters;
+    kinds are limited to those the user's role may see, and locations to
+    the user's scope (see `api.scoping`). Reconnecting
+    clients resume from the `Last-Event-ID` header.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+    user = await _authenticate_stream(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+    role = await UserProfile.objects.filter(user=user).values_list('role', flat=True).afirst()
+    allowed = ROLE_KINDS.get(role, set(PUSH_KINDS))
+    kinds = set(request.GET['kinds'].split(',')) if request.GET.get('kinds') else set(PUSH_KINDS)
+    if kinds - set(PUSH_KINDS):
+        return JsonResponse({'error': f"kinds must be drawn from {', '.join(PUSH_KINDS)}"}, status=400)
+    try:
+        locations = {int(pk) for pk in request.GET['location'].split(',')} if request.GET.get('location') else None
+        last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return JsonResponse({'error': 'location and Last-Event-ID must be integers'}, status=400)
+
+    scope = await sync_to_async(location_scope)(user)
+    if scope is not None:
+        locations = scope if locations is None else locations & scope
+
+    broadcaster = get_broadcaster()
+    subscription = Subscription(kinds & allowed, locations)
+    await broadcaster.subscribe(subscription, last_event_id)
+    return StreamingHttpResponse(
+        _event_stream(broadcaster, subscription),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
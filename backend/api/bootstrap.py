@@ -0,0 +1,142 @@
+"""
+One-request page bootstrap.
+
+`bootstrap(request, sections)` gathers what the frontend needs on first
+render (the current user, their locations, catalog, dashboard counts and
+the most urgent lists) into one response, so a page load costs one auth
+and one round trip instead of one per resource. Every section is a few
+`values()` queries limited to the user's location scope (see
+`api.scoping`), the dashboard ones shared with their own endpoints through
+`api.dashboard`; lists are capped at `LIST_LIMIT` rows, most urgent first,
+and the full lists stay with their own endpoints.
+
+`ROLE_SECTIONS` picks the sections each role's pages use. The assembled
+payload is cached per user and section set for `TTL_SECONDS`, so page
+switches and reloads within that window cost a single cache read.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+
+from . import dashboard
+from .fast_serializers import InventoryValuesSerializer
+from .models import Medicine, ProductionBatch, Location, Inventory, ResupplyRequest, UserProfile
+from .scoping import request_scope, scope_queryset
+from .serializers import UserSerializer
+
+DEFAULTS = {
+    'CACHE': 'default',
+    'TTL_SECONDS': 30,
+    'LIST_LIMIT': 50,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'BOOTSTRAP', {}).get(name, DEFAULTS[name])
+
+
+def _user(request, scope, limit):
+    return UserSerializer(request.user).data
+
+
+def _locations(request, scope, limit):
+    return list(scope_queryset(Location.objects.all(), scope, 'id').order_by('name').values(
+        'id', 'name', 'location_type', 'organization'
+    ))
+
+
+def _medicines(request, scope, limit):
+    return list(Medicine.objects.order_by('name').values('id', 'name', 'strength'))
+
+
+def _dashboard(request, scope, limit):
+    """The counts and recent activity of `InventoryViewSet.dashboard_stats`."""
+    return dashboard.stats(
+        Medicine.objects.count(),
+        dashboard.low_stock(scope).count(),
+        dashboard.in_transit(scope).count(),
+        dashboard.recent_activity(scope),
+    )
+
+
+def _low_stock_alerts(request, scope, limit):
+    return [dashboard.alert_row(row) for row in dashboard.low_stock_alerts(scope)[:limit]]
+
+
+def _inventory(request, scope, limit):
+    rows = scope_queryset(Inventory.objects.all(), scope, 'location')
+    return {
+        'count': rows.count(),
+        'results': list(InventoryValuesSerializer(rows.order_by('-last_updated', '-id')).get_values_queryset()[:limit]),
+    }
+
+
+def _expiring(request, scope, limit):
+    today = timezone.localdate()
+    return [dashboard.expiring_row(row, today) for row in dashboard.expiring(scope, today)[:limit]]
+
+
+def _production(request, scope, limit):
+    return list(ProductionBatch.objects.order_by('-production_date', '-id').values(
+        'id', 'batch_number', 'production_date', 'expiry_date', 'quantity',
+        medicine_name=F('medicine__name'),
+        manufacturer_name=F('manufacturer__name'),
+    )[:limit])
+
+
+def _resupply(request, scope, limit):
+    return list(scope_queryset(ResupplyRequest.objects.filter(status__in=('pending', 'approved', 'in_progress')), scope, 'requesting_location').order_by('-created_at', '-id').values(
+        'id', 'requested_quantity', 'urgency', 'status', 'created_at',
+        medicine_name=F('medicine__name'),
+        location_name=F('requesting_location__name'),
+    )[:limit])
+
+
+SECTIONS = {
+    'user': _user,
+    'locations': _locations,
+    'medicines': _medicines,
+    'dashboard': _dashboard,
+    'low_stock_alerts': _low_stock_alerts,
+    'inventory': _inventory,
+    'expiring_soon': _expiring,
+    'production': _production,
+    'resupply_requests': _resupply,
+}
+
+# Sections each role's pages load; users without a profile get them all.
+ROLE_SECTIONS = {
+    'manufacturer': ('user', 'medicines', 'dashboard', 'production', 'expiring_soon'),
+    'stockist': ('user', 'locations', 'medicines', 'dashboard', 'low_stock_alerts', 'resupply_requests'),
+    'pharmacist': ('user', 'locations', 'dashboard', 'inventory', 'low_stock_alerts', 'expiring_soon'),
+}
+
+
+def user_role(user):
+    return UserProfile.objects.filter(user=user).values_list('role', flat=True).first()
+
+
+def bootstrap(request, sections=None):
+    """
+    The named sections, or the user's role defaults, for the request's
+    user, as (payload, cached). The payload comes from the per-user cache
+    when a fresh one is there.
+    """
+    cache = caches[get_setting('CACHE')]
+    key = f"bootstrap:{request.user.pk}:{','.join(sections) if sections else ''}"
+    payload = cache.get(key)
+    if payload is not None:
+        return payload, True
+
+    role = user_role(request.user)
+    sections = sections or ROLE_SECTIONS.get(role, tuple(SECTIONS))
+    scope = request_scope(request)
+    limit = get_setting('LIST_LIMIT')
+    payload = {
+        'role': role,
+        'generated_at': timezone.now(),
+        **{name: SECTIONS[name](request, scope, limit) for name in sections},
+    }
+    cache.set(key, payload, get_setting('TTL_SECONDS'))
+    return payload, False
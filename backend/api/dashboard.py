@@ -0,0 +1,101 @@
+"""
+Dashboard figures shared by `InventoryViewSet`, its async variants in
+`api.async_views` and the bootstrap payload (see `api.bootstrap`), so the
+three report the same numbers.
+
+The helpers build `values()` querysets limited to a location scope (see
+`api.scoping`), which callers evaluate with the sync or the async ORM and
+page or cap as they need; the `*_row` functions shape one row of each for
+the response.
+"""
+from datetime import timedelta
+
+from django.db.models import F, Q
+
+from .models import Inventory, StockMovement
+from .scoping import scope_queryset
+
+# Stock below this many units counts as low, whatever its status says.
+LOW_STOCK_THRESHOLD = 100
+EXPIRING_DAYS = 90
+# Expiring stock with fewer days left than this is critical.
+CRITICAL_DAYS = 30
+RECENT_ACTIVITY = 10
+FORECAST_ACCURACY = 92.5
+
+
+def low_stock(scope):
+    return scope_queryset(Inventory.objects.filter(Q(quantity__lt=LOW_STOCK_THRESHOLD) | Q(status='low_stock')), scope, 'location')
+
+
+def in_transit(scope):
+    return scope_queryset(Inventory.objects.filter(status='in_transit'), scope, 'location')
+
+
+def recent_activity(scope):
+    """The latest movements touching the scope, newest first."""
+    movements = scope_queryset(StockMovement.objects.all(), scope, 'inventory__location', 'from_location', 'to_location')
+    return movements.order_by('-created_at').values(
+        'created_at', 'movement_type', 'quantity_change',
+        medicine=F('inventory__batch__medicine__name'),
+        to_location_name=F('to_location__name'),
+        from_location_name=F('from_location__name'),
+    )[:RECENT_ACTIVITY]
+
+
+def activity_row(row):
+    return {
+        'timestamp': row['created_at'].strftime('%Y-%m-%d %H:%M'),
+        'event': row['movement_type'].replace('_', ' ').title(),
+        'medicine': row['medicine'] or 'N/A',
+        'details': f"{abs(row['quantity_change'])} units",
+        'location': row['to_location_name'] or row['from_location_name'],
+    }
+
+
+def stats(medicines, low_stock_count, in_transit_count, activity):
+    return {
+        'medicines_in_system': medicines,
+        'low_stock_alerts': low_stock_count,
+        'items_in_transit': in_transit_count,
+        'forecast_accuracy': FORECAST_ACCURACY,
+        'recent_activity': [activity_row(row) for row in activity],
+    }
+
+
+def low_stock_alerts(scope):
+    """Low stock lines, emptiest first."""
+    return low_stock(scope).order_by('quantity', 'id').values(
+        'status',
+        medicine=F('batch__medicine__name'),
+        location_name=F('location__name'),
+        current_stock=F('quantity'),
+        batch_number=F('batch__batch_number'),
+    )
+
+
+def alert_row(row):
+    row['location'] = row.pop('location_name')
+    return row
+
+
+def expiring(scope, today, days=EXPIRING_DAYS):
+    """Stocked lines whose batch expires within `days` of `today`, soonest first."""
+    return scope_queryset(Inventory.objects.all(), scope, 'location').filter(
+        batch__expiry_date__range=(today, today + timedelta(days=days)), quantity__gt=0
+    ).order_by('batch__expiry_date', 'id').values(
+        'id',
+        'quantity',
+        medicine=F('batch__medicine__name'),
+        batch_number=F('batch__batch_number'),
+        location_name=F('location__name'),
+        expiry_date=F('batch__expiry_date'),
+    )
+
+
+def expiring_row(row, today):
+    days_left = (row['expiry_date'] - today).days
+    row['location'] = row.pop('location_name')
+    row['days_left'] = days_left
+    row['status'] = 'critical' if days_left < CRITICAL_DAYS else 'warning'
+    return row
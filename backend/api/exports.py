@@ -0,0 +1,206 @@
+"""
+Streaming table exports.
+
+`stream_export()` turns a `ValuesSerializer` query into CSV, Parquet or an
+Arrow IPC stream, yielding bytes chunk by chunk. Rows are read with keyset
+pagination on the primary key, so memory stays bounded by the chunk size
+whatever the table size or database backend, and every chunk is one
+indexed range query. Parquet and Arrow need the optional `pyarrow` package.
+
+`TABLES` lists the exportable tables with the query parameters that select
+a slice of each; the viewset `export` actions and the `export_table`
+management command both go through it.
+"""
+import csv
+import io
+
+from django.core.exceptions import ValidationError
+from django.conf import settings
+
+from .fast_serializers import InventoryValuesSerializer, StockMovementValuesSerializer, DemandForecastValuesSerializer
+from .models import Inventory, StockMovement, DemandForecast
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = None
+
+DEFAULT_CHUNK_SIZE = 5000
+MAX_CHUNK_SIZE = 50000
+
+# format: (content type, file extension)
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+
+def available_formats():
+    return [name for name in FORMATS if name == 'csv' or pa is not None]
+
+
+class ExportTable:
+    def __init__(self, model, serializer_class, filters):
+        self.model = model
+        self.serializer_class = serializer_class
+        self.filters = filters
+
+    def values_queryset(self, params, queryset=None):
+        """
+        The values query for the slice `params` selects; `?fields=` and
+        `?exclude=` narrow the columns. Raises ValueError for bad filters.
+        """
+        queryset = self.model.objects.all() if queryset is None else queryset
+        lookups = {self.filters[name]: value for name, value in params.items() if name in self.filters and value != ''}
+        try:
+            queryset = queryset.filter(**lookups)
+        except ValidationError as exc:
+            raise ValueError(f"Invalid filter value: {' '.join(exc.messages)}")
+        except ValueError as exc:
+            raise ValueError(f"Invalid filter value: {exc}")
+        return self.serializer_class(queryset, params).get_values_queryset()
+
+
+TABLES = {
+    'inventory': ExportTable(Inventory, InventoryValuesSerializer, {
+        'medicine': 'batch__medicine_id',
+        'location': 'location_id',
+        'status': 'status',
+        'since': 'last_updated__date__gte',
+        'until': 'last_updated__date__lte',
+    }),
+    'stock-movements': ExportTable(StockMovement, StockMovementValuesSerializer, {
+        'medicine': 'inventory__batch__medicine_id',
+        'location': 'inventory__location_id',
+        'movement_type': 'movement_type',
+        'since': 'created_at__date__gte',
+        'until': 'created_at__date__lte',
+    }),
+    'demand-forecasts': ExportTable(DemandForecast, DemandForecastValuesSerializer, {
+        'medicine': 'medicine_id',
+        'location': 'location_id',
+        'since': 'forecast_date__gte',
+        'until': 'forecast_date__lte',
+    }),
+}
+
+
+def columns_of(values_queryset):
+    return [*values_queryset.query.values_select, *values_queryset.query.annotation_select]
+
+
+def iter_chunks(values_queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield lists of row tuples in primary key order, `chunk_size` at a time."""
+    rows = values_queryset.values_list('pk', *columns_of(values_queryset)).order_by('pk')
+    last = None
+    while True:
+        page = rows if last is None else rows.filter(pk__gt=last)
+        chunk = list(page[:chunk_size])
+        if not chunk:
+            return
+        last = chunk[-1][0]
+        yield [row[1:] for row in chunk]
+        if len(chunk) < chunk_size:
+            return
+
+
+def _output_field(values_queryset, name):
+    annotation = values_queryset.query.annotation_select.get(name)
+    if annotation is not None:
+        return annotation.output_field
+    field = values_queryset.model._meta.get_field(name)
+    return field.target_field if field.is_relation else field
+
+
+def arrow_schema(values_queryset):
+    types = {
+        'AutoField': pa.int64(), 'BigAutoField': pa.int64(), 'IntegerField': pa.int64(),
+        'BigIntegerField': pa.int64(), 'PositiveIntegerField': pa.int64(), 'SmallIntegerField': pa.int64(),
+        'FloatField': pa.float64(), 'BooleanField': pa.bool_(), 'DateField': pa.date32(),
+        'DateTimeField': pa.timestamp('us', tz='UTC' if settings.USE_TZ else None),
+    }
+    fields = []
+    for name in columns_of(values_queryset):
+        field = _output_field(values_queryset, name)
+        internal_type = field.get_internal_type()
+        if internal_type == 'DecimalField':
+            arrow_type = pa.decimal128(field.max_digits, field.decimal_places)
+        else:
+            arrow_type = types.get(internal_type, pa.string())
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+class _ChunkSink:
+    """Write-only file object whose contents are drained after each chunk."""
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def _stream_csv(values_queryset, chunk_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns_of(values_queryset))
+    for chunk in iter_chunks(values_queryset, chunk_size):
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _stream_arrow(values_queryset, chunk_size, file_format):
+    schema = arrow_schema(values_queryset)
+    sink = _ChunkSink()
+    target = pa.PythonFile(sink, mode='w')
+    if file_format == 'parquet':
+        writer = pq.ParquetWriter(target, schema)
+    else:
+        writer = pa.ipc.new_stream(target, schema)
+    try:
+        for chunk in iter_chunks(values_queryset, chunk_size):
+            # One row group / record batch per chunk.
+            arrays = [pa.array(column, type=field.type) for column, field in zip(zip(*chunk), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def stream_export(values_queryset, file_format='csv', chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the rows of `values_queryset` encoded as `file_format`, chunk by chunk."""
+    if file_format not in available_formats():
+        raise ValueError(f"file_format must be one of {', '.join(available_formats())}")
+    if file_format == 'csv':
+        return _stream_csv(values_queryset, chunk_size)
+    return _stream_arrow(values_queryset, chunk_size, file_format)
@@ -0,0 +1,142 @@
+"""
+Fast serialization path for the high-volume list endpoints.
+
+A `ValuesSerializer` describes the same output as a ModelSerializer, but as a
+`values()` query: related names are joined in SQL and computed fields such as
+days-to-expiry are evaluated by the database, so each row arrives as a plain
+dict that goes straight to the renderer without per-object field machinery.
+"""
+from django.db.models import DateField, F, Func, IntegerField, Value
+from django.utils import timezone
+
+from .serializers import sparse_field_names
+
+
+class DaysUntil(Func):
+    """Whole days from `today` until a date column, computed in SQL."""
+    template = '(%(expressions)s)'
+    arg_joiner = ' - '
+    output_field = IntegerField()
+
+    def __init__(self, expression, today, **extra):
+        super().__init__(expression, Value(today, output_field=DateField()), **extra)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='CAST(julianday(%(expressions)s) AS INTEGER)',
+            arg_joiner=') - julianday(',
+            **extra_context
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function='DATEDIFF', template='%(function)s(%(expressions)s)', arg_joiner=', ', **extra_context)
+
+
+class PaginatedValues:
+    """
+    Sliceable `values()` rows whose `count()` runs on the base queryset.
+
+    The joins added for related names never change the row count, but they
+    make COUNT(*) on large tables much slower, so pagination counts the
+    unjoined queryset instead.
+    """
+
+    def __init__(self, base_queryset, rows):
+        self.base_queryset = base_queryset
+        self.rows = rows
+
+    @property
+    def ordered(self):
+        return self.rows.ordered
+
+    def count(self):
+        return self.base_queryset.count()
+
+    def __getitem__(self, key):
+        return self.rows[key]
+
+
+class ValuesSerializer:
+    """
+    Serialize a queryset through `values()`.
+
+    `fields` lists model columns returned as-is (foreign keys come back as
+    ids, like PrimaryKeyRelatedField); `get_expressions()` returns the
+    computed and related fields. Output keys match the ModelSerializer the
+    subclass mirrors, and `?fields=`/`?exclude=` are honoured.
+    """
+    fields = ()
+
+    def __init__(self, queryset, query_params=None):
+        self.queryset = queryset
+        self.query_params = query_params or {}
+        self.today = timezone.now().date()
+
+    def get_expressions(self):
+        return {}
+
+    def get_values_queryset(self):
+        expressions = self.get_expressions()
+        names = sparse_field_names([*self.fields, *expressions], self.query_params)
+        return self.queryset.values(
+            *[name for name in names if name in self.fields],
+            **{name: expressions[name] for name in names if name in expressions}
+        )
+
+    def get_paginatable(self):
+        return PaginatedValues(self.queryset, self.get_values_queryset())
+
+    @property
+    def data(self):
+        return list(self.get_values_queryset())
+
+
+class InventoryValuesSerializer(ValuesSerializer):
+    """Values-based equivalent of InventorySerializer."""
+    fields = ('id', 'quantity', 'status', 'last_updated', 'created_at', 'batch', 'location')
+
+    def get_expressions(self):
+        return {
+            'medicine_name': F('batch__medicine__name'),
+            'batch_number': F('batch__batch_number'),
+            'location_name': F('location__name'),
+            'expiry_date': F('batch__expiry_date'),
+            'days_to_expiry': DaysUntil('batch__expiry_date', self.today),
+        }
+
+
+class StockMovementValuesSerializer(ValuesSerializer):
+    """Values-based equivalent of StockMovementSerializer."""
+    fields = (
+        'id', 'movement_type', 'quantity_change', 'notes', 'created_at',
+        'inventory', 'from_location', 'to_location', 'created_by',
+    )
+
+    def get_expressions(self):
+        return {
+            'from_location_name': F('from_location__name'),
+            'to_location_name': F('to_location__name'),
+            'created_by_username': F('created_by__username'),
+            'medicine_name': F('inventory__batch__medicine__name'),
+        }
+
+
+class DemandForecastValuesSerializer(ValuesSerializer):
+    """Values-based equivalent of DemandForecastSerializer."""
+    fields = (
+        'id', 'forecast_date', 'predicted_demand', 'predicted_lower', 'predicted_upper',
+        'confidence_level', 'created_at', 'updated_at', 'medicine', 'location',
+    )
+
+    def get_expressions(self):
+        return {
+            'medicine_name': F('medicine__name'),
+            'location_name': F('location__name'),
+            'days_until_forecast': DaysUntil('forecast_date', self.today),
+        }
+
+
+class MedicineValuesSerializer(ValuesSerializer):
+    """Values-based equivalent of MedicineSerializer."""
+    fields = ('id', 'name', 'strength', 'created_at', 'updated_at')
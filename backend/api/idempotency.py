@@ -0,0 +1,147 @@
+"""
+Idempotency keys for write endpoints.
+
+A client that sends an `Idempotency-Key` header with a write request may
+retry it with the same key as often as it likes: the first request runs,
+its response is stored in `IdempotencyKey`, and every retry gets that
+stored response back (marked `Idempotent-Replayed: true`) without the
+handler running again. Keys are scoped per user and expire after
+`TTL_SECONDS`; expired rows are purged opportunistically.
+
+The handler's writes and the stored response commit in one transaction, so
+a response is only ever replayed for work that was actually applied. A
+request that fails with a server error or an exception releases its key so
+the retry runs normally. Reusing a key for a different request is rejected
+with 422, and a retry that arrives while the first attempt is still running
+gets 409.
+"""
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+DEFAULTS = {
+    'TTL_SECONDS': 24 * 3600,
+    # A key still unanswered after this long belongs to a request that died
+    # mid-flight; a retry may take it over.
+    'IN_PROGRESS_TIMEOUT_SECONDS': 60,
+    'PURGE_INTERVAL_SECONDS': 300,
+}
+
+_last_purge = 0.0
+
+
+def get_setting(name):
+    return getattr(settings, 'IDEMPOTENCY', {}).get(name, DEFAULTS[name])
+
+
+def fingerprint(request):
+    """Digest of the method, path and body, to spot a key reused for another request."""
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    body = json.dumps(data, sort_keys=True, default=str)
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (request.method, request.get_full_path(), body):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def purge_expired(force=False):
+    """Delete expired keys, at most once per purge interval unless forced."""
+    global _last_purge
+    now = time.monotonic()
+    if not force and now - _last_purge < get_setting('PURGE_INTERVAL_SECONDS'):
+        return 0
+    _last_purge = now
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
+
+
+def _claim(user, key, digest):
+    """
+    Return (record, error_response). A record with a status code is a
+    finished request to replay; one without is freshly claimed by us.
+    """
+    for _ in range(2):
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=user, key=key, fingerprint=digest,
+                    expires_at=now + timedelta(seconds=get_setting('TTL_SECONDS'))
+                )
+            return record, None
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if record is None:
+            continue
+        stale = record.status_code is None and record.created_at <= now - timedelta(seconds=get_setting('IN_PROGRESS_TIMEOUT_SECONDS'))
+        if record.expires_at <= now or stale:
+            # Only one retry wins the takeover; the others see it in progress.
+            IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+            continue
+        if record.fingerprint != digest:
+            return None, Response(
+                {'error': f'{HEADER} was already used for a different request'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        if record.status_code is None:
+            return None, Response(
+                {'error': f'A request with this {HEADER} is still in progress'},
+                status=status.HTTP_409_CONFLICT
+            )
+        return record, None
+    return None, Response({'error': f'Could not claim {HEADER}, please retry'}, status=status.HTTP_409_CONFLICT)
+
+
+def idempotent(handler):
+    """
+    Make a DRF view or viewset method honour the `Idempotency-Key` header.
+    Requests without the header run unchanged.
+    """
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        # Nested handlers (partial_update calls update) share the outer claim.
+        if not key or getattr(request, '_idempotency_claimed', False):
+            return handler(self, request, *args, **kwargs)
+        if len(key) > 255 or not request.user.is_authenticated:
+            return Response({'error': f'{HEADER} must be at most 255 characters and needs an authenticated user'}, status=status.HTTP_400_BAD_REQUEST)
+
+        purge_expired()
+        record, error = _claim(request.user, key, fingerprint(request))
+        if error is not None:
+            return error
+        if record.status_code is not None:
+            return Response(record.response_body, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+        request._idempotency_claimed = True
+        try:
+            with transaction.atomic():
+                response = handler(self, request, *args, **kwargs)
+                if response.status_code < 500:
+                    record.status_code = response.status_code
+                    record.response_body = getattr(response, 'data', None)
+                    record.save(update_fields=['status_code', 'response_body'])
+        except BaseException:
+            record.delete()
+            raise
+        finally:
+            request._idempotency_claimed = False
+        if response.status_code >= 500:
+            record.delete()
+        return response
+    return wrapper
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.archive import archivable_months, archive_month, get_setting
+
+
+class Command(BaseCommand):
+    help = (
+        "Move stock movements from months wholly older than the archive horizon into "
+        "per-month shard files. Rollups keep covering archived months, and "
+        "movement_history?include_archived=true reads them back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horizon-days', type=int, help=f"Keep this many days online (default: {get_setting('HORIZON_DAYS')})")
+        parser.add_argument('--chunk-size', type=int, default=get_setting('CHUNK_SIZE'))
+        parser.add_argument('--dry-run', action='store_true', help='List the months that would be archived')
+
+    def handle(self, *args, **options):
+        if options['horizon_days'] is not None and options['horizon_days'] < 0:
+            raise CommandError("--horizon-days must not be negative")
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive")
+
+        months = archivable_months(options['horizon_days'])
+        if options['dry_run']:
+            for month in months:
+                self.stdout.write(f"{month:%Y-%m}")
+            return
+
+        started = time.perf_counter()
+        total = 0
+        for month in months:
+            moved = archive_month(month, options['chunk_size'])
+            total += moved
+            self.stdout.write(f"{month:%Y-%m}: {moved} movements")
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {total} movements from {len(months)} months in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,75 @@
+import asyncio
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, AsyncClient
+from django.test.utils import override_settings
+
+ENDPOINTS = [
+    ('dashboard_stats', '/api/inventory/dashboard_stats/', '/api/async/inventory/dashboard_stats/'),
+    ('low_stock_alerts', '/api/inventory/low_stock_alerts/', '/api/async/inventory/low_stock_alerts/'),
+    ('expiring_soon', '/api/demand-forecasts/expiring_soon/', '/api/async/demand-forecasts/expiring_soon/'),
+    ('search', '/api/demand-forecasts/search/?q=a', '/api/async/demand-forecasts/search/?q=a'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare in-process throughput of the synchronous DRF endpoints under the WSGI "
+        "handler with their async variants under the ASGI handler."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint and mode')
+        parser.add_argument('--concurrency', type=int, default=16)
+
+    def handle(self, *args, **options):
+        # Staff are exempt from the request throttle (api.throttling).
+        user = User.objects.create(username=f'bench-{uuid.uuid4().hex[:8]}', is_staff=True)
+        try:
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                self.stdout.write(f"{'endpoint':<20}{'WSGI req/s':>14}{'ASGI req/s':>14}{'speedup':>10}")
+                for name, sync_path, async_path in ENDPOINTS:
+                    wsgi_rate = self._bench_wsgi(user, sync_path, options['requests'], options['concurrency'])
+                    asgi_rate = asyncio.run(
+                        self._bench_asgi(user, async_path, options['requests'], options['concurrency'])
+                    )
+                    self.stdout.write(f"{name:<20}{wsgi_rate:>14.1f}{asgi_rate:>14.1f}{asgi_rate / wsgi_rate:>9.2f}x")
+        finally:
+            user.delete()
+
+    def _bench_wsgi(self, user, path, total, concurrency):
+        def worker(count):
+            client = Client()
+            client.force_login(user)
+            try:
+                for _ in range(count):
+                    response = client.get(path)
+                    assert response.status_code == 200, response.content[:200]
+            finally:
+                connection.close()
+
+        counts = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(worker, counts))
+        return total / (time.perf_counter() - started)
+
+    async def _bench_asgi(self, user, path, total, concurrency):
+        client = AsyncClient()
+        await client.aforce_login(user)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                response = await client.get(path)
+                assert response.status_code == 200, response.content[:200]
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        return total / (time.perf_counter() - started)
@@ -0,0 +1,83 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from api.fast_serializers import InventoryValuesSerializer, StockMovementValuesSerializer
+from api.models import Medicine, Manufacturer, ProductionBatch, Location, Inventory, StockMovement
+from api.serializers import InventorySerializer, StockMovementSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare per-row serialization cost of the ModelSerializers with the values()-based "
+        "fast path. Fixture rows are created inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._create_fixture(options['rows'])
+            cases = [
+                ('inventory', InventorySerializer, InventoryValuesSerializer,
+                 Inventory.objects.select_related('batch__medicine', 'location')),
+                ('stock-movements', StockMovementSerializer, StockMovementValuesSerializer,
+                 StockMovement.objects.select_related('inventory__batch__medicine', 'from_location', 'to_location', 'created_by')),
+            ]
+            renderer = JSONRenderer()
+            self.stdout.write(f"{'endpoint':<18}{'rows':>8}{'serializer us/row':>20}{'fast us/row':>14}{'speedup':>10}")
+            for name, serializer_class, fast_class, queryset in cases:
+                rows = queryset.count()
+                slow = self._best_of(options['repeat'], lambda: renderer.render(serializer_class(queryset.all(), many=True).data))
+                fast = self._best_of(options['repeat'], lambda: renderer.render(fast_class(queryset.all()).data))
+                self.stdout.write(
+                    f"{name:<18}{rows:>8}{slow / rows * 1e6:>20.1f}{fast / rows * 1e6:>14.1f}{slow / fast:>9.1f}x"
+                )
+            transaction.set_rollback(True)
+
+    def _best_of(self, repeat, func):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    def _create_fixture(self, rows):
+        user = User.objects.create(username='bench-serializers')
+        manufacturer = Manufacturer.objects.create(name='Bench Manufacturer')
+        medicines = Medicine.objects.bulk_create([Medicine(name=f'Bench Medicine {i}', strength='250mg') for i in range(50)])
+        locations = Location.objects.bulk_create([Location(name=f'Bench Site {i}', location_type='pharmacy') for i in range(50)])
+        today = timezone.now().date()
+        batches = ProductionBatch.objects.bulk_create([
+            ProductionBatch(
+                medicine=medicines[i % len(medicines)],
+                batch_number=f'BENCH-SER-{i}',
+                manufacturer=manufacturer,
+                production_date=today,
+                expiry_date=today + timedelta(days=30 + i % 300),
+                quantity=1000,
+            )
+            for i in range(rows // len(locations) + 1)
+        ])
+        inventories = Inventory.objects.bulk_create([
+            Inventory(batch=batches[i // len(locations)], location=locations[i % len(locations)], quantity=100)
+            for i in range(rows)
+        ])
+        StockMovement.objects.bulk_create([
+            StockMovement(
+                inventory=inventory,
+                movement_type='distribution',
+                quantity_change=-1,
+                from_location=inventory.location,
+                created_by=user,
+            )
+            for inventory in inventories
+        ])
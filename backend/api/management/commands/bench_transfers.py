@@ -0,0 +1,127 @@
+import random
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from django.db.models import Sum
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.models import Medicine, Manufacturer, ProductionBatch, Location, Inventory
+
+
+class Command(BaseCommand):
+    help = "Hammer the transfer_stock endpoint from many threads and report throughput and lock errors."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--transfers', type=int, default=200, help='Transfers per thread')
+        parser.add_argument('--locations', type=int, default=10)
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark fixtures afterwards')
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        user, manufacturer, medicine, batch, locations = self._setup(run_id, options['locations'])
+        self.stdout.write(
+            f"Backend: {connection.vendor} | threads={options['threads']} "
+            f"transfers/thread={options['transfers']} locations={len(locations)}"
+        )
+
+        counters = {'ok': 0, 'rejected': 0, 'locked': 0, 'failed': 0}
+        latencies = []
+        lock = threading.Lock()
+
+        def worker():
+            # runserver-style host so the default DEBUG ALLOWED_HOSTS accept it.
+            client = APIClient(SERVER_NAME='localhost')
+            client.force_authenticate(user=user)
+            local = {key: 0 for key in counters}
+            local_latencies = []
+            try:
+                for _ in range(options['transfers']):
+                    source, dest = random.sample(locations, 2)
+                    started = time.perf_counter()
+                    response = client.post('/api/stock-movements/transfer_stock/', {
+                        'from_location': source.id,
+                        'to_location': dest.id,
+                        'batch': batch.id,
+                        'quantity': random.randint(1, 5),
+                    }, format='json')
+                    local_latencies.append(time.perf_counter() - started)
+                    error = str((getattr(response, 'data', None) or {}).get('error', ''))
+                    if response.status_code == 200:
+                        local['ok'] += 1
+                    elif 'locked' in error or 'deadlock' in error:
+                        local['locked'] += 1
+                    elif response.status_code == 400 and error == 'Not enough stock available':
+                        local['rejected'] += 1
+                    else:
+                        local['failed'] += 1
+            finally:
+                close_old_connections()
+                connection.close()
+            with lock:
+                for key, value in local.items():
+                    counters[key] += value
+                latencies.extend(local_latencies)
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        total = sum(counters.values())
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] if latencies else 0
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0
+        expected = options['locations'] * 10000
+        actual = Inventory.objects.filter(batch=batch).aggregate(total=Sum('quantity'))['total']
+
+        self.stdout.write(f"Requests:        {total} in {elapsed:.2f}s ({total / elapsed:.1f} req/s)")
+        self.stdout.write(f"Succeeded:       {counters['ok']}")
+        self.stdout.write(f"Rejected (qty):  {counters['rejected']}")
+        self.stdout.write(f"Lock errors:     {counters['locked']}")
+        self.stdout.write(f"Other failures:  {counters['failed']}")
+        self.stdout.write(f"Latency p50/p99: {p50 * 1000:.1f}ms / {p99 * 1000:.1f}ms")
+        if actual == expected:
+            self.stdout.write(self.style.SUCCESS(f"Stock conserved: {actual} units"))
+        else:
+            self.stdout.write(self.style.ERROR(f"Stock drift: expected {expected}, found {actual}"))
+
+        if not options['keep']:
+            batch.delete()
+            medicine.delete()
+            manufacturer.delete()
+            Location.objects.filter(pk__in=[location.pk for location in locations]).delete()
+            user.delete()
+
+    def _setup(self, run_id, location_count):
+        # Staff are exempt from the request throttle (api.throttling).
+        user = User.objects.create(username=f'bench-{run_id}', is_staff=True)
+        manufacturer = Manufacturer.objects.create(name=f'Bench Manufacturer {run_id}')
+        medicine = Medicine.objects.create(name=f'Bench Medicine {run_id}', strength='500mg')
+        today = timezone.now().date()
+        batch = ProductionBatch.objects.create(
+            medicine=medicine,
+            batch_number=f'BENCH-{run_id}',
+            manufacturer=manufacturer,
+            production_date=today,
+            expiry_date=today + timedelta(days=365),
+            quantity=location_count * 10000,
+        )
+        locations = Location.objects.bulk_create([
+            Location(name=f'Bench Site {run_id}-{i}', location_type='pharmacy')
+            for i in range(location_count)
+        ])
+        Inventory.objects.bulk_create([
+            Inventory(batch=batch, location=location, quantity=10000)
+            for location in locations
+        ])
+        return user, manufacturer, medicine, batch, locations
@@ -0,0 +1,59 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.exports import TABLES, DEFAULT_CHUNK_SIZE, available_formats, stream_export
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream a whole table, or a filtered slice of it, to a CSV, Parquet or Arrow file "
+        "without loading it into memory. Parquet and Arrow need pyarrow."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', choices=sorted(TABLES))
+        parser.add_argument('--format', dest='file_format', default='csv', help="csv, parquet or arrow (default: csv)")
+        parser.add_argument('--output', '-o', help='File to write; defaults to stdout')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument(
+            '--filter', action='append', default=[], metavar='NAME=VALUE',
+            help='Slice the table, e.g. since=2025-01-01 or medicine=3 (repeatable)'
+        )
+        parser.add_argument('--fields', help='Comma-separated columns to export')
+
+    def handle(self, *args, **options):
+        table = TABLES[options['table']]
+        if options['file_format'] not in available_formats():
+            raise CommandError(f"--format must be one of {', '.join(available_formats())}")
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive")
+        params = {}
+        for item in options['filter']:
+            name, sep, value = item.partition('=')
+            if not sep or name not in table.filters:
+                raise CommandError(f"Invalid filter {item!r}; expected one of {', '.join(table.filters)} as NAME=VALUE")
+            params[name] = value
+        if options['fields']:
+            params['fields'] = options['fields']
+
+        try:
+            rows = table.values_queryset(params)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        started = time.perf_counter()
+        written = 0
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for data in stream_export(rows, options['file_format'], options['chunk_size']):
+                output.write(data)
+                written += len(data)
+        finally:
+            if options['output']:
+                output.close()
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Wrote {written} bytes to {options['output']} in {time.perf_counter() - started:.1f}s"
+            ))
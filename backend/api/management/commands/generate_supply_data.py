@@ -0,0 +1,248 @@
+import math
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import (
+    Medicine, Manufacturer, ProductionBatch, Location, LocationEdge, Inventory, StockMovement,
+    ResupplyRequest, DemandForecast, UserProfile,
+)
+from api.rollups import rebuild
+
+PREFIX = 'SYN'
+
+GENERICS = [
+    'Paracetamol', 'Amoxicillin', 'Metformin', 'Atorvastatin', 'Amlodipine', 'Omeprazole',
+    'Azithromycin', 'Ciprofloxacin', 'Ibuprofen', 'Losartan', 'Salbutamol', 'Insulin Glargine',
+    'Levothyroxine', 'Cetirizine', 'Doxycycline', 'Ceftriaxone', 'Pantoprazole', 'Clopidogrel',
+    'Metronidazole', 'Prednisolone', 'Diclofenac', 'Ondansetron', 'Furosemide', 'Warfarin',
+]
+STRENGTHS = ['5mg', '10mg', '20mg', '40mg', '100mg', '250mg', '500mg', '1g']
+LOCATION_MIX = [('warehouse', 0.05), ('hospital', 0.15), ('cold_storage', 0.05), ('pharmacy', 0.75)]
+MOVEMENT_MIX = [('distribution', 0.80), ('transfer', 0.12), ('adjustment', 0.06), ('disposal', 0.02)]
+
+
+@contextmanager
+def backdated(model, field_name):
+    """Let bulk inserts set an auto_now_add field explicitly."""
+    field = model._meta.get_field(field_name)
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def weighted(rng, mix):
+    return rng.choices([value for value, _ in mix], weights=[weight for _, weight in mix])[0]
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a reproducible synthetic supply-chain dataset with bulk inserts. "
+        "All generated names carry the SYN- prefix so --clear can remove them again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--medicines', type=int, default=500)
+        parser.add_argument('--manufacturers', type=int, default=20)
+        parser.add_argument('--locations', type=int, default=200)
+        parser.add_argument('--edges-per-location', type=int, default=3, help='Road links from each location to its nearest neighbours')
+        parser.add_argument('--batches', type=int, default=5000)
+        parser.add_argument('--stock-per-batch', type=int, default=4, help='Locations stocking each batch')
+        parser.add_argument('--movements', type=int, default=1000000)
+        parser.add_argument('--history-days', type=int, default=365)
+        parser.add_argument('--forecast-days', type=int, default=14)
+        parser.add_argument('--resupply-requests', type=int, default=1000)
+        parser.add_argument('--chunk-size', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--clear', action='store_true', help='Delete previously generated data first')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.chunk_size = options['chunk_size']
+        self.now = timezone.now()
+        self.today = self.now.date()
+
+        if options['clear']:
+            self._clear()
+
+        started = time.perf_counter()
+        with transaction.atomic():
+            user = self._user()
+            manufacturers = self._timed('manufacturers', self._manufacturers, options['manufacturers'])
+            medicines = self._timed('medicines', self._medicines, options['medicines'])
+            locations = self._timed('locations', self._locations, options['locations'])
+            self._timed('location edges', self._edges, locations, options['edges_per_location'])
+            batches = self._timed('batches', self._batches, options['batches'], medicines, manufacturers)
+            inventory = self._timed('inventory', self._inventory, batches, locations, options['stock_per_batch'])
+            self._timed('forecasts', self._forecasts, inventory, options['forecast_days'])
+            self._timed('resupply requests', self._resupply, options['resupply_requests'], medicines, locations, user)
+        # Movements are committed chunk by chunk so millions of rows never sit
+        # in one transaction or in memory at once.
+        self._timed('stock movements', self._movements, options['movements'], inventory, locations, user, options['history_days'])
+        # Backdated bulk inserts bypass the incremental rollup path.
+        self._timed('rollups', rebuild)
+        self.stdout.write(self.style.SUCCESS(f"Done in {time.perf_counter() - started:.1f}s"))
+
+    def _timed(self, label, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        count = result if isinstance(result, int) else len(result)
+        self.stdout.write(f"  {label:<18}{count:>10} rows  {time.perf_counter() - started:7.2f}s")
+        return result
+
+    def _clear(self):
+        with transaction.atomic():
+            Medicine.objects.filter(name__startswith=f'{PREFIX}-').delete()
+            Manufacturer.objects.filter(name__startswith=f'{PREFIX}-').delete()
+            Location.objects.filter(name__startswith=f'{PREFIX}-').delete()
+            User.objects.filter(username=f'{PREFIX.lower()}-generator').delete()
+        self.stdout.write("Cleared previous synthetic data")
+
+    def _user(self):
+        user, created = User.objects.get_or_create(username=f'{PREFIX.lower()}-generator')
+        if created:
+            UserProfile.objects.create(user=user, role='stockist', organization=f'{PREFIX} Distribution')
+        return user
+
+    def _manufacturers(self, count):
+        return Manufacturer.objects.bulk_create([
+            Manufacturer(name=f'{PREFIX}-Pharma {i:03d}', contact_info=f'orders{i}@example.com')
+            for i in range(count)
+        ], batch_size=self.chunk_size)
+
+    def _medicines(self, count):
+        return Medicine.objects.bulk_create([
+            Medicine(
+                name=f'{PREFIX}-{GENERICS[i % len(GENERICS)]} {i // len(GENERICS):03d}',
+                strength=self.rng.choice(STRENGTHS)
+            )
+            for i in range(count)
+        ], batch_size=self.chunk_size)
+
+    def _locations(self, count):
+        locations = []
+        for i in range(count):
+            location_type = weighted(self.rng, LOCATION_MIX)
+            locations.append(Location(
+                name=f'{PREFIX}-{location_type.replace("_", " ").title()} {i:05d}',
+                location_type=location_type,
+                address=f'{self.rng.randint(1, 999)} Supply Road, District {self.rng.randint(1, 60)}'
+            ))
+        return Location.objects.bulk_create(locations, batch_size=self.chunk_size)
+
+    def _edges(self, locations, per_location):
+        # Scatter sites over a 600km square; sorting by x keeps the neighbour
+        # search to a sliding window instead of all pairs.
+        points = sorted(
+            ((self.rng.uniform(0, 600), self.rng.uniform(0, 600), location) for location in locations),
+            key=lambda point: point[0]
+        )
+        pairs = set()
+        for index, (x, y, location) in enumerate(points):
+            window = points[index + 1:index + 1 + per_location * 8]
+            nearest = sorted(window, key=lambda other: math.hypot(other[0] - x, other[1] - y))[:per_location]
+            for other_x, other_y, other in nearest:
+                pairs.add((location, other, math.hypot(other_x - x, other_y - y)))
+        return LocationEdge.objects.bulk_create([
+            LocationEdge(
+                from_location=a, to_location=b,
+                transit_hours=round(km / 60 + 0.5, 2),
+                cost=round(km * 0.8 + 20, 2)
+            )
+            for a, b, km in pairs
+        ], batch_size=self.chunk_size)
+
+    def _batches(self, count, medicines, manufacturers):
+        batches = []
+        for i in range(count):
+            produced = self.today - timedelta(days=self.rng.randint(0, 720))
+            batches.append(ProductionBatch(
+                medicine=self.rng.choice(medicines),
+                batch_number=f'{PREFIX}-{i:08d}',
+                manufacturer=self.rng.choice(manufacturers),
+                production_date=produced,
+                expiry_date=produced + timedelta(days=self.rng.choice([365, 540, 730, 1095])),
+                quantity=self.rng.choice([500, 1000, 2000, 5000, 10000]),
+            ))
+        return ProductionBatch.objects.bulk_create(batches, batch_size=self.chunk_size)
+
+    def _inventory(self, batches, locations, per_batch):
+        rows = []
+        for batch in batches:
+            for location in self.rng.sample(locations, min(per_batch, len(locations))):
+                quantity = self.rng.randint(0, batch.quantity // per_batch)
+                if batch.expiry_date < self.today:
+                    status = 'expired'
+                elif quantity < 100:
+                    status = 'low_stock'
+                else:
+                    status = weighted(self.rng, [('available', 0.9), ('in_transit', 0.05), ('awaiting_distribution', 0.05)])
+                rows.append(Inventory(batch=batch, location=location, quantity=quantity, status=status))
+        return Inventory.objects.bulk_create(rows, batch_size=self.chunk_size)
+
+    def _forecasts(self, inventory, days):
+        pairs = {(item.batch.medicine_id, item.location_id) for item in inventory}
+        rows = []
+        for medicine_id, location_id in pairs:
+            base = self.rng.randint(1, 60)
+            for offset in range(1, days + 1):
+                rows.append(DemandForecast(
+                    medicine_id=medicine_id,
+                    location_id=location_id,
+                    forecast_date=self.today + timedelta(days=offset),
+                    predicted_demand=max(0, int(self.rng.gauss(base, base * 0.2))),
+                    confidence_level=0.95,
+                ))
+        DemandForecast.objects.bulk_create(rows, batch_size=self.chunk_size, ignore_conflicts=True)
+        return len(rows)
+
+    def _resupply(self, count, medicines, locations, user):
+        return ResupplyRequest.objects.bulk_create([
+            ResupplyRequest(
+                medicine=self.rng.choice(medicines),
+                requesting_location=self.rng.choice(locations),
+                requested_quantity=self.rng.choice([50, 100, 200, 500]),
+                urgency=weighted(self.rng, [('low', 0.2), ('normal', 0.5), ('high', 0.2), ('critical', 0.1)]),
+                status=weighted(self.rng, [('pending', 0.4), ('approved', 0.2), ('in_progress', 0.1), ('completed', 0.25), ('rejected', 0.05)]),
+                requested_by=user,
+            )
+            for _ in range(count)
+        ], batch_size=self.chunk_size)
+
+    def _movements(self, count, inventory, locations, user, history_days):
+        history_seconds = history_days * 86400
+        written = 0
+        with backdated(StockMovement, 'created_at'):
+            while written < count:
+                chunk = []
+                for _ in range(min(self.chunk_size, count - written)):
+                    item = self.rng.choice(inventory)
+                    movement_type = weighted(self.rng, MOVEMENT_MIX)
+                    created_at = self.now - timedelta(seconds=self.rng.randint(0, history_seconds))
+                    # Busier on weekdays, like real dispensing.
+                    quantity = self.rng.randint(1, 40 if created_at.weekday() < 5 else 15)
+                    movement = StockMovement(
+                        inventory=item,
+                        movement_type=movement_type,
+                        quantity_change=-quantity,
+                        from_location_id=item.location_id,
+                        created_at=created_at,
+                        created_by=user,
+                    )
+                    if movement_type == 'transfer':
+                        movement.to_location = self.rng.choice(locations)
+                    elif movement_type == 'adjustment':
+                        movement.quantity_change = self.rng.randint(-10, 10) or 1
+                    chunk.append(movement)
+                with transaction.atomic():
+                    StockMovement.objects.bulk_create(chunk, batch_size=self.chunk_size)
+                written += len(chunk)
+        return written
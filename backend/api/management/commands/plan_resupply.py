@@ -0,0 +1,29 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api.resupply import plan_resupply
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or merge resupply requests for every (medicine, location) whose projected "
+        "stock over the lead time falls short of forecast demand. Runs are incremental "
+        "within a day unless --full is given; schedule it from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='Username recorded as requested_by')
+        parser.add_argument('--lead-time-days', type=int, default=7)
+        parser.add_argument('--safety-ratio', type=float, default=0.25)
+        parser.add_argument('--full', action='store_true', help='Re-plan every series, not only changed ones')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['user']}")
+        run = plan_resupply(user, options['lead_time_days'], options['safety_ratio'], options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Full' if run.full else 'Incremental'} run: {run.series_checked} series checked, "
+            f"{run.created_count} requests created, {run.merged_count} merged"
+        ))
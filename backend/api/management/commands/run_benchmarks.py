@@ -0,0 +1,311 @@
+import itertools
+import json
+import secrets
+import statistics
+import subprocess
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.models import Medicine, Manufacturer, ProductionBatch, Location, LocationEdge, Inventory, StockMovement, ResupplyRequest, DemandForecast, DemandAnomaly
+
+FORECAST_CSV = "date,demand\n" + "\n".join(f"2025-01-{day:02d},{20 + day % 7}" for day in range(1, 29))
+
+
+def build_cases(fixture):
+    """
+    Benchmark cases keyed by URL name. Write cases run inside a transaction
+    that is rolled back after every request, so the dataset stays unchanged.
+    """
+    batch, location, other_location = fixture['batch'], fixture['location'], fixture['other_location']
+    medicine, inventory = fixture['medicine'], fixture['inventory']
+    new_batch = {
+        'batch_number': 'BENCH-NEW', 'medicine': medicine.id, 'manufacturer': batch.manufacturer_id,
+        'production_date': '2025-01-01', 'expiry_date': '2027-01-01', 'quantity': 100,
+        'initial_location': location.id,
+    }
+    cases = []
+    for prefix, model, key in [
+        ('medicine', Medicine, 'medicine'), ('manufacturer', Manufacturer, 'manufacturer'),
+        ('productionbatch', ProductionBatch, 'batch'), ('location', Location, 'location'),
+        ('locationedge', LocationEdge, 'edge'),
+        ('inventory', Inventory, 'inventory'), ('resupplyrequest', ResupplyRequest, 'resupply'),
+        ('stockmovement', StockMovement, 'movement'), ('demandforecast', DemandForecast, 'forecast'),
+        ('demandanomaly', DemandAnomaly, 'anomaly'),
+    ]:
+        cases.append({'name': f'{prefix}-list', 'method': 'get', 'path': f'{model_path(model)}'})
+        if fixture.get(key) is not None:
+            cases.append({'name': f'{prefix}-detail', 'method': 'get', 'path': f'{model_path(model)}{fixture[key].id}/'})
+    for prefix, path, key, row in [
+        ('medicine', '/api/medicines/', 'medicine', lambda i: {'name': f'Bench Medicine {i}', 'strength': '10mg'}),
+        ('manufacturer', '/api/manufacturers/', 'manufacturer', lambda i: {'name': f'Bench Manufacturer {i}'}),
+        ('location', '/api/locations/', 'location', lambda i: {'name': f'Bench Site {i}', 'location_type': 'pharmacy'}),
+        ('productionbatch', '/api/production-batches/', 'batch', lambda i: dict(new_batch, batch_number=f'BENCH-BULK-{i}')),
+    ]:
+        rows = [row(i) for i in range(500)]
+        cases += [
+            {'name': f'{prefix}-bulk-create', 'method': 'post', 'path': f'{path}bulk_create/', 'data': rows},
+            {'name': f'{prefix}-bulk-upsert', 'method': 'post', 'path': f'{path}bulk_upsert/', 'data': rows},
+            {'name': f'{prefix}-bulk-update', 'method': 'patch', 'path': f'{path}bulk_update/', 'data': [{'id': fixture[key].id}]},
+        ]
+    edges = [{'from_location': a, 'to_location': b, 'transit_hours': 2.5, 'cost': 40} for a, b in fixture['new_edges']]
+    cases += [
+        {'name': 'locationedge-bulk-create', 'method': 'post', 'path': '/api/location-edges/bulk_create/', 'data': edges},
+        {'name': 'locationedge-bulk-upsert', 'method': 'post', 'path': '/api/location-edges/bulk_upsert/', 'data': edges},
+    ]
+    if fixture['edge'] is not None:
+        cases.append({'name': 'locationedge-bulk-update', 'method': 'patch', 'path': '/api/location-edges/bulk_update/',
+                      'data': [{'id': fixture['edge'].id, 'transit_hours': 3}]})
+    cases += [
+        {'name': 'token_obtain_pair', 'method': 'post', 'path': '/api/auth/login/', 'anonymous': True,
+         'data': {'username': fixture['user'].username, 'password': fixture['password']}},
+        {'name': 'token_refresh', 'method': 'post', 'path': '/api/auth/refresh/', 'anonymous': True,
+         'data': {'refresh': fixture['refresh_token']}},
+        {'name': 'register', 'method': 'post', 'path': '/api/auth/register/', 'anonymous': True,
+         'data': {'username': 'bench-register', 'email': 'bench@example.com', 'password': fixture['password'],
+                  'password2': fixture['password'], 'profile': {'role': 'pharmacist'}}},
+        {'name': 'user-list', 'method': 'get', 'path': '/api/users/'},
+        {'name': 'user-me', 'method': 'get', 'path': '/api/users/me/'},
+        {'name': 'user-detail', 'method': 'get', 'path': f"/api/users/{fixture['user'].id}/"},
+        {'name': 'inventory-dashboard-stats', 'method': 'get', 'path': '/api/inventory/dashboard_stats/'},
+        {'name': 'inventory-low-stock-alerts', 'method': 'get', 'path': '/api/inventory/low_stock_alerts/'},
+        {'name': 'stockmovement-movement-history', 'method': 'get', 'path': f'/api/stock-movements/movement_history/?location={location.id}'},
+        {'name': 'demandforecast-search', 'method': 'get', 'path': f'/api/demand-forecasts/search/?q={medicine.name[:6]}'},
+        {'name': 'demandforecast-expiring-soon', 'method': 'get', 'path': '/api/demand-forecasts/expiring_soon/'},
+        {'name': 'demandforecast-waste-risk', 'method': 'get', 'path': '/api/demand-forecasts/waste_risk/'},
+        {'name': 'async_dashboard_stats', 'method': 'get', 'path': '/api/async/inventory/dashboard_stats/'},
+        {'name': 'async_low_stock_alerts', 'method': 'get', 'path': '/api/async/inventory/low_stock_alerts/'},
+        {'name': 'async_expiring_soon', 'method': 'get', 'path': '/api/async/demand-forecasts/expiring_soon/'},
+        {'name': 'async_search', 'method': 'get', 'path': f'/api/async/demand-forecasts/search/?q={medicine.name[:6]}'},
+        {'name': 'metrics', 'method': 'get', 'path': '/api/metrics/'},
+        {'name': 'stockmovement-transfer-stock', 'method': 'post', 'path': '/api/stock-movements/transfer_stock/',
+         'data': {'from_location': inventory.location_id, 'to_location': other_location.id, 'batch': inventory.batch_id, 'quantity': 1}},
+        {'name': 'inventory-update-stock', 'method': 'post', 'path': '/api/inventory/update_stock/',
+         'data': {'batch_number': inventory.batch.batch_number, 'location': inventory.location.name, 'quantity': inventory.quantity + 1}},
+        {'name': 'productionbatch-production-run', 'method': 'post', 'path': '/api/production-batches/production_run/',
+         'data': {'initial_location': location.id, 'batches': [dict(new_batch, batch_number=f'BENCH-RUN-{i}') for i in range(50)]}},
+        {'name': 'demandforecast-generate-forecast', 'method': 'post', 'path': '/api/demand-forecasts/generate_forecast/',
+         'data': {'historical_data': [{'medicine': medicine.name, 'region': location.name, 'demand': 40}],
+                  'current_stock': [{'pharmacy': location.name, 'medicine': medicine.name, 'stock': 10}]}},
+        {'name': 'demandforecast-redirection-suggestions', 'method': 'post', 'path': '/api/demand-forecasts/redirection_suggestions/',
+         'data': {'current_stock': {location.name: {medicine.name: 500}, other_location.name: {medicine.name: 10}},
+                  'demand_forecasts': {location.name: {medicine.name: 100}, other_location.name: {medicine.name: 100}}}},
+        {'name': 'resupplyrequest-plan', 'method': 'post', 'path': '/api/resupply-requests/plan/', 'data': {}},
+        {'name': 'demandforecast-rebalance', 'method': 'get', 'path': '/api/demand-forecasts/rebalance/'},
+        {'name': 'locationedge-route', 'method': 'get',
+         'path': f'/api/location-edges/route/?from={location.id}&to={fixture["route_target"].id}'},
+        {'name': 'stockmovement-consumption', 'method': 'get', 'path': f'/api/stock-movements/consumption/?period=week&medicine={medicine.id}'},
+        {'name': 'demandforecast-forecast-from-history', 'method': 'post', 'path': '/api/demand-forecasts/forecast_from_history/',
+         'slow': True, 'data': {'medicine_id': medicine.id, 'location_id': location.id}},
+        {'name': 'sync', 'method': 'get', 'path': f'/api/sync/?location={location.id}'},
+        {'name': 'bootstrap', 'method': 'get', 'path': '/api/bootstrap/'},
+        {'name': 'sync_upload', 'method': 'post', 'path': '/api/sync/upload/',
+         'data': {'changes': [{'client_id': 'bench-1', 'inventory': inventory.id, 'quantity_change': 1}]}},
+        {'name': 'inventory-export', 'method': 'get', 'path': '/api/inventory/export/'},
+        {'name': 'stockmovement-export', 'method': 'get', 'path': f'/api/stock-movements/export/?location={location.id}'},
+        {'name': 'demandforecast-export', 'method': 'get', 'path': '/api/demand-forecasts/export/?file_format=parquet'},
+        {'name': 'demandforecast-upload-csv-forecast', 'method': 'post', 'path': '/api/demand-forecasts/upload_csv_forecast/',
+         'multipart': True, 'slow': True,
+         'data': {'medicine_id': medicine.id, 'location_id': location.id, 'file': ('history.csv', FORECAST_CSV)}},
+    ]
+    for case in cases:
+        case.setdefault('writes', case['method'] != 'get')
+    return cases
+
+
+def model_path(model):
+    return {
+        Medicine: '/api/medicines/', Manufacturer: '/api/manufacturers/',
+        ProductionBatch: '/api/production-batches/', Location: '/api/locations/',
+        LocationEdge: '/api/location-edges/',
+        Inventory: '/api/inventory/', ResupplyRequest: '/api/resupply-requests/',
+        StockMovement: '/api/stock-movements/', DemandForecast: '/api/demand-forecasts/',
+        DemandAnomaly: '/api/demand-anomalies/',
+    }[model]
+
+
+# The API root is a listing; the event stream never ends, so it has no latency.
+UNBENCHMARKED = {'api-root', 'events'}
+
+
+def url_names(resolver=None):
+    """Every named URL pattern in api.urls, used to report benchmark coverage."""
+    names = set()
+    for pattern in (resolver or get_resolver('api.urls')).url_patterns:
+        if isinstance(pattern, URLResolver):
+            names |= url_names(pattern)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+class Command(BaseCommand):
+    help = (
+        "Time every API endpoint against the current database (see generate_supply_data) "
+        "and save the results as JSON for comparison across commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--only', nargs='*', help='Benchmark only these URL names')
+        parser.add_argument('--include-slow', action='store_true', help='Include model-fitting endpoints')
+        parser.add_argument('--output', default=str(Path(settings.BASE_DIR) / 'benchmarks' / 'results'))
+        parser.add_argument('--compare', help='Previous results file to diff against')
+
+    def handle(self, *args, **options):
+        fixture = self._fixture()
+        try:
+            self._benchmark(fixture, options)
+        finally:
+            fixture['user'].delete()
+
+    def _benchmark(self, fixture, options):
+        cases = [
+            case for case in build_cases(fixture)
+            if (options['include_slow'] or not case.get('slow'))
+            and (not options['only'] or case['name'] in options['only'])
+        ]
+
+        client, anonymous = Client(), Client()
+        client.force_login(fixture['user'])
+        results = {}
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for case in cases:
+                results[case['name']] = self._run_case(
+                    anonymous if case.get('anonymous') else client, case, options['repeat'], options['warmup']
+                )
+                self._print_result(case['name'], results[case['name']])
+
+        uncovered = sorted(url_names() - {case['name'] for case in build_cases(fixture)} - UNBENCHMARKED)
+        if uncovered:
+            self.stdout.write(self.style.WARNING(f"No benchmark for: {', '.join(uncovered)}"))
+
+        report = {
+            'commit': self._git_commit(),
+            'timestamp': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'dataset': {
+                model.__name__: model.objects.count()
+                for model in (Medicine, Manufacturer, ProductionBatch, Location, Inventory, StockMovement, ResupplyRequest, DemandForecast)
+            },
+            'repeat': options['repeat'],
+            'results': results,
+        }
+        output = Path(options['output'])
+        output.mkdir(parents=True, exist_ok=True)
+        path = output / f"{timezone.now():%Y%m%d-%H%M%S}-{report['commit'][:10]}.json"
+        path.write_text(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Saved {path}"))
+
+        if options['compare']:
+            self._compare(json.loads(Path(options['compare']).read_text()), report)
+
+    def _fixture(self):
+        inventory = Inventory.objects.select_related('batch', 'location').filter(quantity__gt=10).order_by('id').first()
+        if inventory is None:
+            raise CommandError("No inventory to benchmark against; run generate_supply_data first.")
+        # A throwaway staff account with a one-off password, deleted after the run.
+        password = secrets.token_urlsafe(16)
+        user = User.objects.create_user(f'benchmark-{uuid.uuid4().hex[:8]}', password=password, is_staff=True)
+        existing = set(LocationEdge.objects.values_list('from_location_id', 'to_location_id'))
+        sites = Location.objects.order_by('-id').values_list('id', flat=True)[:501]
+        return {
+            'user': user,
+            'password': password,
+            'refresh_token': str(RefreshToken.for_user(user)),
+            'inventory': inventory,
+            'batch': inventory.batch,
+            'medicine': inventory.batch.medicine,
+            'manufacturer': inventory.batch.manufacturer,
+            'location': inventory.location,
+            'other_location': Location.objects.exclude(pk=inventory.location_id).order_by('id').first() or inventory.location,
+            'resupply': ResupplyRequest.objects.order_by('id').first(),
+            'movement': StockMovement.objects.order_by('id').first(),
+            'forecast': DemandForecast.objects.order_by('id').first(),
+            'anomaly': DemandAnomaly.objects.order_by('id').first(),
+            'edge': LocationEdge.objects.order_by('id').first(),
+            'route_target': Location.objects.order_by('-id').first(),
+            # Up to 500 location pairs without an edge yet, so bulk creates succeed.
+            'new_edges': list(itertools.islice(
+                (pair for pair in itertools.permutations(sites, 2) if pair not in existing), 500
+            )),
+        }
+
+    def _request(self, client, case):
+        data = case.get('data')
+        if case.get('multipart'):
+            from django.core.files.uploadedfile import SimpleUploadedFile
+            payload = {
+                key: SimpleUploadedFile(value[0], value[1].encode()) if isinstance(value, tuple) else value
+                for key, value in data.items()
+            }
+            return client.post(case['path'], payload)
+        if data is None:
+            return getattr(client, case['method'])(case['path'])
+        return getattr(client, case['method'])(case['path'], json.dumps(data), content_type='application/json')
+
+    def _run_case(self, client, case, repeat, warmup):
+        timings, queries, status_code, size = [], [], None, 0
+        for iteration in range(warmup + repeat):
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = self._request(client, case)
+                    # Streamed bodies are produced while being read.
+                    body = b''.join(response.streaming_content) if response.streaming else response.content
+                    elapsed = time.perf_counter() - started
+                if case['writes']:
+                    transaction.set_rollback(True)
+            if iteration >= warmup:
+                timings.append(elapsed)
+                queries.append(len(captured))
+            status_code = response.status_code
+            size = len(body)
+        timings.sort()
+        return {
+            'method': case['method'].upper(),
+            'path': case['path'],
+            'status': status_code,
+            'bytes': size,
+            'queries': max(queries),
+            'min_ms': timings[0] * 1000,
+            'p50_ms': statistics.median(timings) * 1000,
+            'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+            'mean_ms': statistics.fmean(timings) * 1000,
+        }
+
+    def _print_result(self, name, result):
+        style = self.style.SUCCESS if result['status'] < 400 else self.style.ERROR
+        self.stdout.write(
+            f"{name:<42}{style(str(result['status'])):>4} {result['p50_ms']:>9.2f}ms p50 "
+            f"{result['p95_ms']:>9.2f}ms p95 {result['queries']:>5} queries {result['bytes']:>9} bytes"
+        )
+
+    def _compare(self, previous, current):
+        self.stdout.write(f"\nCompared with {previous['commit'][:10]} ({previous['timestamp']}):")
+        for name, result in current['results'].items():
+            before = previous['results'].get(name)
+            if not before:
+                continue
+            change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+            style = self.style.ERROR if change > 10 else self.style.SUCCESS if change < -10 else (lambda text: text)
+            self.stdout.write(style(f"  {name:<42}{before['p50_ms']:>9.2f} -> {result['p50_ms']:>9.2f}ms ({change:+.1f}%)"))
+
+    def _git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return 'unknown'
@@ -0,0 +1,252 @@
+"""
+In-memory per-endpoint performance metrics.
+
+`RequestMetricsMiddleware` records, for a sample of requests, wall time, DB
+query count and time, serialization time and response size, keyed by view
+name and HTTP method. Values land in histograms that keep both running
+totals since the process started and a rolling window over the last
+`WINDOW_SECONDS`. `render_prometheus()` exposes them in the Prometheus text
+format: the totals as cumulative histograms, which `rate()` and
+`histogram_quantile()` expect, and the window as gauges of its estimated
+quantiles. Metrics live in the process that served the request.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 1.0,
+    'WINDOW_SECONDS': 300,
+    'SLICES': 10,
+}
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+WINDOW_QUANTILES = (0.5, 0.95, 0.99)
+
+SERIES = {
+    'request_seconds': ('Wall time per request', SECONDS_BUCKETS),
+    'db_queries': ('Database queries per request', COUNT_BUCKETS),
+    'db_seconds': ('Database time per request', SECONDS_BUCKETS),
+    'serialize_seconds': ('Serializer and renderer time per request, excluding database time', SECONDS_BUCKETS),
+    'response_bytes': ('Response body size', BYTES_BUCKETS),
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'PERF_METRICS', {}).get(name, DEFAULTS[name])
+
+
+def _cumulative(counts):
+    cumulative, running = [], 0
+    for count in counts:
+        running += count
+        cumulative.append(running)
+    return cumulative
+
+
+class RollingHistogram:
+    """
+    Histogram over a sliding time window, plus running totals.
+
+    The window is split into slices, each holding its own bucket counts; a
+    slice is reset when the clock wraps around to it, so observing is O(log
+    buckets) and memory is fixed regardless of traffic. The totals only
+    ever grow.
+    """
+
+    def __init__(self, buckets, window_seconds, slices):
+        self.buckets = buckets
+        self.slice_seconds = window_seconds / slices
+        self.counts = [[0] * (len(buckets) + 1) for _ in range(slices)]
+        self.sums = [0.0] * slices
+        self.epochs = [-1] * slices
+        self.total_counts = [0] * (len(buckets) + 1)
+        self.total_sum = 0.0
+
+    def _slice(self, now):
+        epoch = int(now / self.slice_seconds)
+        index = epoch % len(self.counts)
+        if self.epochs[index] != epoch:
+            self.counts[index] = [0] * (len(self.buckets) + 1)
+            self.sums[index] = 0.0
+            self.epochs[index] = epoch
+        return index
+
+    def observe(self, value, now):
+        index = self._slice(now)
+        bucket = bisect.bisect_left(self.buckets, value)
+        self.counts[index][bucket] += 1
+        self.sums[index] += value
+        self.total_counts[bucket] += 1
+        self.total_sum += value
+
+    def totals(self):
+        """Return (cumulative bucket counts, count, sum) since the histogram was created."""
+        cumulative = _cumulative(self.total_counts)
+        return cumulative, cumulative[-1], self.total_sum
+
+    def snapshot(self, now):
+        """Return (cumulative bucket counts, count, sum) over the live window."""
+        oldest = int(now / self.slice_seconds) - len(self.counts) + 1
+        totals = [0] * (len(self.buckets) + 1)
+        total_sum = 0.0
+        for index, epoch in enumerate(self.epochs):
+            if epoch >= oldest:
+                totals = [a + b for a, b in zip(totals, self.counts[index])]
+                total_sum += self.sums[index]
+        cumulative = _cumulative(totals)
+        return cumulative, cumulative[-1], total_sum
+
+    def quantile(self, q, now):
+        """
+        Estimate the `q` quantile over the live window by interpolating
+        within its bucket, as Prometheus' `histogram_quantile()` does. None
+        when the window is empty.
+        """
+        cumulative, count, _ = self.snapshot(now)
+        if not count:
+            return None
+        rank = q * count
+        index = bisect.bisect_left(cumulative, rank)
+        if index == len(self.buckets):
+            return self.buckets[-1]
+        lower = self.buckets[index - 1] if index else 0
+        below = cumulative[index - 1] if index else 0
+        return lower + (self.buckets[index] - lower) * (rank - below) / (cumulative[index] - below)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.requests = defaultdict(int)
+
+    def record(self, labels, sample):
+        now = time.monotonic()
+        window, slices = get_setting('WINDOW_SECONDS'), get_setting('SLICES')
+        with self.lock:
+            for name, value in sample.items():
+                key = (name, labels)
+                if key not in self.histograms:
+                    self.histograms[key] = RollingHistogram(SERIES[name][1], window, slices)
+                self.histograms[key].observe(value, now)
+
+    def count_request(self, labels):
+        with self.lock:
+            self.requests[labels] += 1
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.requests.clear()
+
+    def render_prometheus(self):
+        now = time.monotonic()
+        window = get_setting('WINDOW_SECONDS')
+        lines = [
+            '# HELP pharmaflow_requests_total Requests handled by this process, sampled or not.',
+            '# TYPE pharmaflow_requests_total counter',
+        ]
+        with self.lock:
+            for labels, count in sorted(self.requests.items()):
+                lines.append(f'pharmaflow_requests_total{{{_format_labels(labels)}}} {count}')
+            by_series = defaultdict(list)
+            for (name, labels), histogram in self.histograms.items():
+                by_series[name].append((
+                    labels, histogram.totals(), histogram.buckets,
+                    [(q, histogram.quantile(q, now)) for q in WINDOW_QUANTILES],
+                ))
+        for name, (description, _) in SERIES.items():
+            metric = f'pharmaflow_{name}'
+            series = sorted(by_series.get(name, []))
+            lines.append(f'# HELP {metric} {description} (sampled requests).')
+            lines.append(f'# TYPE {metric} histogram')
+            for labels, (cumulative, count, total), buckets, _ in series:
+                label_text = _format_labels(labels)
+                for bound, value in zip(buckets, cumulative):
+                    lines.append(f'{metric}_bucket{{{label_text},le="{bound}"}} {value}')
+                lines.append(f'{metric}_bucket{{{label_text},le="+Inf"}} {count}')
+                lines.append(f'{metric}_sum{{{label_text}}} {total:.6f}')
+                lines.append(f'{metric}_count{{{label_text}}} {count}')
+            lines.append(f'# HELP {metric}_window {description}, estimated quantiles over the last {window}s (sampled requests).')
+            lines.append(f'# TYPE {metric}_window gauge')
+            for labels, _, _, quantiles in series:
+                label_text = _format_labels(labels)
+                for q, value in quantiles:
+                    if value is not None:
+                        lines.append(f'{metric}_window{{{label_text},quantile="{q}"}} {value:.6g}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    view, method = labels
+    view = view.replace('\\', '\\\\').replace('"', '\\"')
+    return f'view="{view}",method="{method}"'
+
+
+registry = MetricsRegistry()
+
+# The sample being collected for the current request, if it was sampled.
+current_sample = contextvars.ContextVar('current_sample', default=None)
+
+
+class RequestSample:
+    __slots__ = ('db_queries', 'db_seconds', 'serialize_seconds')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.db_queries += 1
+
+
+@contextmanager
+def timed_serialization():
+    """Add the enclosed block's time, minus any DB time inside it, to the current sample."""
+    sample = current_sample.get()
+    if sample is None:
+        yield
+        return
+    started, db_before = time.perf_counter(), sample.db_seconds
+    try:
+        yield
+    finally:
+        sample.serialize_seconds += (time.perf_counter() - started) - (sample.db_seconds - db_before)
+
+
+class InstrumentedSerializerMixin:
+    """
+    Viewset mixin that attributes serializer time to the request metrics.
+
+    Only the serializer instance handed to the view is wrapped, so nested
+    serializers are not double counted and nothing is patched globally.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if current_sample.get() is not None:
+            to_representation = serializer.to_representation
+
+            def timed_to_representation(instance):
+                with timed_serialization():
+                    return to_representation(instance)
+
+            serializer.to_representation = timed_to_representation
+        return serializer
@@ -0,0 +1,94 @@
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connection
+
+from .metrics import registry, current_sample, get_setting, RequestSample
+
+
+class RequestMetricsMiddleware:
+    """
+    Records per-view performance metrics for a sample of requests.
+
+    Sampled synchronous requests get wall time, DB query count and time
+    (through `connection.execute_wrapper`), serialization time and response
+    size. Native async views only report wall time and size, since their
+    queries run on a separate sync thread. Every request is counted.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._sampled():
+            response = self.get_response(request)
+            self._count(request)
+            return response
+
+        sample = RequestSample()
+        token = current_sample.set(sample)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(sample):
+                response = self.get_response(request)
+        finally:
+            current_sample.reset(token)
+        self._record(request, response, time.perf_counter() - started, {
+            'db_queries': sample.db_queries,
+            'db_seconds': sample.db_seconds,
+            'serialize_seconds': sample.serialize_seconds,
+        })
+        return response
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            response = await self.get_response(request)
+            self._count(request)
+            return response
+
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._record(request, response, time.perf_counter() - started, {})
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; charge the
+        # rendering to serialization time as well.
+        sample = current_sample.get()
+        if sample is not None:
+            started, db_before = time.perf_counter(), sample.db_seconds
+
+            def rendered(response):
+                sample.serialize_seconds += (time.perf_counter() - started) - (sample.db_seconds - db_before)
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def _sampled(self):
+        if not get_setting('ENABLED'):
+            return False
+        rate = get_setting('SAMPLE_RATE')
+        return rate >= 1 or random.random() < rate
+
+    def _labels(self, request):
+        match = getattr(request, 'resolver_match', None)
+        return (match.view_name if match else 'unmatched', request.method)
+
+    def _count(self, request):
+        if get_setting('ENABLED'):
+            registry.count_request(self._labels(request))
+
+    def _record(self, request, response, elapsed, sample):
+        labels = self._labels(request)
+        sample['request_seconds'] = elapsed
+        if not response.streaming:
+            sample['response_bytes'] = len(response.content)
+        registry.count_request(labels)
+        registry.record(labels, sample)
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.1 on 2026-10-19 16:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_resupply_planning'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyMovementRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movement_type', models.CharField(choices=[('production', 'Production'), ('distribution', 'Distribution'), ('transfer', 'Transfer'), ('adjustment', 'Adjustment'), ('disposal', 'Disposal')], max_length=50)),
+                ('units_in', models.IntegerField(default=0)),
+                ('units_out', models.IntegerField(default=0)),
+                ('movements', models.IntegerField(default=0)),
+                ('day', models.DateField()),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.location')),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.medicine')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='api_dailymo_day_8446b8_idx')],
+                'unique_together': {('medicine', 'location', 'day', 'movement_type')},
+            },
+        ),
+        migrations.CreateModel(
+            name='WeeklyMovementRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movement_type', models.CharField(choices=[('production', 'Production'), ('distribution', 'Distribution'), ('transfer', 'Transfer'), ('adjustment', 'Adjustment'), ('disposal', 'Disposal')], max_length=50)),
+                ('units_in', models.IntegerField(default=0)),
+                ('units_out', models.IntegerField(default=0)),
+                ('movements', models.IntegerField(default=0)),
+                ('week_start', models.DateField()),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.location')),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.medicine')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['week_start'], name='api_weeklym_week_st_0718ff_idx')],
+                'unique_together': {('medicine', 'location', 'week_start', 'movement_type')},
+            },
+        ),
+    ]
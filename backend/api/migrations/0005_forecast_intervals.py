@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-19 16:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_movement_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='demandforecast',
+            name='predicted_lower',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='demandforecast',
+            name='predicted_upper',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
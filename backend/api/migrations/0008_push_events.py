@@ -0,0 +1,25 @@
+# Generated by Django 5.2.1 on 2026-10-19 16:40
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_sync_tombstones'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PushEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('stock_change', 'Stock Change'), ('low_stock', 'Low Stock'), ('expiry', 'Expiry')], max_length=20)),
+                ('inventory_id', models.IntegerField()),
+                ('location_id', models.IntegerField()),
+                ('payload', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-19 16:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_push_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='organization',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='locations',
+            field=models.ManyToManyField(blank=True, related_name='profiles', to='api.location'),
+        ),
+    ]
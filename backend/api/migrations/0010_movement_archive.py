@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-19 16:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_data_scoping'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovementArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True)),
+                ('path', models.CharField(max_length=255)),
+                ('row_count', models.IntegerField(default=0)),
+                ('archived_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.1 on 2026-10-19 17:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_movement_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DemandAnomaly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.IntegerField()),
+                ('expected', models.FloatField()),
+                ('threshold', models.FloatField()),
+                ('score', models.FloatField()),
+                ('status', models.CharField(choices=[('open', 'Open'), ('confirmed', 'Confirmed'), ('dismissed', 'Dismissed')], default='open', max_length=20)),
+                ('notes', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.location')),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.medicine')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'day'], name='api_demanda_status_1aa569_idx')],
+                'unique_together': {('medicine', 'location', 'day')},
+            },
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 import json
 
@@ -9,6 +10,9 @@ class Medicine(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['updated_at', 'id'])]
+
     def __str__(self):
         return f"{self.name} {self.strength}"
 
@@ -43,11 +47,29 @@ class Location(models.Model):
         ('cold_storage', 'Cold Storage')
     ])
     address = models.TextField(blank=True)
+    organization = models.CharField(max_length=255, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.name
 
+class LocationEdge(models.Model):
+    from_location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name='outgoing_edges')
+    to_location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name='incoming_edges')
+    transit_hours = models.FloatField()
+    cost = models.FloatField(default=0)
+    bidirectional = models.BooleanField(default=True)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['from_location', 'to_location']
+
+    def __str__(self):
+        arrow = '<->' if self.bidirectional else '->'
+        return f"{self.from_location.name} {arrow} {self.to_location.name}"
+
 class Inventory(models.Model):
     STATUS_CHOICES = [
         ('available', 'Available'),
@@ -67,6 +89,7 @@ class Inventory(models.Model):
 
     class Meta:
         unique_together = ['batch', 'location']
+        indexes = [models.Index(fields=['last_updated', 'id'])]
 
     def __str__(self):
         return f"{self.batch.medicine.name} at {self.location.name}"
@@ -89,6 +112,38 @@ class StockMovement(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
 
+class MovementArchive(models.Model):
+    # One month of StockMovement rows moved out to a shard file (see api.archive).
+    month = models.DateField(unique=True)
+    path = models.CharField(max_length=255)
+    row_count = models.IntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now=True)
+
+class MovementRollup(models.Model):
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='+')
+    location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name='+')
+    movement_type = models.CharField(max_length=50, choices=StockMovement.MOVEMENT_TYPE_CHOICES)
+    units_in = models.IntegerField(default=0)
+    units_out = models.IntegerField(default=0)
+    movements = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+class DailyMovementRollup(MovementRollup):
+    day = models.DateField()
+
+    class Meta:
+        unique_together = ['medicine', 'location', 'day', 'movement_type']
+        indexes = [models.Index(fields=['day'])]
+
+class WeeklyMovementRollup(MovementRollup):
+    week_start = models.DateField()
+
+    class Meta:
+        unique_together = ['medicine', 'location', 'week_start', 'movement_type']
+        indexes = [models.Index(fields=['week_start'])]
+
 class ResupplyRequest(models.Model):
     URGENCY_CHOICES = [
         ('low', 'Low'),
@@ -115,17 +170,92 @@ class ResupplyRequest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+class ResupplyPlanRun(models.Model):
+    parameters = models.JSONField(default=dict)
+    full = models.BooleanField(default=False)
+    series_checked = models.IntegerField(default=0)
+    created_count = models.IntegerField(default=0)
+    merged_count = models.IntegerField(default=0)
+    run_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-started_at']
+
 class DemandForecast(models.Model):
     medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE)
     location = models.ForeignKey(Location, on_delete=models.CASCADE)
     forecast_date = models.DateField()
     predicted_demand = models.IntegerField()
+    predicted_lower = models.IntegerField(null=True, blank=True)
+    predicted_upper = models.IntegerField(null=True, blank=True)
     confidence_level = models.FloatField()
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ['medicine', 'location', 'forecast_date']
 
+class DemandAnomaly(models.Model):
+    # A day whose distribution ran far above its series' usual level (see api.anomalies).
+    STATUS_CHOICES = [
+        ('open', 'Open'),
+        ('confirmed', 'Confirmed'),
+        ('dismissed', 'Dismissed'),
+    ]
+
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='+')
+    location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    units = models.IntegerField()
+    expected = models.FloatField()
+    threshold = models.FloatField()
+    score = models.FloatField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='open')
+    notes = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['medicine', 'location', 'day']
+        indexes = [models.Index(fields=['status', 'day'])]
+
+
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=32)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ['user', 'key']
+
+class SyncTombstone(models.Model):
+    table = models.CharField(max_length=50)
+    object_id = models.IntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['table', 'deleted_at'])]
+
+class PushEvent(models.Model):
+    KIND_CHOICES = [
+        ('stock_change', 'Stock Change'),
+        ('low_stock', 'Low Stock'),
+        ('expiry', 'Expiry'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # Plain ids rather than foreign keys: events outlive the rows they describe.
+    inventory_id = models.IntegerField()
+    location_id = models.IntegerField()
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
 
 class UserProfile(models.Model):
     USER_ROLES = [
@@ -137,6 +267,9 @@ class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     role = models.CharField(max_length=20, choices=USER_ROLES)
     organization = models.CharField(max_length=255, blank=True)
+    # Locations the user works at; when empty, every location of their
+    # organization (see api.scoping).
+    locations = models.ManyToManyField(Location, blank=True, related_name='profiles')
     phone = models.CharField(max_length=20, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,243 @@
+"""
+Push events for inventory changes.
+
+Writers record which inventory rows a transaction touched (see
+`api.signals`); when it commits, `_flush()` reads their current state once
+and appends `stock_change`, `low_stock` and `expiry` rows to `PushEvent`.
+Each write queues its rows in its own `on_commit` callback, so a rolled-back
+block takes its queued rows with it, and a row touched by several writes
+still gets one set of events per commit.
+The table is the channel between processes, so events reach every server
+process no matter which one did the write.
+
+Each ASGI process runs one `Broadcaster` per event loop. It polls the table
+for new ids (one indexed query per `POLL_SECONDS`, however many clients are
+connected) and hands each event to the matching `Subscription`. A
+subscription coalesces by (kind, inventory): a burst of updates to one row
+reaches the client as its latest state only. The SSE view in
+`api.async_views` streams subscriptions to browsers.
+"""
+import asyncio
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .dashboard import LOW_STOCK_THRESHOLD
+from .models import Inventory, PushEvent
+
+KINDS = [kind for kind, _ in PushEvent.KIND_CHOICES]
+# Event kinds each role may subscribe to; users without a profile get all.
+ROLE_KINDS = {
+    'manufacturer': {'low_stock', 'expiry'},
+    'stockist': set(KINDS),
+    'pharmacist': set(KINDS),
+}
+
+DEFAULTS = {
+    'POLL_SECONDS': 1.0,
+    # Extra wait after the first event of a burst so the rest coalesce.
+    'COALESCE_SECONDS': 0.25,
+    'HEARTBEAT_SECONDS': 15,
+    'RETENTION_SECONDS': 600,
+    'LOW_STOCK_THRESHOLD': LOW_STOCK_THRESHOLD,
+    'EXPIRY_DAYS': 30,
+}
+
+BACKLOG_LIMIT = 1000
+
+_last_purge = 0.0
+_pending = threading.local()
+
+
+def get_setting(name):
+    return getattr(settings, 'PUSH', {}).get(name, DEFAULTS[name])
+
+
+class _Commit:
+    """What the callbacks of one transaction have flushed so far."""
+
+    def __init__(self):
+        self.started = False
+        self.flushed = set()
+        self.transfers = set()
+
+
+class _Batch:
+    """Rows touched by one write; registered as an on_commit callback of its transaction."""
+
+    def __init__(self, commit, inventory_ids, transfers):
+        self.commit = commit
+        self.ids = set(inventory_ids)
+        self.transfers = set(transfers)
+
+    def __call__(self):
+        # Every write registers its own callback, so rolling a block back
+        # drops exactly the rows queued inside it. The callbacks that survive
+        # run one after another once the transaction commits and all read the
+        # same final state; a row already flushed by one of them is skipped.
+        commit = self.commit
+        commit.started = True
+        ids = _flush(self.ids - commit.flushed, self.transfers - commit.transfers, commit.flushed)
+        commit.flushed |= ids
+        commit.transfers |= self.transfers
+
+
+def inventory_changed(inventory_ids=(), transfers=()):
+    """
+    Queue events for `inventory_ids`, and for the destination rows of
+    `transfers` given as (source inventory id, destination location id),
+    once the current transaction commits.
+    """
+    if not inventory_ids and not transfers:
+        return
+    commit = getattr(_pending, 'commit', None)
+    if commit is None or commit.started:
+        # Once a callback of the last transaction has run, that transaction
+        # is over. One that rolled back ran none and flushed nothing, so
+        # the next can share its `_Commit`.
+        commit = _pending.commit = _Commit()
+    transaction.on_commit(_Batch(commit, inventory_ids, transfers))
+
+
+def _flush(ids, transfers, skip=frozenset()):
+    """Write the events of `ids` and the `transfers` destinations, other than `skip`; returns the ids flushed."""
+    if not ids and not transfers:
+        return set()
+
+    ids = set(ids)
+    if transfers:
+        batches = dict(Inventory.objects.filter(pk__in={source for source, _ in transfers}).values_list('id', 'batch_id'))
+        destinations = Q()
+        for source, location in transfers:
+            if source in batches:
+                destinations |= Q(batch_id=batches[source], location_id=location)
+        if destinations:
+            ids |= set(Inventory.objects.filter(destinations).values_list('id', flat=True))
+    ids -= skip
+
+    today = timezone.localdate()
+    expiry_limit = today + timedelta(days=get_setting('EXPIRY_DAYS'))
+    events = []
+    for row in Inventory.objects.filter(pk__in=ids).values(
+        'id', 'quantity', 'status', 'location_id', 'location__name', 'location__location_type',
+        'batch__medicine_id', 'batch__medicine__name', 'batch__batch_number', 'batch__expiry_date'
+    ):
+        expiry_date = row['batch__expiry_date']
+        payload = {
+            'inventory': row['id'],
+            'location': row['location_id'],
+            'location_name': row['location__name'],
+            'location_type': row['location__location_type'],
+            'medicine': row['batch__medicine_id'],
+            'medicine_name': row['batch__medicine__name'],
+            'batch_number': row['batch__batch_number'],
+            'quantity': row['quantity'],
+            'status': row['status'],
+            'expiry_date': expiry_date,
+            'days_to_expiry': (expiry_date - today).days,
+        }
+        kinds = ['stock_change']
+        if row['quantity'] < get_setting('LOW_STOCK_THRESHOLD') or row['status'] == 'low_stock':
+            kinds.append('low_stock')
+        if row['quantity'] > 0 and today <= expiry_date <= expiry_limit:
+            kinds.append('expiry')
+        events.extend(
+            PushEvent(kind=kind, inventory_id=row['id'], location_id=row['location_id'], payload=payload)
+            for kind in kinds
+        )
+    PushEvent.objects.bulk_create(events, batch_size=500)
+    _purge_old()
+    return ids
+
+
+def _purge_old():
+    global _last_purge
+    now = time.monotonic()
+    if now - _last_purge < get_setting('RETENTION_SECONDS') / 10:
+        return
+    _last_purge = now
+    PushEvent.objects.filter(
+        created_at__lt=timezone.now() - timedelta(seconds=get_setting('RETENTION_SECONDS'))
+    ).delete()
+
+
+class Subscription:
+    def __init__(self, kinds, locations=None):
+        self.kinds = kinds
+        self.locations = locations
+        self.pending = OrderedDict()
+        self.wakeup = asyncio.Event()
+
+    def offer(self, event):
+        if event.kind not in self.kinds or (self.locations is not None and event.location_id not in self.locations):
+            return
+        key = (event.kind, event.inventory_id)
+        current = self.pending.pop(key, None)
+        # Backlog replay can offer an event older than one already queued.
+        self.pending[key] = event if current is None or event.id > current.id else current
+        self.wakeup.set()
+
+    def drain(self):
+        events = sorted(self.pending.values(), key=lambda event: event.id)
+        self.pending.clear()
+        self.wakeup.clear()
+        return events
+
+
+async def _events_after(last_id, until=None, limit=BACKLOG_LIMIT):
+    events = PushEvent.objects.filter(id__gt=last_id).order_by('id')
+    if until is not None:
+        events = events.filter(id__lte=until)
+    return [event async for event in events[:limit]]
+
+
+class Broadcaster:
+    """Polls `PushEvent` for one event loop while anyone is subscribed."""
+
+    def __init__(self):
+        self.subscriptions = set()
+        self.last_id = None
+        self.task = None
+
+    async def subscribe(self, subscription, last_event_id=None):
+        if self.task is None or self.task.done():
+            latest = await PushEvent.objects.order_by('-id').values_list('id', flat=True).afirst()
+            self.last_id = latest or 0
+        self.subscriptions.add(subscription)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._poll())
+        if last_event_id is not None and last_event_id < self.last_id:
+            for event in await _events_after(last_event_id, until=self.last_id):
+                subscription.offer(event)
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.discard(subscription)
+
+    async def _poll(self):
+        while self.subscriptions:
+            events = await _events_after(self.last_id)
+            for event in events:
+                for subscription in list(self.subscriptions):
+                    subscription.offer(event)
+            if events:
+                self.last_id = events[-1].id
+            if len(events) < BACKLOG_LIMIT:
+                await asyncio.sleep(get_setting('POLL_SECONDS'))
+
+
+_broadcasters = weakref.WeakKeyDictionary()
+
+
+def get_broadcaster():
+    loop = asyncio.get_running_loop()
+    broadcaster = _broadcasters.get(loop)
+    if broadcaster is None:
+        broadcaster = _broadcasters[loop] = Broadcaster()
+    return broadcaster
@@ -0,0 +1,205 @@
+"""
+Network-wide stock rebalancing as a min-cost transportation problem.
+
+For each medicine, locations holding more than their forecast demand (plus a
+reserve) are sources and locations below their forecast demand are sinks.
+Arcs run from each sink's nearest sources on the location graph and cost the
+shortest-path distance in the chosen metric. Unmet demand carries a penalty
+larger than any route, so the solver first minimises stock-outs and then
+transport cost; basic solutions of a transportation LP use at most
+sources + sinks - 1 arcs, which keeps the number of transfers low.
+
+Medicines do not share capacity, so the network problem decomposes into one
+LP per medicine, solved with SciPy's HiGHS backend. Each solution is cached
+against its inputs and the graph version; a re-plan only re-solves medicines
+whose stock, demand or routes changed.
+
+A plan limited to a location scope (see `api.scoping`) only moves stock
+between, and reports on, the locations in it.
+"""
+import hashlib
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import timedelta
+
+import numpy as np
+from scipy.optimize import linprog
+from scipy.sparse import coo_matrix
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Medicine, Location, Inventory, DemandForecast
+from .routing import get_routing_table
+from .scoping import scope_queryset
+
+MAX_CACHED_PLANS = 10000
+
+_plans = OrderedDict()
+_lock = threading.Lock()
+
+
+def network_positions(horizon_days=14, medicines=None, scope=None):
+    """
+    Current sellable stock and forecast demand over the horizon, as
+    {medicine_id: {location_id: (stock, demand)}}, for the locations in
+    `scope`.
+    """
+    today = timezone.now().date()
+    stock = scope_queryset(Inventory.objects.all(), scope, 'location').exclude(status='expired').filter(batch__expiry_date__gt=today)
+    demand = scope_queryset(DemandForecast.objects.all(), scope, 'location').filter(
+        forecast_date__range=(today, today + timedelta(days=horizon_days - 1))
+    )
+    if medicines:
+        stock = stock.filter(batch__medicine_id__in=medicines)
+        demand = demand.filter(medicine_id__in=medicines)
+
+    positions = defaultdict(dict)
+    for row in stock.values('batch__medicine_id', 'location_id').annotate(total=Sum('quantity')):
+        positions[row['batch__medicine_id']][row['location_id']] = (row['total'], 0)
+    for row in demand.values('medicine_id', 'location_id').annotate(total=Sum('predicted_demand')):
+        held = positions[row['medicine_id']].get(row['location_id'], (0, 0))[0]
+        positions[row['medicine_id']][row['location_id']] = (held, row['total'])
+    return positions
+
+
+def _balances(position, reserve):
+    supplies, needs = {}, {}
+    for location, (stock, demand) in sorted(position.items()):
+        spare = stock - int(np.ceil(demand * (1 + reserve)))
+        if spare > 0:
+            supplies[location] = spare
+        elif stock < demand:
+            needs[location] = demand - stock
+    return supplies, needs
+
+
+def solve_transport(supplies, needs, table, max_sources=10):
+    """
+    Solve one medicine's transportation problem.
+
+    Returns (transfers, unmet) where transfers is a list of
+    (from_location, to_location, quantity, unit_cost) and unmet maps each
+    sink to the demand no source could cover.
+    """
+    sources = list(supplies)
+    sinks = list(needs)
+    source_index = {source: i for i, source in enumerate(sources)}
+    arcs = []
+    for sink_index, sink in enumerate(sinks):
+        for distance, source in table.nearest(sink, supplies)[:max_sources]:
+            arcs.append((source_index[source], sink_index, distance))
+    if not arcs:
+        return [], dict(needs)
+
+    n_arcs, n_sinks = len(arcs), len(sinks)
+    source_rows, sink_rows, costs = (np.array(column) for column in zip(*arcs))
+    penalty = costs.max() * 10 + 1
+    objective = np.concatenate([costs, np.full(n_sinks, penalty)])
+
+    arc_columns = np.arange(n_arcs)
+    supply_matrix = coo_matrix(
+        (np.ones(n_arcs), (source_rows, arc_columns)), shape=(len(sources), n_arcs + n_sinks)
+    )
+    demand_matrix = coo_matrix(
+        (np.ones(n_arcs + n_sinks), (np.concatenate([sink_rows, np.arange(n_sinks)]),
+                                     np.concatenate([arc_columns, n_arcs + np.arange(n_sinks)]))),
+        shape=(n_sinks, n_arcs + n_sinks)
+    )
+    result = linprog(
+        objective,
+        A_ub=supply_matrix.tocsr(), b_ub=np.array([supplies[source] for source in sources], dtype=float),
+        A_eq=demand_matrix.tocsr(), b_eq=np.array([needs[sink] for sink in sinks], dtype=float),
+        bounds=(0, None), method='highs'
+    )
+    if not result.success:
+        raise RuntimeError(f"Rebalancing solve failed: {result.message}")
+
+    flows = np.rint(result.x).astype(int)
+    transfers = [
+        (sources[source_rows[i]], sinks[sink_rows[i]], int(flows[i]), float(costs[i]))
+        for i in np.flatnonzero(flows[:n_arcs] > 0)
+    ]
+    unmet = {sinks[j]: int(flows[n_arcs + j]) for j in range(n_sinks) if flows[n_arcs + j] > 0}
+    return transfers, unmet
+
+
+def _signature(*parts):
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+def plan_rebalancing(horizon_days=14, reserve=0.2, metric='cost', max_sources=10, medicines=None, scope=None):
+    """
+    Plan transfers for every medicine in the network, or between the
+    locations in `scope`.
+
+    Returns a dict with the transfer list and totals. Medicines whose inputs
+    match a cached solution are reused rather than re-solved.
+    """
+    table = get_routing_table(metric)
+    positions = network_positions(horizon_days, medicines, scope)
+    # One batched shortest-path pass covers every sink in the network.
+    table.prepare({location for position in positions.values() for location in position})
+
+    transfers, unmet = [], []
+    solved = reused = 0
+    for medicine, position in positions.items():
+        supplies, needs = _balances(position, reserve)
+        if not needs:
+            continue
+        key = (medicine, metric, scope and frozenset(scope))
+        signature = _signature(table.version, max_sources, sorted(supplies.items()), sorted(needs.items()))
+        with _lock:
+            cached = _plans.get(key)
+            if cached is not None and cached[0] == signature:
+                _plans.move_to_end(key)
+        if cached is not None and cached[0] == signature:
+            plan = cached[1]
+            reused += 1
+        else:
+            # Solved outside the lock; concurrent plans of one medicine
+            # may both solve it, and the last one is kept.
+            plan = solve_transport(supplies, needs, table, max_sources) if supplies else ([], dict(needs))
+            with _lock:
+                _plans[key] = (signature, plan)
+                _plans.move_to_end(key)
+                while len(_plans) > MAX_CACHED_PLANS:
+                    _plans.popitem(last=False)
+            solved += 1
+        transfers.extend((medicine, *transfer) for transfer in plan[0])
+        unmet.extend((medicine, location, quantity) for location, quantity in plan[1].items())
+
+    names = dict(Location.objects.filter(
+        pk__in={location for transfer in transfers for location in transfer[1:3]} | {row[1] for row in unmet}
+    ).values_list('id', 'name'))
+    medicine_names = dict(Medicine.objects.filter(
+        pk__in={transfer[0] for transfer in transfers} | {row[0] for row in unmet}
+    ).values_list('id', 'name'))
+    return {
+        'metric': metric,
+        'horizon_days': horizon_days,
+        'transfers': [
+            {
+                'medicine': medicine,
+                'medicine_name': medicine_names.get(medicine),
+                'from_location': source,
+                'from_location_name': names.get(source),
+                'to_location': sink,
+                'to_location_name': names.get(sink),
+                'quantity': quantity,
+                metric: unit_cost,
+            }
+            for medicine, source, sink, quantity, unit_cost in transfers
+        ],
+        'unmet_demand': [
+            {'medicine': medicine, 'medicine_name': medicine_names.get(medicine), 'location': location, 'location_name': names.get(location), 'quantity': quantity}
+            for medicine, location, quantity in unmet
+        ],
+        'summary': {
+            'transfers': len(transfers),
+            'units_moved': sum(transfer[3] for transfer in transfers),
+            'total_cost': round(sum(transfer[3] * transfer[4] for transfer in transfers), 2),
+            'unmet_units': sum(row[2] for row in unmet),
+            'medicines_solved': solved,
+            'medicines_reused': reused,
+        },
+    }
@@ -0,0 +1,57 @@
+"""
+Compact renderers for large list responses.
+
+Both are opt-in per request with `?format=columnar` / `?format=msgpack` or the
+matching Accept header, so existing clients keep receiving plain JSON.
+"""
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+
+def to_columnar(data):
+    """
+    Turn a list of row dicts into {'columns': [...], 'rows': [[...], ...]}.
+
+    Column names are sent once instead of once per row, which roughly halves
+    the payload of wide tables. Paginated responses keep their envelope and
+    only `results` is converted; anything that is not a list of dicts is
+    returned unchanged.
+    """
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        return {**data, 'results': to_columnar(data['results'])}
+    if not isinstance(data, list) or not data or not all(isinstance(row, dict) for row in data):
+        return data
+    columns = list(data[0])
+    return {
+        'columns': columns,
+        'rows': [[row.get(column) for column in columns] for row in data],
+    }
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    media_type = 'application/vnd.pharmaflow.columnar+json'
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(to_columnar(data), accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Binary MessagePack encoding of the regular response body (requires `msgpack`)."""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=JSONEncoder().default, use_bin_type=True)
+
+
+COMPACT_RENDERER_CLASSES = [ColumnarJSONRenderer] + ([MessagePackRenderer] if msgpack else [])
@@ -0,0 +1,131 @@
+"""
+Forecast-driven resupply planning.
+
+`plan_resupply()` projects stock for every (medicine, location) series over
+the resupply lead time: sellable stock plus approved or in-progress requests,
+minus forecast demand. Series that fall below demand plus a safety margin
+get a request with an urgency derived from how much of the lead-time demand
+is covered. A series with a pending request is merged into it (quantity and
+urgency only ever rise) instead of gaining a duplicate.
+
+Runs are recorded in `ResupplyPlanRun`. A run is incremental when the last
+one used the same parameters on the same day: it only re-plans series whose
+inventory, forecasts or requests changed since that run started. A run
+limited to a location scope (see `api.scoping`) records it among its
+parameters, so it is only incremental on a run over the same locations.
+"""
+import math
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Inventory, ResupplyRequest, ResupplyPlanRun, DemandForecast
+from .rebalancing import network_positions
+from .scoping import scope_queryset
+
+URGENCY_ORDER = ['low', 'normal', 'high', 'critical']
+# Urgency by share of lead-time demand the projected stock covers.
+URGENCY_BY_COVERAGE = [(0.25, 'critical'), (0.5, 'high'), (0.75, 'normal')]
+
+
+def urgency_for(coverage):
+    for limit, urgency in URGENCY_BY_COVERAGE:
+        if coverage < limit:
+            return urgency
+    return 'low'
+
+
+def _changed_series(previous):
+    since = previous.started_at
+    series = set(Inventory.objects.filter(last_updated__gt=since).values_list('batch__medicine_id', 'location_id'))
+    series.update(DemandForecast.objects.filter(updated_at__gt=since).values_list('medicine_id', 'location_id'))
+    # Open requests are locked for the whole run, so only edits after it
+    # finished are new; this skips the run's own creates and merges.
+    series.update(ResupplyRequest.objects.filter(updated_at__gt=previous.finished_at).values_list('medicine_id', 'requesting_location_id'))
+    return series
+
+
+def plan_resupply(user, lead_time_days=7, safety_ratio=0.25, full=False, scope=None):
+    """
+    Create and merge resupply requests for series projected to run short at
+    the locations in `scope`. Returns the `ResupplyPlanRun` describing what
+    was done.
+    """
+    started_at = timezone.now()
+    parameters = {'lead_time_days': lead_time_days, 'safety_ratio': safety_ratio}
+    if scope is not None:
+        parameters['locations'] = sorted(scope)
+    previous = ResupplyPlanRun.objects.first()
+    incremental = (
+        not full and previous is not None and previous.parameters == parameters
+        and timezone.localdate(previous.started_at) == timezone.localdate(started_at)
+    )
+
+    series = None
+    medicines = None
+    if incremental:
+        series = _changed_series(previous)
+        medicines = {medicine for medicine, _ in series}
+
+    with transaction.atomic():
+        run = ResupplyPlanRun(parameters=parameters, full=not incremental, run_by=user, started_at=started_at)
+        if series is not None and not series:
+            run.save()
+            return run
+
+        positions = network_positions(lead_time_days, medicines, scope)
+        open_requests = scope_queryset(ResupplyRequest.objects.all(), scope, 'requesting_location').filter(
+            status__in=['pending', 'approved', 'in_progress']
+        )
+        if medicines is not None:
+            open_requests = open_requests.filter(medicine_id__in=medicines)
+        inbound = defaultdict(int)
+        pending = {}
+        for open_request in open_requests.select_for_update().order_by('created_at'):
+            key = (open_request.medicine_id, open_request.requesting_location_id)
+            if open_request.status == 'pending':
+                # The oldest pending request absorbs new needs; any later
+                # duplicates already in the table are left as they are.
+                pending.setdefault(key, open_request)
+            else:
+                inbound[key] += open_request.requested_quantity
+
+        to_create, to_merge = [], []
+        for medicine, position in positions.items():
+            for location, (stock, demand) in position.items():
+                key = (medicine, location)
+                if (series is not None and key not in series) or demand <= 0:
+                    continue
+                run.series_checked += 1
+                projected = stock + inbound[key]
+                target = math.ceil(demand * (1 + safety_ratio))
+                if projected >= target:
+                    continue
+                quantity = target - projected
+                urgency = urgency_for(projected / demand)
+                notes = (
+                    f"Auto-planned: {projected} projected against {demand} forecast demand "
+                    f"over {lead_time_days} days"
+                )
+                existing = pending.get(key)
+                if existing is None:
+                    to_create.append(ResupplyRequest(
+                        medicine_id=medicine, requesting_location_id=location,
+                        requested_quantity=quantity, urgency=urgency, notes=notes, requested_by=user
+                    ))
+                elif quantity > existing.requested_quantity or URGENCY_ORDER.index(urgency) > URGENCY_ORDER.index(existing.urgency):
+                    existing.requested_quantity = max(quantity, existing.requested_quantity)
+                    existing.urgency = max(urgency, existing.urgency, key=URGENCY_ORDER.index)
+                    existing.notes = notes
+                    existing.updated_at = started_at
+                    to_merge.append(existing)
+
+        ResupplyRequest.objects.bulk_create(to_create, batch_size=500)
+        ResupplyRequest.objects.bulk_update(
+            to_merge, ['requested_quantity', 'urgency', 'notes', 'updated_at'], batch_size=500
+        )
+        run.created_count = len(to_create)
+        run.merged_count = len(to_merge)
+        run.save()
+    return run
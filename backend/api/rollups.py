@@ -0,0 +1,245 @@
+"""
+Daily and weekly StockMovement rollups.
+
+Each rollup row holds units in, units out and the movement count for one
+(medicine, location, period, movement_type). A movement counts at its
+inventory's location; a transfer also counts as units in at its destination.
+
+New movements are folded in incrementally by `record_movements()` in the
+transaction that writes them (see `api.signals`). Edits, which cannot be
+applied as simple increments, re-aggregate the affected days with
+`rebuild()` once the transaction commits. The `rebuild_rollups` management
+command backfills or re-aggregates any date range from the raw table;
+rollups of archived months (see `api.archive`) are kept as they are.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, Q, Sum, Case, When, Value
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .archive import archived_until
+from .models import Inventory, StockMovement, DailyMovementRollup, WeeklyMovementRollup
+
+COUNTERS = ('units_in', 'units_out', 'movements')
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _totals(rows):
+    """
+    Fold (medicine, location, to_location, movement_type, day, units_in,
+    units_out, movements) rows into {(medicine, location, day, type): [in, out, count]}.
+    """
+    totals = defaultdict(lambda: [0, 0, 0])
+    for medicine, location, to_location, movement_type, day, units_in, units_out, movements in rows:
+        bucket = totals[(medicine, location, day, movement_type)]
+        bucket[0] += units_in
+        bucket[1] += units_out
+        bucket[2] += movements
+        if movement_type == 'transfer' and to_location is not None and to_location != location:
+            bucket = totals[(medicine, to_location, day, movement_type)]
+            bucket[0] += units_in + units_out
+            bucket[2] += movements
+    return totals
+
+
+def _weekly(totals):
+    weekly = defaultdict(lambda: [0, 0, 0])
+    for (medicine, location, day, movement_type), counters in totals.items():
+        bucket = weekly[(medicine, location, week_start(day), movement_type)]
+        for i, value in enumerate(counters):
+            bucket[i] += value
+    return weekly
+
+
+def _increment(model, period_field, totals):
+    """Add `totals` to existing rollup rows, creating the missing ones."""
+    if not totals:
+        return
+    existing = model.objects.select_for_update().filter(
+        medicine_id__in={key[0] for key in totals},
+        location_id__in={key[1] for key in totals},
+        **{f'{period_field}__in': {key[2] for key in totals}},
+        movement_type__in={key[3] for key in totals},
+    )
+    by_key = {(row.medicine_id, row.location_id, getattr(row, period_field), row.movement_type): row for row in existing}
+    to_update, to_create = [], []
+    for key, counters in totals.items():
+        row = by_key.get(key)
+        if row is None:
+            to_create.append(_row(model, period_field, key, counters))
+            continue
+        for name, value in zip(COUNTERS, counters):
+            setattr(row, name, getattr(row, name) + value)
+        to_update.append(row)
+    model.objects.bulk_update(to_update, COUNTERS, batch_size=500)
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(to_create, batch_size=500)
+    except IntegrityError:
+        # Another writer created some of these rows after our read; fall back
+        # to one atomic increment per row.
+        for row in to_create:
+            lookup = {'medicine_id': row.medicine_id, 'location_id': row.location_id,
+                      period_field: getattr(row, period_field), 'movement_type': row.movement_type}
+            updated = model.objects.filter(**lookup).update(
+                **{name: F(name) + getattr(row, name) for name in COUNTERS}
+            )
+            if not updated:
+                row.save()
+
+
+def _row(model, period_field, key, counters):
+    medicine, location, period, movement_type = key
+    return model(
+        medicine_id=medicine, location_id=location, movement_type=movement_type,
+        **{period_field: period}, **dict(zip(COUNTERS, counters))
+    )
+
+
+def record_movements(movements):
+    """Fold newly created StockMovement instances into the rollups."""
+    movements = [movement for movement in movements if movement.inventory_id is not None]
+    if not movements:
+        return
+    placement = {
+        pk: (medicine, location)
+        for pk, medicine, location in Inventory.objects.filter(
+            pk__in={movement.inventory_id for movement in movements}
+        ).values_list('id', 'batch__medicine_id', 'location_id')
+    }
+    rows = []
+    for movement in movements:
+        if movement.inventory_id not in placement:
+            continue
+        medicine, location = placement[movement.inventory_id]
+        change = movement.quantity_change
+        rows.append((
+            medicine, location, movement.to_location_id, movement.movement_type,
+            timezone.localdate(movement.created_at), max(change, 0), max(-change, 0), 1
+        ))
+    totals = _totals(rows)
+    _increment(DailyMovementRollup, 'day', totals)
+    _increment(WeeklyMovementRollup, 'week_start', _weekly(totals))
+
+
+def rebuild(start=None, end=None, medicines=None, locations=None):
+    """
+    Recompute daily rollups for the days from `start` to `end` (inclusive,
+    either open-ended) from the raw movements, optionally limited to some
+    medicines and locations, then recompute the weekly rows those days fall
+    in. Days before `archived_until()` are left as they are, since their
+    raw movements have been archived. Returns the number of daily rows
+    written.
+    """
+    boundary = archived_until()
+    if boundary is not None and (start is None or start < boundary):
+        start = boundary
+    movements = StockMovement.objects.filter(inventory__isnull=False)
+    daily = DailyMovementRollup.objects.all()
+    if start is not None:
+        movements = movements.filter(created_at__date__gte=start)
+        daily = daily.filter(day__gte=start)
+    if end is not None:
+        movements = movements.filter(created_at__date__lte=end)
+        daily = daily.filter(day__lte=end)
+    if medicines is not None:
+        movements = movements.filter(inventory__batch__medicine_id__in=medicines)
+        daily = daily.filter(medicine_id__in=medicines)
+    if locations is not None:
+        movements = movements.filter(Q(inventory__location_id__in=locations) | Q(to_location_id__in=locations))
+        daily = daily.filter(location_id__in=locations)
+
+    grouped = movements.annotate(day=TruncDate('created_at')).values_list(
+        'inventory__batch__medicine_id', 'inventory__location_id', 'to_location_id', 'movement_type', 'day'
+    ).annotate(
+        units_in=Sum(Case(When(quantity_change__gt=0, then=F('quantity_change')), default=Value(0), output_field=IntegerField())),
+        units_out=Sum(Case(When(quantity_change__lt=0, then=-F('quantity_change')), default=Value(0), output_field=IntegerField())),
+        movements=Count('id'),
+    ).order_by()
+    totals = _totals(grouped.iterator(chunk_size=5000))
+    if locations is not None:
+        allowed = set(locations)
+        totals = {key: counters for key, counters in totals.items() if key[1] in allowed}
+
+    with transaction.atomic():
+        daily.delete()
+        DailyMovementRollup.objects.bulk_create(
+            [_row(DailyMovementRollup, 'day', key, counters) for key, counters in totals.items()],
+            batch_size=1000
+        )
+        _rebuild_weekly(start, end, medicines, locations)
+    return len(totals)
+
+
+def _rebuild_weekly(start, end, medicines, locations):
+    weekly = WeeklyMovementRollup.objects.all()
+    daily = DailyMovementRollup.objects.all()
+    if start is not None:
+        weekly = weekly.filter(week_start__gte=week_start(start))
+        daily = daily.filter(day__gte=week_start(start))
+    if end is not None:
+        weekly = weekly.filter(week_start__lte=week_start(end))
+        daily = daily.filter(day__lt=week_start(end) + timedelta(days=7))
+    if medicines is not None:
+        weekly = weekly.filter(medicine_id__in=medicines)
+        daily = daily.filter(medicine_id__in=medicines)
+    if locations is not None:
+        weekly = weekly.filter(location_id__in=locations)
+        daily = daily.filter(location_id__in=locations)
+
+    totals = {
+        (medicine, location, day, movement_type): list(counters)
+        for medicine, location, day, movement_type, *counters in daily.values_list(
+            'medicine_id', 'location_id', 'day', 'movement_type', *COUNTERS
+        ).iterator(chunk_size=5000)
+    }
+    weekly.delete()
+    WeeklyMovementRollup.objects.bulk_create(
+        [_row(WeeklyMovementRollup, 'week_start', key, counters) for key, counters in _weekly(totals).items()],
+        batch_size=1000
+    )
+
+
+def rebuild_buckets(buckets):
+    """Re-aggregate (medicine, location, day) buckets, one pass per day."""
+    by_day = defaultdict(lambda: (set(), set()))
+    for medicine, location, day in buckets:
+        by_day[day][0].add(medicine)
+        by_day[day][1].add(location)
+    for day, (medicines, locations) in by_day.items():
+        rebuild(day, day, medicines, locations)
+
+
+def demand_series(medicine, location, start=None, end=None, movement_types=('distribution',)):
+    """
+    Units leaving `location` per day for one medicine, as a list of
+    (day, units) with missing days filled with zero, from the first
+    recorded day on or after `start` through `end`. Days before the series'
+    first record are left out rather than zero-filled, so a short history is
+    not padded with demand that never happened.
+
+    `end` defaults to yesterday: today's total is still growing, and a
+    partial day would read as a dip in demand.
+    """
+    if end is None:
+        end = timezone.localdate() - timedelta(days=1)
+    rows = DailyMovementRollup.objects.filter(
+        medicine_id=medicine, location_id=location, movement_type__in=movement_types, day__lte=end
+    )
+    if start is not None:
+        rows = rows.filter(day__gte=start)
+    units = dict(rows.values_list('day').annotate(total=Sum('units_out')).order_by())
+    if not units:
+        return []
+    day = min(units)
+    series = []
+    while day <= end:
+        series.append((day, units.get(day, 0)))
+        day += timedelta(days=1)
+    return series
@@ -0,0 +1,216 @@
+"""
+Shortest-path routing over the location graph.
+
+`LocationEdge` rows form a weighted, directed graph (bidirectional edges add
+both directions). `get_routing_table(metric)` loads the active edges once per
+process into a sparse adjacency matrix and caches a `RoutingTable`. Shortest
+paths come from SciPy's compiled Dijkstra, run backwards from each target so
+one pass yields the distance and next hop from every source; `prepare()`
+batches many targets into a single call. Rows are kept per target, so later
+"nearest source with stock" and route lookups are array reads.
+
+The cache is keyed on the edge count and latest `updated_at`, so edge writes
+made through the ORM or the API (in any process) invalidate it on the next
+lookup. Raw queryset `.update()` calls that skip `updated_at` do not.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from django.db.models import Count, Max
+
+from .models import Location, LocationEdge
+
+METRICS = ('transit_hours', 'cost')
+# Each cached target holds a distance and a next-hop entry per location;
+# the per-process cache evicts least recently used targets beyond this size.
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+# csgraph treats explicit zeros as missing edges, so free links get a token weight.
+MIN_WEIGHT = 1e-9
+
+_tables = {}
+
+
+class RoutingTable:
+    def __init__(self, edges, metric='transit_hours', version=None):
+        self.metric = metric
+        self.version = version
+        weights = {}
+        for from_id, to_id, weight, bidirectional in edges:
+            pairs = [(from_id, to_id), (to_id, from_id)] if bidirectional else [(from_id, to_id)]
+            for pair in pairs:
+                weights[pair] = min(weight, weights.get(pair, weight))
+        self.ids = np.array(sorted({pk for pair in weights for pk in pair}), dtype=np.int64)
+        self.index = {int(pk): i for i, pk in enumerate(self.ids)}
+        size = len(self.ids)
+        # Stored reversed (target -> source) so a search from a target
+        # reaches every location that can ship to it.
+        rows = [self.index[to_id] for _, to_id in weights]
+        cols = [self.index[from_id] for from_id, _ in weights]
+        data = [max(weight, MIN_WEIGHT) for weight in weights.values()]
+        self.reverse = csr_matrix((data, (rows, cols)), shape=(size, size))
+        self._targets = OrderedDict()
+        # Guards `_targets`; searches run outside it.
+        self._lock = threading.Lock()
+
+    def prepare(self, targets):
+        """Run one batched search for every target not already cached. Returns the new rows by index."""
+        with self._lock:
+            missing = sorted({
+                self.index[target] for target in targets
+                if target in self.index and self.index[target] not in self._targets
+            })
+        if not missing:
+            return {}
+        distances, next_hops = dijkstra(self.reverse, indices=missing, return_predecessors=True)
+        rows = {i: (distance, next_hop) for i, distance, next_hop in zip(missing, distances, next_hops)}
+        limit = max(1, MAX_CACHE_BYTES // max(1, distances.itemsize * 2 * len(self.ids)))
+        with self._lock:
+            self._targets.update(rows)
+            while len(self._targets) > limit:
+                self._targets.popitem(last=False)
+        return rows
+
+    def _row(self, target):
+        i = self.index.get(target)
+        if i is None:
+            return None
+        with self._lock:
+            row = self._targets.get(i)
+            if row is not None:
+                self._targets.move_to_end(i)
+                return row
+        # Another thread may evict the row again before it is read back.
+        return self.prepare([target]).get(i) or self._row(target)
+
+    def distance(self, source, target):
+        """Shortest distance from `source` to `target`, or None if unreachable."""
+        row = self._row(target)
+        if row is None or source not in self.index:
+            return None
+        distance = row[0][self.index[source]]
+        return float(distance) if np.isfinite(distance) else None
+
+    def path(self, source, target):
+        """Location ids along the shortest route, or None if unreachable."""
+        if self.distance(source, target) is None:
+            return None
+        next_hop = self._row(target)[1]
+        goal = self.index[target]
+        node = self.index[source]
+        route = [source]
+        while node != goal:
+            node = next_hop[node]
+            route.append(int(self.ids[node]))
+        return route
+
+    def nearest(self, target, candidates):
+        """
+        Locations in `candidates` that can reach `target`, as (distance,
+        location id) pairs, nearest first.
+        """
+        row = self._row(target)
+        known = [pk for pk in candidates if pk in self.index and pk != target]
+        if row is None or not known:
+            return []
+        distances = row[0][[self.index[pk] for pk in known]]
+        order = np.argsort(distances, kind='stable')
+        order = order[np.isfinite(distances[order])].tolist()
+        return list(zip(distances[order].tolist(), [known[i] for i in order]))
+
+
+def _graph_version():
+    stamp = LocationEdge.objects.aggregate(count=Count('id'), changed=Max('updated_at'))
+    return stamp['count'], stamp['changed']
+
+
+def get_routing_table(metric='transit_hours'):
+    if metric not in METRICS:
+        raise ValueError(f"Unknown routing metric '{metric}'")
+    version = _graph_version()
+    cached = _tables.get(metric)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    edges = LocationEdge.objects.filter(is_active=True).values_list(
+        'from_location_id', 'to_location_id', metric, 'bidirectional'
+    )
+    table = RoutingTable(edges, metric, version)
+    _tables[metric] = (version, table)
+    return table
+
+
+def _surplus_sources(table, target, surplus, candidates):
+    """Yield (distance, location name) for surplus locations, nearest first, then unroutable ones."""
+    visited = set()
+    if target is not None:
+        for distance, source in table.nearest(target, candidates):
+            name = candidates[source]
+            visited.add(name)
+            if surplus[name] > 0:
+                yield distance, name
+    for name in list(surplus):
+        if name not in visited and surplus[name] > 0:
+            yield None, name
+
+
+def suggest_redirections(current_stock, demand_forecasts, threshold=0.2, metric='transit_hours'):
+    """
+    Match surplus stock to shortages, nearest source first.
+
+    `current_stock` and `demand_forecasts` map location name -> medicine ->
+    quantity. A location has a surplus when stock exceeds demand by more
+    than `threshold`, and a shortage when it falls short by more than
+    `threshold`. Shortages are filled worst-first from the closest surplus
+    locations on the graph; surplus at locations the graph cannot route from
+    is used last, in input order.
+    """
+    table = get_routing_table(metric)
+    ids = dict(Location.objects.filter(name__in=list(current_stock)).values_list('name', 'id'))
+    names = {pk: name for name, pk in ids.items()}
+
+    table.prepare(ids.values())
+    medicines = dict.fromkeys(medicine for stock_data in current_stock.values() for medicine in stock_data)
+
+    suggestions = []
+    for medicine in medicines:
+        surplus = {}
+        shortages = []
+        for location, stock_data in current_stock.items():
+            quantity = stock_data.get(medicine, 0)
+            demand = demand_forecasts.get(location, {}).get(medicine, 0)
+            if demand <= 0:
+                continue
+            ratio = quantity / demand
+            if ratio > (1 + threshold):
+                surplus[location] = quantity - demand
+            elif ratio < (1 - threshold):
+                shortages.append((ratio, location, demand - quantity))
+
+        candidates = {ids[name]: name for name in surplus if name in ids}
+        for _, location, need in sorted(shortages, key=lambda shortage: shortage[0]):
+            target = ids.get(location)
+            for distance, source in _surplus_sources(table, target, surplus, candidates):
+                if need <= 0:
+                    break
+                transfer_amount = min(surplus[source], need)
+                surplus[source] -= transfer_amount
+                need -= transfer_amount
+                suggestions.append({
+                    'from_location': source,
+                    'to_location': location,
+                    'medicine': medicine,
+                    'suggested_quantity': transfer_amount,
+                    metric: distance,
+                    'route': table.path(ids[source], target) if distance is not None else None,
+                    'reason': f"Surplus at {source}, shortage at {location}"
+                })
+
+    # Routes may pass through locations that were not in the request.
+    hops = {pk for suggestion in suggestions for pk in suggestion['route'] or ()}
+    names.update(Location.objects.filter(pk__in=hops - set(names)).values_list('id', 'name'))
+    for suggestion in suggestions:
+        if suggestion['route']:
+            suggestion['route'] = [names[pk] for pk in suggestion['route']]
+    return suggestions
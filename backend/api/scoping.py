@@ -0,0 +1,73 @@
+"""
+Per-user data scoping.
+
+`location_scope(user)` returns the ids of the locations a user's requests may
+touch, or None when the user is not restricted:
+
+- staff, and users without a profile, are not restricted;
+- a profile with assigned `locations` is limited to them;
+- otherwise a profile with an organization is limited to that
+  organization's locations;
+- a profile with neither, or whose organization has no locations yet,
+  keeps network-wide access, as before scoping.
+
+Both are assigned by admins; users cannot set them through the API.
+
+Viewsets apply the scope as an `IN` filter on indexed location foreign keys
+(see `ScopedQuerysetMixin` in `api.views`), so a pharmacist's list queries
+read only their own rows instead of filtering the whole network client-side.
+The scope is computed once per request.
+"""
+from django.db.models import Q
+
+from .models import Location, UserProfile
+
+
+def location_scope(user):
+    if not user.is_authenticated:
+        return frozenset()
+    if user.is_staff:
+        return None
+    profile = UserProfile.objects.filter(user=user).values('id', 'organization').first()
+    if profile is None:
+        return None
+    assigned = frozenset(
+        UserProfile.locations.through.objects.filter(userprofile_id=profile['id']).values_list('location_id', flat=True)
+    )
+    if assigned:
+        return assigned
+    if profile['organization']:
+        # Locations are tagged with their organization by admins; until
+        # then, an organization name alone restricts nothing.
+        return frozenset(Location.objects.filter(organization=profile['organization']).values_list('id', flat=True)) or None
+    return None
+
+
+def request_scope(request):
+    """`location_scope` for the request's user, computed once per request."""
+    if not hasattr(request, '_location_scope'):
+        request._location_scope = location_scope(request.user)
+    return request._location_scope
+
+
+def scope_filter(scope, *fields):
+    """Q matching rows whose location, through any of `fields`, is in `scope`."""
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{f'{field}__in': scope})
+    return condition
+
+
+def scope_queryset(queryset, scope, *fields):
+    if scope is None or not fields:
+        return queryset
+    return queryset.filter(scope_filter(scope, *fields))
+
+
+def in_scope(scope, location_id):
+    if scope is None:
+        return True
+    try:
+        return int(location_id) in scope
+    except (TypeError, ValueError):
+        return False
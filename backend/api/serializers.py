@@ -1,8 +1,311 @@
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator, UniqueTogetherValidator
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils import timezone
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from .models import Medicine, Manufacturer, ProductionBatch, Location, Inventory, StockMovement, ResupplyRequest, DemandForecast, UserProfile
+from .models import Medicine, Manufacturer, ProductionBatch, Location, LocationEdge, Inventory, StockMovement, ResupplyRequest, ResupplyPlanRun, DemandForecast, DemandAnomaly, UserProfile
+from .stock import provision_batches
+
+def request_today(serializer):
+    """Today's date, computed once per serialization rather than once per row."""
+    context = serializer.context
+    if 'today' not in context:
+        context['today'] = timezone.now().date()
+    return context['today']
+
+
+def sparse_field_names(names, query_params):
+    """Apply `?fields=` and `?exclude=` to an ordered collection of field names. `id` is always kept."""
+    names = list(names)
+    if query_params.get('fields'):
+        wanted = {name.strip() for name in query_params['fields'].split(',')}
+        names = [name for name in names if name in wanted or name == 'id']
+    if query_params.get('exclude'):
+        unwanted = {name.strip() for name in query_params['exclude'].split(',')}
+        names = [name for name in names if name not in unwanted]
+    return names
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer mixin for `?fields=a,b` and `?exclude=c` on read requests.
+
+    Only the top-level serializer (or the child of a top-level list) is
+    narrowed. `sparse_orm_paths()` reports which model columns and relations
+    the remaining fields read, so the view can narrow its queryset to match.
+    Computed fields declare their dependencies in `Meta.sparse_sources`.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in ('GET', 'HEAD') or not self._is_sparse_root():
+            return fields
+        names = sparse_field_names(fields, request.query_params)
+        return {name: fields[name] for name in names}
+
+    def _is_sparse_root(self):
+        parent = self.parent
+        return parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None)
+
+    def sparse_orm_paths(self):
+        """
+        Return (only_paths, select_related_paths) for the readable fields, or
+        None when a field's dependencies are unknown and the query must not
+        be narrowed.
+        """
+        dependencies = getattr(self.Meta, 'sparse_sources', {})
+        only, related = set(), set()
+        for name, field in self.fields.items():
+            if field.write_only:
+                continue
+            if name in dependencies:
+                sources = dependencies[name]
+            elif isinstance(field, serializers.SerializerMethodField) or field.source == '*':
+                return None
+            else:
+                sources = ['__'.join(field.source_attrs)]
+            for source in sources:
+                parts = source.split('__')
+                for depth in range(1, len(parts)):
+                    related.add('__'.join(parts[:depth]))
+                    only.add('__'.join(parts[:depth]))
+                only.add(source)
+        # Keep only the deepest relations; select_related follows the chain.
+        related = {path for path in related if not any(other.startswith(path + '__') for other in related)}
+        return only, related
+
+
+class PrefetchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key field that resolves against objects prefetched by a
+    `BulkListSerializer`, so a bulk payload costs one query per related model
+    instead of one per row. Outside bulk writes it behaves like the parent.
+    """
+
+    def to_internal_value(self, data):
+        cache = getattr(self.root, 'related_cache', {}).get(self.field_name)
+        if cache is None:
+            return super().to_internal_value(data)
+        try:
+            pk = self.get_queryset().model._meta.pk.to_python(data)
+        except (DjangoValidationError, TypeError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return cache[pk]
+        except (KeyError, TypeError):
+            self.fail('does_not_exist', pk_value=data)
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    List serializer for bulk create, update and upsert.
+
+    Rows are validated in one pass: related objects are prefetched with one
+    query per model, unique fields are checked with one query per field, and
+    rows are written with `bulk_create`/`bulk_update`. Updates match rows by
+    `id`; upserts match on the child serializer's `Meta.upsert_fields`.
+    """
+
+    def __init__(self, *args, mode='create', **kwargs):
+        self.mode = mode
+        self.related_cache = {}
+        self.matched = []
+        super().__init__(*args, **kwargs)
+
+    @property
+    def model(self):
+        return self.child.Meta.model
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            return super().to_internal_value(data)
+
+        self._prefetch_related(data)
+        instances = self._match_instances(data)
+        unique_sources = self._defer_unique_validators()
+
+        self.matched = []
+        ret = []
+        errors = {}
+        for index, item in enumerate(data):
+            instance = instances[index]
+            if self.mode == 'update' and instance is None:
+                errors[index] = {'id': ['No object with this id.']}
+                continue
+            self.child.instance = instance
+            self.child.initial_data = item
+            try:
+                validated = self.child.run_validation(item)
+            except serializers.ValidationError as exc:
+                errors[index] = exc.detail
+            else:
+                ret.append(validated)
+                self.matched.append(instance)
+            finally:
+                self.child.instance = None
+
+        if not errors and self.mode == 'upsert':
+            errors = self._check_upsert_keys(ret)
+        if not errors:
+            errors = self._check_unique(ret, unique_sources)
+        if errors:
+            raise serializers.ValidationError(errors)
+        return ret
+
+    def _prefetch_related(self, data):
+        for name, field in self.child.fields.items():
+            if field.read_only or not isinstance(field, PrefetchedPrimaryKeyRelatedField):
+                continue
+            model = field.get_queryset().model
+            pks = set()
+            for item in data:
+                if not isinstance(item, dict) or item.get(name) in (None, ''):
+                    continue
+                try:
+                    pks.add(model._meta.pk.to_python(item[name]))
+                except (DjangoValidationError, TypeError):
+                    continue
+            self.related_cache[name] = field.get_queryset().in_bulk(pks)
+
+    def _to_pk(self, value):
+        try:
+            return self.model._meta.pk.to_python(value)
+        except (DjangoValidationError, TypeError):
+            return None
+
+    def _match_instances(self, data):
+        if self.mode == 'update':
+            ids = [self._to_pk(item.get('id')) if isinstance(item, dict) else None for item in data]
+            existing = self.model.objects.in_bulk([pk for pk in ids if pk is not None])
+            return [existing.get(pk) for pk in ids]
+        if self.mode == 'upsert':
+            key_fields = self.child.Meta.upsert_fields
+            keys = [
+                tuple(item.get(field) for field in key_fields) if isinstance(item, dict) else None
+                for item in data
+            ]
+            existing = self.model.objects.filter(**{
+                f'{key_fields[0]}__in': {key[0] for key in keys if key is not None}
+            })
+            attnames = [self.model._meta.get_field(field).attname for field in key_fields]
+            by_key = {tuple(getattr(obj, attname) for attname in attnames): obj for obj in existing}
+            return [by_key.get(key) for key in keys]
+        return [None] * len(data)
+
+    def _check_upsert_keys(self, rows):
+        """Upsert rows sharing a key would all be planned as creates; reject the repeats."""
+        key_fields = self.child.Meta.upsert_fields
+        label = ', '.join(key_fields)
+        errors, seen = {}, set()
+        for index, attrs in enumerate(rows):
+            key = tuple(getattr(attrs.get(field), 'pk', attrs.get(field)) for field in key_fields)
+            if key in seen:
+                errors[index] = {label: ['Duplicate value in this request.']}
+            seen.add(key)
+        return errors
+
+    def _defer_unique_validators(self):
+        """
+        Strip per-row UniqueValidators and UniqueTogetherValidators;
+        `_check_unique` replaces them with one query per field set.
+        """
+        sources = []
+        for name, field in self.child.fields.items():
+            unique = [validator for validator in field.validators if isinstance(validator, UniqueValidator)]
+            if unique:
+                field.validators = [validator for validator in field.validators if not isinstance(validator, UniqueValidator)]
+                sources.append((field.source,))
+        together = [validator for validator in self.child.validators if isinstance(validator, UniqueTogetherValidator)]
+        if together:
+            self.child.validators = [validator for validator in self.child.validators if not isinstance(validator, UniqueTogetherValidator)]
+            sources.extend(tuple(self.child.fields[name].source for name in validator.fields) for validator in together)
+        return sources
+
+    def _check_unique(self, rows, sources):
+        errors = {}
+        for source in sources:
+            label = ', '.join(source)
+            attnames = [self.model._meta.get_field(name).attname for name in source]
+            seen = {}
+            for index, attrs in enumerate(rows):
+                owner = self.matched[index]
+                if not any(name in attrs for name in source) or not all(name in attrs or owner is not None for name in source):
+                    continue
+                value = tuple(
+                    getattr(attrs[name], 'pk', attrs[name]) if name in attrs else getattr(owner, attname)
+                    for name, attname in zip(source, attnames)
+                )
+                if value in seen:
+                    errors.setdefault(index, {})[label] = ['Duplicate value in this request.']
+                seen[value] = index
+            if not seen:
+                continue
+            taken = {
+                row[:-1]: row[-1]
+                for row in self.model.objects.filter(**{
+                    f'{attnames[0]}__in': {value[0] for value in seen}
+                }).values_list(*attnames, 'pk')
+                if row[:-1] in seen
+            }
+            for value, index in seen.items():
+                owner = self.matched[index]
+                if value in taken and (owner is None or owner.pk != taken[value]):
+                    errors.setdefault(index, {})[label] = [f'{self.model._meta.verbose_name} with this {label} already exists.']
+        return errors
+
+    def save(self, **kwargs):
+        validated_data = [{**attrs, **kwargs} for attrs in self.validated_data]
+        to_create = [attrs for attrs, instance in zip(validated_data, self.matched) if instance is None]
+        to_update = [(instance, attrs) for attrs, instance in zip(validated_data, self.matched) if instance is not None]
+        self.created = self.create(to_create) if to_create else []
+        self.updated = self.update(*zip(*to_update)) if to_update else []
+        self.instance = self.created + self.updated
+        return self.instance
+
+    def create(self, validated_data):
+        return self.model.objects.bulk_create(
+            [self.model(**attrs) for attrs in validated_data], batch_size=500
+        )
+
+    def update(self, instance, validated_data):
+        fields = set()
+        for obj, attrs in zip(instance, validated_data):
+            for attr, value in attrs.items():
+                setattr(obj, attr, value)
+            fields.update(attrs)
+        # bulk_update skips pre_save, so auto_now columns are stamped here.
+        now = timezone.now()
+        for field in self.model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False):
+                for obj in instance:
+                    setattr(obj, field.attname, now)
+                fields.add(field.name)
+        if fields:
+            self.model.objects.bulk_update(instance, sorted(fields), batch_size=500)
+        return list(instance)
+
+
+class ProductionRunListSerializer(BulkListSerializer):
+    """
+    Bulk serializer for production batches. New batches are provisioned at
+    their `initial_location` in the same transaction, with the batches, their
+    Inventory rows and their production movements each bulk-inserted.
+    """
+
+    def create(self, validated_data):
+        locations = [attrs.pop('initial_location') for attrs in validated_data]
+        batches = super().create(validated_data)
+        self.inventories = provision_batches(batches, locations, self.context['request'].user)
+        return batches
+
+    def update(self, instance, validated_data):
+        for attrs in validated_data:
+            attrs.pop('initial_location', None)
+        return super().update(instance, validated_data)
+
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
     @classmethod
@@ -21,7 +324,10 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
 class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserProfile
-        fields = ['role', 'organization', 'phone']
+        fields = ['role', 'organization', 'phone', 'locations']
+        # Organization and locations decide what a user may see (see
+        # api.scoping), so only admins assign them.
+        read_only_fields = ['organization', 'locations']
 
 class UserSerializer(serializers.ModelSerializer):
     profile = UserProfileSerializer(required=True)
@@ -62,48 +368,90 @@ class RegisterSerializer(serializers.ModelSerializer):
         UserProfile.objects.create(
             user=user,
             role=profile_data['role'],
-            organization=profile_data.get('organization', ''),
             phone=profile_data.get('phone', '')
         )
         
         return user
 
-class MedicineSerializer(serializers.ModelSerializer):
+class MedicineSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Medicine
         fields = '__all__'
+        upsert_fields = ('name', 'strength')
 
-class ManufacturerSerializer(serializers.ModelSerializer):
+class ManufacturerSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Manufacturer
         fields = '__all__'
+        upsert_fields = ('name',)
 
-class ProductionBatchSerializer(serializers.ModelSerializer):
+class ProductionBatchSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
     medicine_name = serializers.CharField(source='medicine.name', read_only=True)
     manufacturer_name = serializers.CharField(source='manufacturer.name', read_only=True)
     days_to_expiry = serializers.SerializerMethodField()
+    initial_location = PrefetchedPrimaryKeyRelatedField(
+        queryset=Location.objects.all(), write_only=True, required=False
+    )
     
     class Meta:
         model = ProductionBatch
         fields = '__all__'
+        sparse_sources = {'days_to_expiry': ['expiry_date']}
+        upsert_fields = ('batch_number',)
     
     def get_days_to_expiry(self, obj):
-        from django.utils import timezone
-        from datetime import datetime
-        today = timezone.now().date()
+        today = request_today(self)
         return (obj.expiry_date - today).days
+    
+    def validate(self, attrs):
+        if self.instance is None and not attrs.get('initial_location'):
+            raise serializers.ValidationError({'initial_location': 'New batches need an initial location to stock.'})
+        return attrs
+    
+    def create(self, validated_data):
+        location = validated_data.pop('initial_location')
+        batch = super().create(validated_data)
+        provision_batches([batch], [location], self.context['request'].user)
+        return batch
+    
+    def update(self, instance, validated_data):
+        validated_data.pop('initial_location', None)
+        return super().update(instance, validated_data)
 
-class LocationSerializer(serializers.ModelSerializer):
+class LocationSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     inventory_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Location
         fields = '__all__'
+        sparse_sources = {'inventory_count': []}
+        upsert_fields = ('name',)
     
     def get_inventory_count(self, obj):
         return Inventory.objects.filter(location=obj).count()
 
-class InventorySerializer(serializers.ModelSerializer):
+class LocationEdgeSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
+    from_location_name = serializers.CharField(source='from_location.name', read_only=True)
+    to_location_name = serializers.CharField(source='to_location.name', read_only=True)
+
+    class Meta:
+        model = LocationEdge
+        fields = '__all__'
+        upsert_fields = ('from_location', 'to_location')
+
+    def validate(self, attrs):
+        from_location = attrs.get('from_location', getattr(self.instance, 'from_location', None))
+        to_location = attrs.get('to_location', getattr(self.instance, 'to_location', None))
+        if from_location is not None and from_location == to_location:
+            raise serializers.ValidationError('An edge must connect two different locations.')
+        for field in ('transit_hours', 'cost'):
+            if attrs.get(field, 0) < 0:
+                raise serializers.ValidationError({field: 'Must not be negative.'})
+        return attrs
+
+class InventorySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     medicine_name = serializers.CharField(source='batch.medicine.name', read_only=True)
     batch_number = serializers.CharField(source='batch.batch_number', read_only=True)
     location_name = serializers.CharField(source='location.name', read_only=True)
@@ -113,13 +461,13 @@ class InventorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Inventory
         fields = '__all__'
+        sparse_sources = {'days_to_expiry': ['batch__expiry_date']}
     
     def get_days_to_expiry(self, obj):
-        from django.utils import timezone
-        today = timezone.now().date()
+        today = request_today(self)
         return (obj.batch.expiry_date - today).days
 
-class StockMovementSerializer(serializers.ModelSerializer):
+class StockMovementSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     from_location_name = serializers.CharField(source='from_location.name', read_only=True, allow_null=True)
     to_location_name = serializers.CharField(source='to_location.name', read_only=True, allow_null=True)
     created_by_username = serializers.CharField(source='created_by.username', read_only=True)
@@ -128,13 +476,14 @@ class StockMovementSerializer(serializers.ModelSerializer):
     class Meta:
         model = StockMovement
         fields = '__all__'
+        sparse_sources = {'medicine_name': ['inventory__batch__medicine__name']}
     
     def get_medicine_name(self, obj):
         if obj.inventory and obj.inventory.batch:
             return obj.inventory.batch.medicine.name
         return None
 
-class ResupplyRequestSerializer(serializers.ModelSerializer):
+class ResupplyRequestSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     medicine_name = serializers.CharField(source='medicine.name', read_only=True)
     location_name = serializers.CharField(source='requesting_location.name', read_only=True)
     requested_by_name = serializers.CharField(source='requested_by.username', read_only=True)
@@ -143,13 +492,18 @@ class ResupplyRequestSerializer(serializers.ModelSerializer):
     class Meta:
         model = ResupplyRequest
         fields = '__all__'
+        sparse_sources = {'days_since_request': ['created_at']}
     
     def get_days_since_request(self, obj):
-        from django.utils import timezone
-        today = timezone.now().date()
+        today = request_today(self)
         return (today - obj.created_at.date()).days
 
-class DemandForecastSerializer(serializers.ModelSerializer):
+class ResupplyPlanRunSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ResupplyPlanRun
+        fields = '__all__'
+
+class DemandForecastSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     medicine_name = serializers.CharField(source='medicine.name', read_only=True)
     location_name = serializers.CharField(source='location.name', read_only=True)
     days_until_forecast = serializers.SerializerMethodField()
@@ -157,8 +511,18 @@ class DemandForecastSerializer(serializers.ModelSerializer):
     class Meta:
         model = DemandForecast
         fields = '__all__'
+        sparse_sources = {'days_until_forecast': ['forecast_date']}
     
     def get_days_until_forecast(self, obj):
-        from django.utils import timezone
-        today = timezone.now().date()
-        return (obj.forecast_date - today).days
\ No newline at end of file
+        today = request_today(self)
+        return (obj.forecast_date - today).days
+
+class DemandAnomalySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    medicine_name = serializers.CharField(source='medicine.name', read_only=True)
+    location_name = serializers.CharField(source='location.name', read_only=True)
+
+    class Meta:
+        model = DemandAnomaly
+        fields = '__all__'
+        # Flags are written by the detector; reviewers only set status and notes.
+        read_only_fields = ['medicine', 'location', 'day', 'units', 'expected', 'threshold', 'score']
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+Stock movement signals.
+
+`movements_recorded` fires for every batch of newly written StockMovement
+rows, including bulk inserts that bypass `post_save` (callers of
+`bulk_create` send it themselves). Receivers run inside the writing
+transaction. Edits to existing movements schedule a rollup re-aggregation
+for the affected days when the transaction commits.
+
+Deletes are not tracked: a post_delete receiver would disable Django's fast
+cascade delete for the movement table. Rollups of deleted medicines and
+locations cascade with them; after deleting movements otherwise, run the
+`rebuild_rollups` command for the affected range.
+
+Deleted medicines and inventory rows leave a `SyncTombstone` so delta-sync
+clients (see `api.sync`) learn about the deletion.
+
+Inventory saves and recorded movements queue push events (see `api.push`)
+for the rows they touched.
+
+Recorded distributions also feed the demand anomaly detector (see
+`api.anomalies`), after the rollups it reads have been updated.
+"""
+import threading
+
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from .models import Medicine, Inventory, StockMovement, SyncTombstone
+from . import anomalies, push, rollups
+
+movements_recorded = Signal()
+
+# Delta-synced models by sync table name.
+SYNC_TABLE_NAMES = {Medicine: 'medicines', Inventory: 'inventory'}
+
+_pending = threading.local()
+
+
+def _buckets(inventory_id, to_location_id, created_at):
+    placement = Inventory.objects.filter(pk=inventory_id).values_list('batch__medicine_id', 'location_id').first()
+    if placement is None or created_at is None:
+        return []
+    medicine, location = placement
+    day = timezone.localdate(created_at)
+    buckets = [(medicine, location, day)]
+    if to_location_id is not None:
+        buckets.append((medicine, to_location_id, day))
+    return buckets
+
+
+def _schedule_rebuild(buckets):
+    """
+    Queue buckets for re-aggregation after commit. Every edit registers a
+    callback, but the first one to run drains the shared queue, so many
+    edits in one transaction cost one rebuild per affected day.
+    """
+    if not buckets:
+        return
+    _pending.__dict__.setdefault('buckets', set()).update(buckets)
+    transaction.on_commit(_flush_rebuilds)
+
+
+def _flush_rebuilds():
+    buckets = getattr(_pending, 'buckets', None)
+    if buckets:
+        _pending.buckets = set()
+        rollups.rebuild_buckets(buckets)
+
+
+@receiver(movements_recorded)
+def update_rollups(sender, movements, **kwargs):
+    rollups.record_movements(movements)
+
+
+@receiver(movements_recorded)
+def detect_anomalies(sender, movements, **kwargs):
+    anomalies.observe(movements)
+
+
+@receiver(movements_recorded)
+def push_movements(sender, movements, **kwargs):
+    push.inventory_changed(
+        {movement.inventory_id for movement in movements if movement.inventory_id is not None},
+        {
+            (movement.inventory_id, movement.to_location_id) for movement in movements
+            if movement.movement_type == 'transfer' and movement.to_location_id is not None
+        }
+    )
+
+
+@receiver(post_save, sender=Inventory)
+def push_inventory_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        push.inventory_changed([instance.pk])
+
+
+@receiver(pre_save, sender=StockMovement)
+def remember_movement_bucket(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    previous = StockMovement.objects.filter(pk=instance.pk).values_list(
+        'inventory_id', 'to_location_id', 'created_at'
+    ).first()
+    instance._previous_buckets = _buckets(*previous) if previous else []
+
+
+@receiver(post_save, sender=StockMovement)
+def movement_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        movements_recorded.send(sender=StockMovement, movements=[instance])
+        return
+    _schedule_rebuild(
+        getattr(instance, '_previous_buckets', [])
+        + _buckets(instance.inventory_id, instance.to_location_id, instance.created_at)
+    )
+
+
+@receiver(post_delete, sender=Medicine)
+@receiver(post_delete, sender=Inventory)
+def record_tombstone(sender, instance, **kwargs):
+    SyncTombstone.objects.create(table=SYNC_TABLE_NAMES[sender], object_id=instance.pk)
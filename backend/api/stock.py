@@ -0,0 +1,34 @@
+"""
+Stock write helpers shared by the single-object and bulk endpoints.
+"""
+from .models import Inventory, StockMovement
+from .signals import movements_recorded
+
+
+def provision_batches(batches, locations, user, notes=None):
+    """
+    Create the opening Inventory row and production movement for each newly
+    produced batch at its initial location.
+
+    Both tables are written with one bulk insert each, so a production run of
+    any size costs two INSERTs. Bulk inserts skip `post_save`, so
+    `movements_recorded` is sent for the new movements here. Callers wrap
+    this in the transaction that created the batches.
+    """
+    inventories = Inventory.objects.bulk_create([
+        Inventory(batch=batch, location=location, quantity=batch.quantity)
+        for batch, location in zip(batches, locations)
+    ], batch_size=500)
+    movements = StockMovement.objects.bulk_create([
+        StockMovement(
+            inventory=inventory,
+            movement_type='production',
+            quantity_change=batch.quantity,
+            to_location=location,
+            notes=notes or f"Initial production batch {batch.batch_number}",
+            created_by=user
+        )
+        for batch, location, inventory in zip(batches, locations, inventories)
+    ], batch_size=500)
+    movements_recorded.send(sender=StockMovement, movements=movements)
+    return inventories
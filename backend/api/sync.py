@@ -0,0 +1,265 @@
+"""
+Delta sync for offline-capable clients.
+
+`pull()` returns the rows of each synced table changed since the client's
+sync token, plus the ids deleted since then (from `SyncTombstone`), and a
+new token to send next time. Without a token, or with one older than the
+tombstone retention, a table is sent in full and listed under `reset` so
+the client replaces its local copy. Rows come in (changed-at, id) order in
+pages of `limit`; `has_more` tells the client to pull again straight away.
+
+Once a table is caught up, the next token is rewound by `OVERLAP_SECONDS`.
+A change committed slightly after its timestamp was taken would otherwise
+be skipped, so recent rows may be sent twice. Clients upsert by id, so the
+repeat is harmless.
+
+`apply_offline_changes()` takes stock changes queued while a terminal was
+offline. They are applied as deltas, so they merge with whatever happened
+on the server in the meantime. Each change carries a client id that is
+recorded as an idempotency key, so re-uploading a batch never applies a
+change twice.
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .fast_serializers import MedicineValuesSerializer, InventoryValuesSerializer
+from .models import Medicine, Inventory, StockMovement, SyncTombstone, IdempotencyKey
+from .scoping import scope_queryset
+from .signals import SYNC_TABLE_NAMES, movements_recorded
+
+DEFAULTS = {
+    'TOMBSTONE_RETENTION_DAYS': 30,
+    'OVERLAP_SECONDS': 5,
+}
+
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 5000
+MAX_UPLOAD_CHANGES = 500
+UPLOAD_MOVEMENT_TYPES = ('adjustment', 'distribution', 'disposal')
+
+_TOKEN_SALT = 'api.sync'
+
+
+def get_setting(name):
+    return getattr(settings, 'SYNC', {}).get(name, DEFAULTS[name])
+
+
+class SyncTable:
+    def __init__(self, model, changed_field, serializer_class, filters=None, location_field=None):
+        self.name = SYNC_TABLE_NAMES[model]
+        self.model = model
+        self.changed_field = changed_field
+        self.serializer_class = serializer_class
+        self.filters = filters or {}
+        self.location_field = location_field
+
+    def scope(self, params, locations=None):
+        scope = {name: params[name] for name in self.filters if params.get(name)}
+        if self.location_field and locations is not None:
+            scope['locations'] = sorted(locations)
+        return scope
+
+    def changed_rows(self, scope, since, last_id, limit):
+        queryset = self.model.objects.filter(**{
+            self.filters[name]: value for name, value in scope.items() if name != 'locations'
+        })
+        if 'locations' in scope:
+            queryset = queryset.filter(**{f'{self.location_field}__in': scope['locations']})
+        if since is not None:
+            queryset = queryset.filter(
+                Q(**{f'{self.changed_field}__gt': since})
+                | Q(**{self.changed_field: since, 'id__gt': last_id})
+            )
+        rows = self.serializer_class(queryset).get_values_queryset()
+        return list(rows.order_by(self.changed_field, 'id')[:limit])
+
+
+SYNC_TABLES = {
+    table.name: table for table in (
+        SyncTable(Medicine, 'updated_at', MedicineValuesSerializer),
+        SyncTable(Inventory, 'last_updated', InventoryValuesSerializer, {'location': 'location_id'}, 'location_id'),
+    )
+}
+
+
+def _read_token(token):
+    if not token:
+        return {}
+    try:
+        return signing.loads(token, salt=_TOKEN_SALT)
+    except signing.BadSignature:
+        raise ValueError('Invalid sync token')
+
+
+def _timestamp(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def pull(token=None, tables=None, params=None, limit=DEFAULT_LIMIT, locations=None):
+    """
+    Changes and deletions since `token` for the named tables. `params`
+    narrows tables that support it (inventory by `location`), as does the
+    user's location scope `locations` (see `api.scoping`); changing either
+    resets the affected tables. Raises ValueError for a bad token or table.
+    """
+    tables = list(SYNC_TABLES) if tables is None else tables
+    unknown = [name for name in tables if name not in SYNC_TABLES]
+    if unknown:
+        raise ValueError(f"Unknown sync tables: {', '.join(unknown)}; expected {', '.join(SYNC_TABLES)}")
+    params = params or {}
+    cursors = _read_token(token)
+    now = timezone.now()
+    horizon = now - timedelta(days=get_setting('TOMBSTONE_RETENTION_DAYS'))
+    rewound = (now - timedelta(seconds=get_setting('OVERLAP_SECONDS'))).isoformat()
+
+    result = {'token': None, 'has_more': False, 'reset': [], 'changes': {}, 'deleted': {}}
+    next_cursors = {}
+    for name in tables:
+        table = SYNC_TABLES[name]
+        scope = table.scope(params, locations)
+        cursor = cursors.get(name)
+        if cursor is not None and (cursor['scope'] != scope or _timestamp(cursor['deleted_since']) < horizon):
+            cursor = None
+        if cursor is None:
+            # Deletions before a full copy do not concern the client.
+            cursor = {'since': None, 'last_id': 0, 'deleted_since': rewound, 'scope': scope, 'reset': True}
+
+        rows = table.changed_rows(scope, _timestamp(cursor['since']), cursor['last_id'], limit + 1)
+        more = len(rows) > limit
+        rows = rows[:limit]
+        deleted = SyncTombstone.objects.filter(
+            table=name, deleted_at__gt=_timestamp(cursor['deleted_since'])
+        ).values_list('object_id', flat=True)
+
+        if cursor['reset']:
+            result['reset'].append(name)
+        result['changes'][name] = rows
+        result['deleted'][name] = sorted(set(deleted))
+        result['has_more'] = result['has_more'] or more
+        if more:
+            last = rows[-1]
+            since, last_id = last[table.changed_field].isoformat(), last['id']
+        else:
+            since, last_id = rewound, 0
+        next_cursors[name] = {
+            'since': since, 'last_id': last_id, 'deleted_since': rewound, 'scope': scope,
+            # A reset stays a reset until its last page, so the client keeps
+            # replacing rather than merging.
+            'reset': cursor['reset'] and more,
+        }
+
+    # Tables not pulled this time keep their cursors.
+    result['token'] = signing.dumps({**cursors, **next_cursors}, salt=_TOKEN_SALT, compress=True)
+    purge_tombstones(horizon)
+    return result
+
+
+def purge_tombstones(before):
+    SyncTombstone.objects.filter(deleted_at__lt=before).delete()
+
+
+def _validate_change(change):
+    if not isinstance(change, dict):
+        return 'Each change must be an object'
+    client_id = change.get('client_id')
+    if not isinstance(client_id, str) or not 0 < len(client_id) <= 200:
+        return 'client_id must be a string of at most 200 characters'
+    for field in ('inventory', 'quantity_change'):
+        if not isinstance(change.get(field), int) or isinstance(change.get(field), bool):
+            return f'{field} must be an integer'
+    if change['quantity_change'] == 0:
+        return 'quantity_change must not be zero'
+    if change.get('movement_type', 'adjustment') not in UPLOAD_MOVEMENT_TYPES:
+        return f"movement_type must be one of {', '.join(UPLOAD_MOVEMENT_TYPES)}"
+    return None
+
+
+def apply_offline_changes(user, changes, scope=None):
+    """
+    Apply a batch of offline stock changes in one transaction and return one
+    result per change: `applied` (with the movement id and new quantity),
+    `duplicate` (the stored result of an earlier upload) or `rejected` (with
+    an error; nothing was written for it, so the client may fix and resend).
+    Inventory outside the user's location `scope` (see `api.scoping`) is
+    rejected as not found.
+    """
+    now = timezone.now()
+    errors = [_validate_change(change) for change in changes]
+    keys = {
+        f"sync:{change['client_id']}": change
+        for change, error in zip(changes, errors) if error is None
+    }
+    results = []
+    movements = []
+    applied = []
+    with transaction.atomic():
+        # Locking the touched rows first also serializes concurrent uploads
+        # of the same change, so the duplicate check below is race-free.
+        inventories = scope_queryset(Inventory.objects.select_for_update(), scope, 'location').in_bulk(
+            {change['inventory'] for change in keys.values()}
+        )
+        done = {
+            record.key: record.response_body
+            for record in IdempotencyKey.objects.filter(
+                user=user, key__in=keys, status_code__isnull=False, expires_at__gt=now
+            )
+        }
+        changed = {}
+        for change, error in zip(changes, errors):
+            client_id = change.get('client_id') if isinstance(change, dict) else None
+            if error is not None:
+                results.append({'client_id': client_id, 'status': 'rejected', 'error': error})
+                continue
+            key = f'sync:{client_id}'
+            if key in done:
+                results.append({**done[key], 'status': 'duplicate'})
+                continue
+            inventory = inventories.get(change['inventory'])
+            if inventory is None:
+                results.append({'client_id': client_id, 'status': 'rejected', 'error': 'Inventory not found'})
+                continue
+            delta = change['quantity_change']
+            if inventory.quantity + delta < 0:
+                results.append({'client_id': client_id, 'status': 'rejected', 'error': 'Not enough stock available'})
+                continue
+
+            inventory.quantity += delta
+            inventory.last_updated = now
+            changed[inventory.pk] = inventory
+            notes = change.get('notes') or 'Offline stock change'
+            if change.get('recorded_at'):
+                notes = f"{notes} (recorded offline at {change['recorded_at']})"
+            movements.append(StockMovement(
+                inventory=inventory,
+                movement_type=change.get('movement_type', 'adjustment'),
+                quantity_change=delta,
+                from_location_id=inventory.location_id if delta < 0 else None,
+                to_location_id=inventory.location_id if delta > 0 else None,
+                notes=notes,
+                created_by=user
+            ))
+            result = {'client_id': client_id, 'status': 'applied', 'quantity': inventory.quantity}
+            results.append(result)
+            applied.append((key, result))
+            # A repeated client id later in the same batch is a duplicate too.
+            done[key] = result
+
+        Inventory.objects.bulk_update(changed.values(), ['quantity', 'last_updated'], batch_size=500)
+        movements = StockMovement.objects.bulk_create(movements, batch_size=500)
+        movements_recorded.send(sender=StockMovement, movements=movements)
+        for (key, result), movement in zip(applied, movements):
+            result['movement_id'] = movement.pk
+        expires_at = now + timedelta(days=get_setting('TOMBSTONE_RETENTION_DAYS'))
+        IdempotencyKey.objects.bulk_create([
+            IdempotencyKey(
+                user=user, key=key, fingerprint='', status_code=200,
+                response_body=result, expires_at=expires_at
+            )
+            for key, result in applied
+        ], batch_size=500)
+    return results
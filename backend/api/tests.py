@@ -1,3 +1,1308 @@
-from django.test import TestCase
+import csv
+import io
+import json
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import anomalies, archive, bootstrap, dashboard, exports, push, rebalancing, rollups, routing, waste
+from .ai import forecasting
+from .management.commands import run_benchmarks
+from .metrics import registry as metrics_registry, RollingHistogram
+from .models import (
+    Medicine, Manufacturer, ProductionBatch, Location, LocationEdge, Inventory, StockMovement,
+    DailyMovementRollup, WeeklyMovementRollup, ResupplyRequest, DemandForecast, DemandAnomaly, IdempotencyKey,
+    SyncTombstone, PushEvent, MovementArchive, UserProfile,
+)
+from .renderers import msgpack
+from .serializers import InventorySerializer, StockMovementSerializer
+
+
+class ApiTestCase(TestCase):
+    """A small network: one batch stocked at a warehouse, plus a pharmacy and a hospital."""
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        cls.staff = User.objects.create_user('staff', password='staff-Passw0rd!', is_staff=True)
+        cls.medicine = Medicine.objects.create(name='Amoxicillin', strength='500mg')
+        cls.manufacturer = Manufacturer.objects.create(name='Acme Pharma')
+        cls.batch = ProductionBatch.objects.create(
+            medicine=cls.medicine, manufacturer=cls.manufacturer, batch_number='B-1',
+            production_date=today - timedelta(days=30), expiry_date=today + timedelta(days=365), quantity=500,
+        )
+        cls.warehouse = Location.objects.create(name='Central Warehouse', location_type='warehouse')
+        cls.pharmacy = Location.objects.create(name='Main Street Pharmacy', location_type='pharmacy')
+        cls.hospital = Location.objects.create(name='City Hospital', location_type='hospital')
+        cls.stock = Inventory.objects.create(batch=cls.batch, location=cls.warehouse, quantity=500)
+
+    def setUp(self):
+        # Throttle buckets and cached payloads live in the cache.
+        cache.clear()
+        self.client = self.client_for(self.staff)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def pharmacist(self, username='pharmacist', locations=(), organization=''):
+        user = User.objects.create_user(username)
+        profile = UserProfile.objects.create(user=user, role='pharmacist', organization=organization)
+        profile.locations.set(locations)
+        return user
+
+    def quantity(self, location, batch=None):
+        row = Inventory.objects.filter(batch=batch or self.batch, location=location).first()
+        return row and row.quantity
+
+
+class TransferStockTests(ApiTestCase):
+    url = '/api/stock-movements/transfer_stock/'
+
+    def transfer(self, source, destination, quantity):
+        return self.client.post(self.url, {
+            'from_location': source.id, 'to_location': destination.id, 'batch': self.batch.id, 'quantity': quantity,
+        }, format='json')
+
+    def test_transfer_moves_stock_and_creates_the_destination_row(self):
+        response = self.transfer(self.warehouse, self.pharmacy, 120)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantity(self.warehouse), 380)
+        self.assertEqual(self.quantity(self.pharmacy), 120)
+        movement = StockMovement.objects.get(pk=response.data['movement_id'])
+        self.assertEqual((movement.movement_type, movement.quantity_change), ('transfer', -120))
+
+    def test_opposing_transfers_conserve_stock(self):
+        self.transfer(self.warehouse, self.pharmacy, 100)
+        self.assertEqual(self.transfer(self.pharmacy, self.warehouse, 40).status_code, 200)
+        self.assertEqual(self.quantity(self.warehouse), 440)
+        self.assertEqual(self.quantity(self.pharmacy), 60)
+
+    def test_both_rows_are_locked_in_one_statement_in_primary_key_order(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.transfer(self.warehouse, self.pharmacy, 10)
+        locking = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT') and 'FROM "api_inventory"' in query['sql'] and '"location_id" IN' in query['sql']
+        ]
+        self.assertEqual(len(locking), 1)
+        self.assertIn('ORDER BY "api_inventory"."id" ASC', locking[0])
+
+    def test_insufficient_stock_leaves_no_destination_row(self):
+        response = self.transfer(self.warehouse, self.hospital, 10_000)
+        self.assertEqual(response.status_code, 400)
+        self.assertIsNone(self.quantity(self.hospital))
+        self.assertEqual(self.quantity(self.warehouse), 500)
+
+    def test_missing_source_is_not_found(self):
+        response = self.transfer(self.hospital, self.pharmacy, 1)
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNone(self.quantity(self.pharmacy))
+
+
+class AsyncEndpointTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        Inventory.objects.create(batch=self.batch, location=self.pharmacy, quantity=12)
+        self.client.force_login(self.staff)
+
+    def test_async_endpoints_match_their_sync_actions(self):
+        for path, async_path in (
+            ('/api/inventory/low_stock_alerts/', '/api/async/inventory/low_stock_alerts/'),
+            ('/api/demand-forecasts/expiring_soon/?days=400', '/api/async/demand-forecasts/expiring_soon/?days=400'),
+        ):
+            response = self.client.get(async_path)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), self.client.get(path).json())
+
+    def test_dashboard_stats_counts(self):
+        data = self.client.get('/api/async/inventory/dashboard_stats/').json()
+        self.assertEqual(data['medicines_in_system'], 1)
+        self.assertEqual(data['low_stock_alerts'], 1)
+
+    def test_requires_authentication_and_get(self):
+        self.assertEqual(APIClient().get('/api/async/inventory/dashboard_stats/').status_code, 401)
+        self.assertEqual(self.client.post('/api/async/inventory/dashboard_stats/').status_code, 405)
+
+
+class BulkWriteTests(ApiTestCase):
+    def test_bulk_create(self):
+        response = self.client.post('/api/medicines/bulk_create/', [
+            {'name': 'Ibuprofen', 'strength': '200mg'}, {'name': 'Paracetamol', 'strength': '500mg'},
+        ], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['created']), 2)
+        self.assertEqual(Medicine.objects.count(), 3)
+
+    def test_bulk_update_stamps_updated_at_and_rejects_unknown_ids(self):
+        before = self.medicine.updated_at
+        response = self.client.patch('/api/medicines/bulk_update/', [{'id': self.medicine.id, 'strength': '250mg'}], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.medicine.refresh_from_db()
+        self.assertEqual(self.medicine.strength, '250mg')
+        self.assertGreater(self.medicine.updated_at, before)
+
+        response = self.client.patch('/api/medicines/bulk_update/', [{'id': 999_999, 'strength': '1mg'}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('0', response.json())
+
+    def test_bulk_upsert_updates_matches_and_creates_the_rest(self):
+        response = self.client.post('/api/manufacturers/bulk_upsert/', [
+            {'name': 'Acme Pharma', 'contact_info': 'orders@acme.test'}, {'name': 'Globex'},
+        ], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['updated'], [self.manufacturer.id])
+        self.assertEqual(len(response.data['created']), 1)
+        self.manufacturer.refresh_from_db()
+        self.assertEqual(self.manufacturer.contact_info, 'orders@acme.test')
+
+        # Replaying the same payload only updates.
+        response = self.client.post('/api/manufacturers/bulk_upsert/', [{'name': 'Globex', 'contact_info': 'x'}], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], [])
+        self.assertEqual(Manufacturer.objects.count(), 2)
+
+    def test_bulk_upsert_rejects_repeated_keys(self):
+        response = self.client.post('/api/medicines/bulk_upsert/', [
+            {'name': 'Ibuprofen', 'strength': '200mg'}, {'name': 'Ibuprofen', 'strength': '200mg'},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'1': {'name, strength': ['Duplicate value in this request.']}})
+        self.assertEqual(Medicine.objects.count(), 1)
+
+    def test_bulk_create_checks_unique_fields_against_the_table_and_the_payload(self):
+        today = timezone.localdate()
+        row = {
+            'medicine': self.medicine.id, 'manufacturer': self.manufacturer.id, 'initial_location': self.warehouse.id,
+            'production_date': str(today), 'expiry_date': str(today + timedelta(days=90)), 'quantity': 10,
+        }
+        response = self.client.post('/api/production-batches/bulk_create/', [
+            {**row, 'batch_number': 'B-1'}, {**row, 'batch_number': 'B-2'}, {**row, 'batch_number': 'B-2'},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'0', '2'})
+        self.assertEqual(ProductionBatch.objects.count(), 1)
+
+
+class ProductionBatchTests(ApiTestCase):
+    def batch_payload(self, batch_number, quantity=100):
+        today = timezone.localdate()
+        return {
+            'medicine': self.medicine.id, 'manufacturer': self.manufacturer.id, 'batch_number': batch_number,
+            'production_date': str(today), 'expiry_date': str(today + timedelta(days=180)), 'quantity': quantity,
+        }
+
+    def test_create_provisions_inventory_and_a_production_movement(self):
+        response = self.client.post('/api/production-batches/', {
+            **self.batch_payload('B-2', 75), 'initial_location': self.warehouse.id,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        batch = ProductionBatch.objects.get(batch_number='B-2')
+        self.assertEqual(self.quantity(self.warehouse, batch), 75)
+        movement = StockMovement.objects.get(inventory__batch=batch)
+        self.assertEqual((movement.movement_type, movement.quantity_change, movement.to_location_id), ('production', 75, self.warehouse.id))
+
+    def test_create_requires_an_initial_location(self):
+        response = self.client.post('/api/production-batches/', self.batch_payload('B-2'), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('initial_location', response.json())
+        self.assertFalse(ProductionBatch.objects.filter(batch_number='B-2').exists())
+
+    def test_production_run_is_all_or_nothing(self):
+        response = self.client.post('/api/production-batches/production_run/', {
+            'initial_location': self.pharmacy.id,
+            'batches': [self.batch_payload('B-2', 10), self.batch_payload('B-3', 20)],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['total_quantity'], 30)
+        self.assertEqual(Inventory.objects.filter(location=self.pharmacy).count(), 2)
+        self.assertEqual(StockMovement.objects.filter(movement_type='production').count(), 2)
+
+        response = self.client.post('/api/production-batches/production_run/', {
+            'initial_location': self.pharmacy.id,
+            'batches': [self.batch_payload('B-4'), self.batch_payload('B-1')],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ProductionBatch.objects.filter(batch_number='B-4').exists())
+
+
+class SparseFieldsetTests(ApiTestCase):
+    def test_fields_and_exclude_narrow_the_payload_and_the_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/production-batches/?fields=batch_number,medicine_name')
+        self.assertEqual(response.json()['results'], [{'id': self.batch.id, 'batch_number': 'B-1', 'medicine_name': 'Amoxicillin'}])
+        select = next(query['sql'] for query in queries.captured_queries if 'FROM "api_productionbatch"' in query['sql'] and 'COUNT' not in query['sql'])
+        self.assertNotIn('"notes"', select)
+        self.assertIn('INNER JOIN "api_medicine"', select)
+
+        row = self.client.get('/api/medicines/?exclude=created_at,updated_at').json()['results'][0]
+        self.assertEqual(set(row), {'id', 'name', 'strength'})
+
+    def test_columnar_format_keeps_the_pagination_envelope(self):
+        data = self.client.get('/api/medicines/?format=columnar&fields=name,strength').json()
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['results'], {'columns': ['id', 'name', 'strength'], 'rows': [[self.medicine.id, 'Amoxicillin', '500mg']]})
+
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack_format(self):
+        response = self.client.get('/api/medicines/?fields=name', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['results'], [{'id': self.medicine.id, 'name': 'Amoxicillin'}])
+
+
+class FastListTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.post('/api/stock-movements/transfer_stock/', {
+            'from_location': self.warehouse.id, 'to_location': self.pharmacy.id, 'batch': self.batch.id, 'quantity': 25,
+        }, format='json')
+
+    def assertMatchesModelSerializer(self, url, serializer_class, queryset):
+        results = self.client.get(url).json()['results']
+        expected = json.loads(JSONRenderer().render(serializer_class(queryset, many=True, context={}).data))
+        self.assertEqual(sorted(results, key=lambda row: row['id']), sorted(expected, key=lambda row: row['id']))
+
+    def test_inventory_list_matches_the_model_serializer(self):
+        self.assertMatchesModelSerializer('/api/inventory/', InventorySerializer, Inventory.objects.all())
+
+    def test_movement_list_matches_the_model_serializer(self):
+        self.assertMatchesModelSerializer('/api/stock-movements/', StockMovementSerializer, StockMovement.objects.all())
+
+    def test_list_is_one_query_plus_the_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/inventory/?fields=quantity,medicine_name')
+        self.assertEqual(len([query for query in queries.captured_queries if 'api_inventory' in query['sql']]), 2)
+
+
+class MetricsTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics_registry.reset()
+
+    def test_requests_are_recorded_per_view(self):
+        self.client.get('/api/medicines/')
+        self.client.get('/api/medicines/')
+        text = self.client.get('/api/metrics/').content.decode()
+        labels = '{view="medicine-list",method="GET"}'
+        self.assertIn(f'pharmaflow_requests_total{labels} 2', text)
+        self.assertIn(f'pharmaflow_request_seconds_count{labels} 2', text)
+        self.assertIn(f'pharmaflow_db_queries_bucket{{view="medicine-list",method="GET",le="+Inf"}} 2', text)
+        self.assertIn('# TYPE pharmaflow_request_seconds histogram', text)
+        self.assertIn('# TYPE pharmaflow_request_seconds_window gauge', text)
+        self.assertIn('pharmaflow_db_queries_window{view="medicine-list",method="GET",quantile="0.5"}', text)
+
+    @override_settings(PERF_METRICS={'SAMPLE_RATE': 0.0})
+    def test_unsampled_requests_are_only_counted(self):
+        self.client.get('/api/medicines/')
+        text = self.client.get('/api/metrics/').content.decode()
+        self.assertIn('pharmaflow_requests_total{view="medicine-list",method="GET"} 1', text)
+        self.assertNotIn('pharmaflow_request_seconds_count{view="medicine-list"', text)
+
+    def test_metrics_are_admin_only(self):
+        user = User.objects.create_user('pharmacist')
+        self.assertEqual(self.client_for(user).get('/api/metrics/').status_code, 403)
+
+    def test_histogram_forgets_observations_outside_the_window(self):
+        histogram = RollingHistogram((1, 10), window_seconds=10, slices=5)
+        histogram.observe(0.5, now=0)
+        histogram.observe(5, now=4)
+        self.assertEqual(histogram.snapshot(now=4), ([1, 2, 2], 2, 5.5))
+        self.assertEqual(histogram.snapshot(now=11), ([0, 1, 1], 1, 5.0))
+        # The exported totals never go down, or Prometheus would read a counter reset.
+        self.assertEqual(histogram.totals(), ([1, 2, 2], 2, 5.5))
+
+    def test_window_quantiles_interpolate_within_buckets(self):
+        histogram = RollingHistogram((1, 10), window_seconds=10, slices=5)
+        histogram.observe(0.5, now=0)
+        histogram.observe(5, now=4)
+        self.assertEqual(histogram.quantile(0.5, now=4), 1.0)
+        self.assertAlmostEqual(histogram.quantile(0.95, now=4), 9.1)
+        self.assertEqual(histogram.quantile(0.5, now=11), 5.5)
+        self.assertIsNone(histogram.quantile(0.5, now=100))
+        histogram.observe(50, now=100)
+        self.assertEqual(histogram.quantile(0.99, now=100), 10)
+
+
+class BenchmarkSuiteTests(TestCase):
+    def generate(self):
+        call_command(
+            'generate_supply_data', '--clear', '--medicines', '6', '--manufacturers', '2', '--locations', '8',
+            '--batches', '10', '--movements', '200', '--history-days', '30', '--resupply-requests', '5',
+            stdout=StringIO(),
+        )
+        return (
+            list(ProductionBatch.objects.order_by('batch_number').values_list('batch_number', 'quantity', 'expiry_date')),
+            list(StockMovement.objects.order_by('id').values_list('movement_type', 'quantity_change')),
+        )
+
+    def test_generated_data_is_reproducible(self):
+        first = self.generate()
+        self.assertEqual(len(first[0]), 10)
+        self.assertEqual(len(first[1]), 200)
+        self.assertEqual(self.generate(), first)
+
+    def test_every_endpoint_has_a_case_and_the_cases_run(self):
+        self.generate()
+        # The generator records no anomalies; detail cases need a row.
+        DemandAnomaly.objects.create(
+            medicine=Medicine.objects.first(), location=Location.objects.first(), day=timezone.localdate(),
+            units=50, expected=5, threshold=20, score=9,
+        )
+        fixture = run_benchmarks.Command()._fixture()
+        cases = run_benchmarks.build_cases(fixture)
+        fixture['user'].delete()
+        self.assertEqual(run_benchmarks.url_names() - {case['name'] for case in cases} - run_benchmarks.UNBENCHMARKED, set())
+
+        movements = StockMovement.objects.count()
+        with TemporaryDirectory() as output:
+            call_command(
+                'run_benchmarks', '--repeat', '1', '--warmup', '0', '--output', output,
+                '--only', 'medicine-list', 'stockmovement-transfer-stock', 'inventory-export', 'locationedge-bulk-create',
+                'token_obtain_pair', stdout=StringIO(),
+            )
+            [report] = [json.loads(path.read_text()) for path in Path(output).iterdir()]
+        self.assertEqual({name: result['status'] for name, result in report['results'].items()}, {
+            'medicine-list': 200, 'stockmovement-transfer-stock': 200, 'inventory-export': 200,
+            'locationedge-bulk-create': 201, 'token_obtain_pair': 200,
+        })
+        # Write cases are rolled back, and the benchmark account is removed.
+        self.assertEqual(StockMovement.objects.count(), movements)
+        self.assertFalse(User.objects.filter(username__startswith='benchmark-').exists())
+
+
+class RoutingTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        routing._tables.clear()
+        self.slow = LocationEdge.objects.create(from_location=self.warehouse, to_location=self.pharmacy, transit_hours=5, cost=20)
+        LocationEdge.objects.create(from_location=self.warehouse, to_location=self.hospital, transit_hours=1, cost=30)
+        LocationEdge.objects.create(from_location=self.hospital, to_location=self.pharmacy, transit_hours=1, cost=30, bidirectional=False)
+
+    def route(self, source, target, metric=None):
+        url = f'/api/location-edges/route/?from={source.id}&to={target.id}'
+        return self.client.get(url + (f'&metric={metric}' if metric else ''))
+
+    def test_shortest_route_by_metric(self):
+        data = self.route(self.warehouse, self.pharmacy).json()
+        self.assertEqual(data['transit_hours'], 2.0)
+        self.assertEqual([hop['name'] for hop in data['route']], ['Central Warehouse', 'City Hospital', 'Main Street Pharmacy'])
+
+        data = self.route(self.warehouse, self.pharmacy, 'cost').json()
+        self.assertEqual((data['cost'], [hop['id'] for hop in data['route']]), (20.0, [self.warehouse.id, self.pharmacy.id]))
+
+    def test_one_way_edges_are_not_reversed(self):
+        self.assertEqual(self.route(self.pharmacy, self.hospital).json()['route'][1]['id'], self.warehouse.id)
+        LocationEdge.objects.filter(pk=self.slow.pk).delete()
+        self.assertEqual(self.route(self.pharmacy, self.hospital).status_code, 404)
+
+    def test_edge_writes_invalidate_the_cached_table(self):
+        self.route(self.warehouse, self.pharmacy)
+        self.slow.transit_hours = 0.5
+        self.slow.save()
+        self.assertEqual(self.route(self.warehouse, self.pharmacy).json()['transit_hours'], 0.5)
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.route(self.warehouse, self.pharmacy, 'distance').status_code, 400)
+        self.assertEqual(self.client.get('/api/location-edges/route/?from=1').status_code, 400)
+
+    def test_hops_outside_the_users_scope_are_not_named(self):
+        self.client = self.client_for(self.pharmacist(locations=[self.warehouse, self.pharmacy]))
+        data = self.route(self.warehouse, self.pharmacy).json()
+        self.assertEqual(
+            [(hop['id'], hop['name']) for hop in data['route']],
+            [(self.warehouse.id, 'Central Warehouse'), (self.hospital.id, None), (self.pharmacy.id, 'Main Street Pharmacy')],
+        )
+
+    def test_redirections_draw_from_the_nearest_surplus_first(self):
+        suggestions = routing.suggest_redirections(
+            {'Central Warehouse': {'X': 150}, 'City Hospital': {'X': 150}, 'Main Street Pharmacy': {'X': 0}},
+            {'Central Warehouse': {'X': 100}, 'City Hospital': {'X': 100}, 'Main Street Pharmacy': {'X': 80}},
+        )
+        self.assertEqual(
+            [(row['from_location'], row['suggested_quantity'], row['transit_hours']) for row in suggestions],
+            [('City Hospital', 50, 1.0), ('Central Warehouse', 30, 2.0)],
+        )
+        self.assertEqual(suggestions[1]['route'], ['Central Warehouse', 'City Hospital', 'Main Street Pharmacy'])
+
+
+class RebalancingTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        routing._tables.clear()
+        rebalancing._plans.clear()
+        LocationEdge.objects.create(from_location=self.warehouse, to_location=self.pharmacy, transit_hours=4, cost=1)
+        LocationEdge.objects.create(from_location=self.warehouse, to_location=self.hospital, transit_hours=1, cost=5)
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        for location, demand in ((self.pharmacy, 300), (self.hospital, 400)):
+            DemandForecast.objects.create(
+                medicine=self.medicine, location=location, forecast_date=tomorrow, predicted_demand=demand, confidence_level=0.9,
+            )
+
+    def test_plan_minimises_stock_outs_then_cost(self):
+        plan = self.client.get('/api/demand-forecasts/rebalance/').json()
+        self.assertEqual(
+            sorted((row['to_location_name'], row['quantity'], row['cost']) for row in plan['transfers']),
+            [('City Hospital', 200, 5.0), ('Main Street Pharmacy', 300, 1.0)],
+        )
+        self.assertEqual([(row['location'], row['quantity']) for row in plan['unmet_demand']], [(self.hospital.id, 200)])
+        self.assertEqual(plan['summary']['total_cost'], 1300)
+
+    def test_unchanged_medicines_reuse_their_solution(self):
+        self.assertEqual(self.client.get('/api/demand-forecasts/rebalance/').json()['summary']['medicines_solved'], 1)
+        self.assertEqual(self.client.get('/api/demand-forecasts/rebalance/').json()['summary']['medicines_reused'], 1)
+        Inventory.objects.filter(pk=self.stock.pk).update(quantity=900)
+        summary = self.client.get('/api/demand-forecasts/rebalance/').json()['summary']
+        self.assertEqual((summary['medicines_solved'], summary['unmet_units']), (1, 0))
+
+    def test_plan_is_limited_to_the_users_locations(self):
+        client = self.client_for(self.pharmacist(locations=[self.warehouse, self.pharmacy]))
+        plan = client.get('/api/demand-forecasts/rebalance/').json()
+        self.assertEqual(
+            [(row['from_location'], row['to_location'], row['quantity']) for row in plan['transfers']],
+            [(self.warehouse.id, self.pharmacy.id, 300)],
+        )
+        self.assertEqual(plan['unmet_demand'], [])
+        # The scoped plan is cached apart from the network-wide one.
+        self.assertEqual(self.client.get('/api/demand-forecasts/rebalance/').json()['summary']['medicines_solved'], 1)
+        self.assertEqual(client.get('/api/demand-forecasts/rebalance/').json()['summary']['medicines_reused'], 1)
+
+    def test_reserve_is_kept_at_the_source(self):
+        DemandForecast.objects.create(
+            medicine=self.medicine, location=self.warehouse, forecast_date=timezone.localdate(), predicted_demand=100, confidence_level=0.9,
+        )
+        plan = self.client.get('/api/demand-forecasts/rebalance/?reserve=0.5').json()
+        self.assertEqual(plan['summary']['units_moved'], 500 - 150)
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.client.get('/api/demand-forecasts/rebalance/?reserve=-1').status_code, 400)
+        self.assertEqual(self.client.get('/api/demand-forecasts/rebalance/?metric=distance').status_code, 400)
+
+
+class ResupplyPlanTests(ApiTestCase):
+    url = '/api/resupply-requests/plan/'
+
+    def setUp(self):
+        super().setUp()
+        self.forecast = DemandForecast.objects.create(
+            medicine=self.medicine, location=self.pharmacy, forecast_date=timezone.localdate() + timedelta(days=2),
+            predicted_demand=100, confidence_level=0.9,
+        )
+
+    def test_short_series_get_one_request_that_later_runs_merge_into(self):
+        run = self.client.post(self.url, {}, format='json').json()
+        self.assertEqual((run['full'], run['created_count'], run['series_checked']), (True, 1, 1))
+        request = ResupplyRequest.objects.get()
+        self.assertEqual((request.requesting_location, request.requested_quantity, request.urgency), (self.pharmacy, 125, 'critical'))
+
+        # Nothing changed since the last run with these parameters.
+        run = self.client.post(self.url, {}, format='json').json()
+        self.assertEqual((run['full'], run['series_checked'], run['created_count']), (False, 0, 0))
+
+        self.forecast.predicted_demand = 200
+        self.forecast.save()
+        run = self.client.post(self.url, {}, format='json').json()
+        self.assertEqual((run['full'], run['created_count'], run['merged_count']), (False, 0, 1))
+        self.assertEqual(ResupplyRequest.objects.get().requested_quantity, 250)
+
+    def test_runs_are_limited_to_the_users_locations(self):
+        DemandForecast.objects.create(
+            medicine=self.medicine, location=self.hospital, forecast_date=timezone.localdate() + timedelta(days=2),
+            predicted_demand=40, confidence_level=0.9,
+        )
+        client = self.client_for(self.pharmacist(locations=[self.hospital]))
+        run = client.post(self.url, {}, format='json').json()
+        self.assertEqual((run['created_count'], run['parameters']['locations']), (1, [self.hospital.id]))
+        self.assertEqual(list(ResupplyRequest.objects.values_list('requesting_location', flat=True)), [self.hospital.id])
+
+        # A network-wide run after a scoped one re-plans every series.
+        run = self.client.post(self.url, {}, format='json').json()
+        self.assertEqual((run['full'], run['created_count'], run['merged_count']), (True, 1, 0))
+
+    def test_approved_requests_count_as_inbound_stock(self):
+        ResupplyRequest.objects.create(
+            medicine=self.medicine, requesting_location=self.pharmacy, requested_quantity=90, status='approved', requested_by=self.staff,
+        )
+        self.client.post(self.url, {'full': True}, format='json')
+        request = ResupplyRequest.objects.get(status='pending')
+        self.assertEqual((request.requested_quantity, request.urgency), (125 - 90, 'low'))
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.client.post(self.url, {'lead_time_days': 0}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'safety_ratio': 'x'}, format='json').status_code, 400)
+
+
+class RollupTests(ApiTestCase):
+    def rollup(self, location, movement_type, model=DailyMovementRollup):
+        return model.objects.filter(medicine=self.medicine, location=location, movement_type=movement_type).values_list(
+            'units_in', 'units_out', 'movements'
+        ).first()
+
+    def distribute(self, quantity, location=None):
+        inventory = Inventory.objects.get(batch=self.batch, location=location or self.warehouse)
+        return StockMovement.objects.create(
+            inventory=inventory, movement_type='distribution', quantity_change=-quantity, created_by=self.staff,
+        )
+
+    def test_movements_are_folded_in_as_they_are_recorded(self):
+        self.client.post('/api/stock-movements/transfer_stock/', {
+            'from_location': self.warehouse.id, 'to_location': self.pharmacy.id, 'batch': self.batch.id, 'quantity': 120,
+        }, format='json')
+        self.distribute(30)
+        self.distribute(5)
+        self.assertEqual(self.rollup(self.warehouse, 'transfer'), (0, 120, 1))
+        self.assertEqual(self.rollup(self.pharmacy, 'transfer'), (120, 0, 1))
+        self.assertEqual(self.rollup(self.warehouse, 'distribution'), (0, 35, 2))
+        self.assertEqual(self.rollup(self.warehouse, 'distribution', WeeklyMovementRollup), (0, 35, 2))
+
+    def test_edits_are_re_aggregated_on_commit_and_match_a_rebuild(self):
+        movement = self.distribute(30)
+        self.distribute(5)
+        with self.captureOnCommitCallbacks(execute=True):
+            movement.quantity_change = -50
+            movement.save()
+        self.assertEqual(self.rollup(self.warehouse, 'distribution'), (0, 55, 2))
+
+        before = sorted(DailyMovementRollup.objects.values_list('location', 'day', 'movement_type', 'units_in', 'units_out', 'movements'))
+        rollups.rebuild()
+        after = sorted(DailyMovementRollup.objects.values_list('location', 'day', 'movement_type', 'units_in', 'units_out', 'movements'))
+        self.assertEqual(after, before)
+
+    def test_demand_series_starts_at_the_first_recorded_day(self):
+        today = timezone.localdate()
+        for days_ago, units in ((5, 10), (2, 4)):
+            DailyMovementRollup.objects.create(
+                medicine=self.medicine, location=self.pharmacy, day=today - timedelta(days=days_ago),
+                movement_type='distribution', units_out=units, movements=1,
+            )
+        series = rollups.demand_series(self.medicine.id, self.pharmacy.id, start=today - timedelta(days=30))
+        self.assertEqual(series[0], (today - timedelta(days=5), 10))
+        # Through yesterday: today's total is not final yet.
+        self.assertEqual([units for _, units in series], [10, 0, 0, 4, 0])
+        self.assertEqual(len(rollups.demand_series(self.medicine.id, self.pharmacy.id, end=today)), 6)
+        self.assertEqual(rollups.demand_series(self.medicine.id, self.hospital.id), [])
+
+    def test_forecasts_from_history_leave_out_today(self):
+        today = timezone.localdate()
+        for days_ago in range(3):
+            DailyMovementRollup.objects.create(
+                medicine=self.medicine, location=self.pharmacy, day=today - timedelta(days=days_ago),
+                movement_type='distribution', units_out=10, movements=1,
+            )
+        with mock.patch('api.views.generate_forecast_from_series', return_value=[]) as forecast:
+            response = self.client.post('/api/demand-forecasts/forecast_from_history/', {
+                'medicine_id': self.medicine.id, 'location_id': self.pharmacy.id,
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(forecast.call_args.args[0][-1], (today - timedelta(days=1), 10))
+
+    def test_consumption_endpoint(self):
+        self.distribute(30)
+        data = self.client.get(f'/api/stock-movements/consumption/?medicine={self.medicine.id}').json()
+        self.assertEqual(data, [{'period': str(timezone.localdate()), 'units_in': 0, 'units_out': 30, 'movements': 1}])
+        self.assertEqual(self.client.get('/api/stock-movements/consumption/?period=month').status_code, 400)
+
+
+class ForecastOptionsTests(ApiTestCase):
+    url = '/api/demand-forecasts/upload_csv_forecast/'
+    history = "date,demand\n" + "\n".join(f"2025-01-{day:02d},{20 + day % 7}" for day in range(1, 29))
+
+    def setUp(self):
+        super().setUp()
+        forecasting._models.clear()
+
+    def upload(self, **options):
+        return self.client.post(self.url, {
+            'file': SimpleUploadedFile('history.csv', self.history.encode()),
+            'medicine_id': self.medicine.id, 'location_id': self.pharmacy.id, **options,
+        })
+
+    def test_invalid_options_are_rejected(self):
+        for options in ({'periods': 0}, {'periods': 'x'}, {'frequency': 'monthly'}, {'interval_width': 1}):
+            self.assertEqual(self.upload(**options).status_code, 400, options)
+        self.assertFalse(forecasting._models)
+
+    def test_horizon_and_interval(self):
+        data = self.upload(periods=10, interval_width=0.8).json()
+        self.assertEqual((data['periods'], data['interval_width'], len(data['forecast'])), (10, 0.8, 10))
+        self.assertTrue(data['forecast'][0]['date'].startswith('2025-01-29'))
+        row = DemandForecast.objects.get(forecast_date='2025-01-29')
+        self.assertLessEqual(row.predicted_lower, row.predicted_demand)
+        self.assertLessEqual(row.predicted_demand, row.predicted_upper)
+
+    def test_weekly_predictions_are_spread_over_their_days(self):
+        data = self.upload(periods=2, frequency='weekly').json()
+        self.assertEqual(len(data['forecast']), 2)
+        self.assertEqual(DemandForecast.objects.filter(location=self.pharmacy).count(), 14)
+
+    def test_the_fitted_model_is_reused_and_extended(self):
+        first = self.upload(periods=3).json()['forecast']
+        [fitted] = forecasting._models.values()
+        with mock.patch.object(forecasting, 'Prophet') as prophet:
+            second = self.upload(periods=5).json()['forecast']
+        prophet.assert_not_called()
+        self.assertEqual(len(fitted.predictions), 5)
+        self.assertEqual(second[:3], first)
+
+
+class ExportTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        for location, quantity in ((self.pharmacy, 12), (self.hospital, 30)):
+            Inventory.objects.create(batch=self.batch, location=location, quantity=quantity)
+
+    def export(self, query=''):
+        response = self.client.get(f'/api/inventory/export/{query}')
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_streams_in_keyset_chunks(self):
+        response, body = self.export('?fields=location,quantity')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="inventory.csv"')
+        rows = list(csv.reader(io.StringIO(body.decode())))
+        self.assertEqual(rows, [
+            ['id', 'quantity', 'location'],
+            *[[str(row.id), str(row.quantity), str(row.location_id)] for row in Inventory.objects.order_by('id')],
+        ])
+
+        with CaptureQueriesContext(connection) as queries:
+            _, chunked = self.export('?fields=location,quantity&chunk_size=1')
+        self.assertEqual(chunked, body)
+        # One page per row, then the empty page that ends the stream.
+        pages = [query['sql'] for query in queries.captured_queries if 'FROM "api_inventory"' in query['sql']]
+        self.assertEqual(len(pages), 4)
+        self.assertTrue(all('"api_inventory"."id" >' in sql for sql in pages[1:]))
+
+    def test_filters_select_a_slice(self):
+        _, body = self.export(f'?location={self.hospital.id}&fields=quantity')
+        self.assertEqual(body.decode().split(), ['id,quantity', f'{Inventory.objects.get(location=self.hospital).id},30'])
+        self.assertEqual(self.client.get('/api/inventory/export/?since=yesterday').status_code, 400)
+        self.assertEqual(self.client.get('/api/inventory/export/?chunk_size=0').status_code, 400)
+        self.assertEqual(self.client.get('/api/inventory/export/?file_format=xlsx').status_code, 400)
+
+    @skipIf(exports.pa is None, 'pyarrow is not installed')
+    def test_parquet(self):
+        _, body = self.export('?file_format=parquet&chunk_size=2')
+        table = exports.pq.read_table(io.BytesIO(body))
+        self.assertEqual(sorted(table.column('quantity').to_pylist()), [12, 30, 500])
+
+
+class IdempotencyKeyTests(ApiTestCase):
+    url = '/api/stock-movements/transfer_stock/'
+
+    def transfer(self, key=None, quantity=10, client=None):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        return (client or self.client).post(self.url, {
+            'from_location': self.warehouse.id, 'to_location': self.pharmacy.id, 'batch': self.batch.id, 'quantity': quantity,
+        }, format='json', **headers)
+
+    def test_a_retry_replays_the_response_without_writing_again(self):
+        first = self.transfer('retry-1')
+        second = self.transfer('retry-1')
+        self.assertEqual((first.status_code, second.status_code), (200, 200))
+        self.assertEqual(second.json(), first.json())
+        self.assertNotIn('Idempotent-Replayed', first)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.quantity(self.pharmacy), 10)
+        self.assertEqual(StockMovement.objects.filter(movement_type='transfer').count(), 1)
+
+    def test_requests_without_a_key_run_every_time(self):
+        self.transfer()
+        self.transfer()
+        self.assertEqual(self.quantity(self.pharmacy), 20)
+
+    def test_client_errors_are_replayed_too(self):
+        self.assertEqual(self.transfer('too-much', quantity=10_000).status_code, 400)
+        Inventory.objects.filter(pk=self.stock.pk).update(quantity=20_000)
+        response = self.transfer('too-much', quantity=10_000)
+        self.assertEqual((response.status_code, response['Idempotent-Replayed']), (400, 'true'))
+
+    def test_a_key_reused_for_another_request_is_rejected(self):
+        self.transfer('reused')
+        self.assertEqual(self.transfer('reused', quantity=11).status_code, 422)
+        self.assertEqual(self.quantity(self.pharmacy), 10)
+
+    def test_keys_are_per_user(self):
+        other = User.objects.create_user('other-staff', is_staff=True)
+        self.transfer('shared')
+        self.assertNotIn('Idempotent-Replayed', self.transfer('shared', client=self.client_for(other)))
+        self.assertEqual(self.quantity(self.pharmacy), 20)
+
+    def test_in_progress_keys_conflict_until_they_go_stale(self):
+        self.transfer('running')
+        # As if the first attempt were still running.
+        IdempotencyKey.objects.filter(key='running').update(status_code=None, response_body=None)
+        self.assertEqual(self.transfer('running').status_code, 409)
+        IdempotencyKey.objects.filter(key='running').update(created_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(self.transfer('running').status_code, 200)
+        self.assertEqual(self.quantity(self.pharmacy), 20)
+
+    def test_model_writes_honour_the_header(self):
+        payload = {'batch': self.batch.id, 'location': self.hospital.id, 'quantity': 5}
+        first = self.client.post('/api/inventory/', payload, format='json', HTTP_IDEMPOTENCY_KEY='create-1')
+        second = self.client.post('/api/inventory/', payload, format='json', HTTP_IDEMPOTENCY_KEY='create-1')
+        self.assertEqual((first.status_code, second.status_code), (201, 201))
+        self.assertEqual(second.json()['id'], first.json()['id'])
+        self.assertEqual(Inventory.objects.filter(location=self.hospital).count(), 1)
+
+
+class SyncTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.shelf = Inventory.objects.create(batch=self.batch, location=self.pharmacy, quantity=40)
+
+    def pull(self, client=None, **params):
+        response = (client or self.client).get('/api/sync/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def upload(self, *changes, client=None):
+        return (client or self.client).post('/api/sync/upload/', {'changes': list(changes)}, format='json').json()['results']
+
+    @override_settings(SYNC={'OVERLAP_SECONDS': 0})
+    def test_pull_sends_everything_then_only_changes_and_deletions(self):
+        data = self.pull()
+        self.assertEqual(sorted(data['reset']), ['inventory', 'medicines'])
+        self.assertEqual(len(data['changes']['inventory']), 2)
+
+        self.shelf.quantity = 35
+        self.shelf.save()
+        doomed = Inventory.objects.create(batch=self.batch, location=self.hospital, quantity=1)
+        doomed_id = doomed.id
+        doomed.delete()
+        data = self.pull(token=data['token'])
+        self.assertEqual(data['reset'], [])
+        self.assertEqual([(row['id'], row['quantity']) for row in data['changes']['inventory']], [(self.shelf.id, 35)])
+        self.assertEqual(data['changes']['medicines'], [])
+        self.assertEqual(data['deleted']['inventory'], [doomed_id])
+        self.assertTrue(SyncTombstone.objects.filter(table='inventory', object_id=doomed_id).exists())
+
+    def test_pull_pages_through_a_reset(self):
+        first = self.pull(tables='inventory', limit=1)
+        self.assertTrue(first['has_more'])
+        second = self.pull(tables='inventory', limit=1, token=first['token'])
+        self.assertEqual(second['reset'], ['inventory'])
+        self.assertEqual(
+            {row['id'] for row in first['changes']['inventory'] + second['changes']['inventory']}, {self.stock.id, self.shelf.id},
+        )
+        self.assertFalse(second['has_more'])
+
+    def test_pull_is_limited_to_the_users_locations(self):
+        client = self.client_for(self.pharmacist(locations=[self.pharmacy]))
+        self.assertEqual([row['id'] for row in self.pull(client, tables='inventory')['changes']['inventory']], [self.shelf.id])
+
+    def test_bad_pull_parameters(self):
+        self.assertEqual(self.client.get('/api/sync/?token=forged').status_code, 400)
+        self.assertEqual(self.client.get('/api/sync/?tables=orders').status_code, 400)
+        self.assertEqual(self.client.get('/api/sync/?limit=0').status_code, 400)
+
+    def test_upload_applies_each_change_once(self):
+        change = {'client_id': 'terminal-1:1', 'inventory': self.shelf.id, 'quantity_change': -5, 'movement_type': 'distribution'}
+        [applied] = self.upload(change)
+        self.assertEqual((applied['status'], applied['quantity']), ('applied', 35))
+        self.assertEqual(StockMovement.objects.get(pk=applied['movement_id']).quantity_change, -5)
+
+        results = self.upload(change, {**change, 'client_id': 'terminal-1:2'}, {**change, 'client_id': 'terminal-1:2'})
+        self.assertEqual([result['status'] for result in results], ['duplicate', 'applied', 'duplicate'])
+        self.assertEqual(results[0]['movement_id'], applied['movement_id'])
+        self.assertEqual(self.quantity(self.pharmacy), 30)
+
+    def test_upload_rejects_bad_changes_without_writing_them(self):
+        results = self.upload(
+            {'client_id': 'a', 'inventory': self.shelf.id, 'quantity_change': -100},
+            {'client_id': 'b', 'inventory': self.shelf.id, 'quantity_change': 0},
+            {'client_id': 'c', 'inventory': self.shelf.id, 'quantity_change': 1, 'movement_type': 'transfer'},
+            {'client_id': 'd', 'inventory': 999_999, 'quantity_change': 1},
+        )
+        self.assertEqual([result['status'] for result in results], ['rejected'] * 4)
+        self.assertEqual(results[0]['error'], 'Not enough stock available')
+        self.assertEqual(self.quantity(self.pharmacy), 40)
+        # A rejected change may be fixed and resent under the same client id.
+        self.assertEqual(self.upload({'client_id': 'a', 'inventory': self.shelf.id, 'quantity_change': -10})[0]['status'], 'applied')
+
+    def test_upload_rejects_inventory_outside_the_users_locations(self):
+        client = self.client_for(self.pharmacist(locations=[self.pharmacy]))
+        results = self.upload(
+            {'client_id': 'mine', 'inventory': self.shelf.id, 'quantity_change': -1},
+            {'client_id': 'theirs', 'inventory': self.stock.id, 'quantity_change': -1},
+            client=client,
+        )
+        self.assertEqual([(result['status'], result.get('error')) for result in results], [('applied', None), ('rejected', 'Inventory not found')])
+        self.assertEqual(self.quantity(self.warehouse), 500)
+
+
+class PushEventTests(ApiTestCase):
+    def events(self):
+        return sorted(PushEvent.objects.values_list('kind', 'inventory_id'))
+
+    def test_events_are_written_when_the_transaction_commits(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.client.post('/api/stock-movements/transfer_stock/', {
+                'from_location': self.warehouse.id, 'to_location': self.pharmacy.id, 'batch': self.batch.id, 'quantity': 10,
+            }, format='json')
+            self.assertEqual(PushEvent.objects.count(), 0)
+        self.assertTrue(any(isinstance(callback, push._Batch) for callback in callbacks))
+        destination = Inventory.objects.get(location=self.pharmacy)
+        self.assertEqual(self.events(), sorted([
+            ('stock_change', self.stock.id), ('stock_change', destination.id), ('low_stock', destination.id),
+        ]))
+        self.assertEqual(PushEvent.objects.get(kind='low_stock').payload['quantity'], 10)
+
+    def test_rolled_back_blocks_take_their_events_with_them(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Inventory.objects.filter(pk=self.stock.pk).first().save()
+                try:
+                    with transaction.atomic():
+                        Inventory.objects.create(batch=self.batch, location=self.hospital, quantity=5)
+                        raise RuntimeError
+                except RuntimeError:
+                    pass
+        self.assertEqual(self.events(), [('stock_change', self.stock.id)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.stock.save()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(PushEvent.objects.count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.stock.save()
+        self.assertEqual(PushEvent.objects.count(), 2)
+
+    def test_rows_touched_by_several_writes_get_one_set_of_events(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                for quantity in (400, 300, 200):
+                    self.stock.quantity = quantity
+                    self.stock.save()
+        self.assertEqual(len(callbacks), 3)
+        self.assertEqual(list(PushEvent.objects.values_list('kind', 'payload__quantity')), [('stock_change', 200)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.stock.save()
+        self.assertEqual(PushEvent.objects.count(), 2)
+
+    def test_expiring_stock_raises_an_expiry_event(self):
+        self.batch.expiry_date = timezone.localdate() + timedelta(days=10)
+        self.batch.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.stock.save()
+        self.assertEqual(PushEvent.objects.get(kind='expiry').payload['days_to_expiry'], 10)
+
+    def test_subscriptions_coalesce_and_filter(self):
+        subscription = push.Subscription({'stock_change'}, locations={self.warehouse.id})
+        for pk, (kind, location, inventory) in enumerate([
+            ('stock_change', self.warehouse.id, 1), ('stock_change', self.warehouse.id, 1),
+            ('low_stock', self.warehouse.id, 1), ('stock_change', self.pharmacy.id, 2),
+        ], start=1):
+            subscription.offer(PushEvent(id=pk, kind=kind, location_id=location, inventory_id=inventory, payload={}))
+        self.assertEqual([event.id for event in subscription.drain()], [2])
+        self.assertEqual(subscription.drain(), [])
+
+
+class ScopingTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.shelf = Inventory.objects.create(batch=self.batch, location=self.pharmacy, quantity=40)
+        self.user = self.pharmacist(locations=[self.pharmacy])
+        self.scoped_client = self.client_for(self.user)
+
+    def ids(self, url, client=None):
+        return sorted(row['id'] for row in (client or self.scoped_client).get(url).json()['results'])
+
+    def test_lists_are_limited_to_the_users_locations(self):
+        self.assertEqual(self.ids('/api/inventory/'), [self.shelf.id])
+        self.assertEqual(self.ids('/api/locations/'), [self.pharmacy.id])
+        self.assertEqual(self.scoped_client.get(f'/api/inventory/{self.stock.id}/').status_code, 404)
+        self.assertEqual(len(self.ids('/api/inventory/', self.client)), 2)
+
+    def test_organization_scope(self):
+        Location.objects.filter(pk__in=[self.warehouse.pk, self.hospital.pk]).update(organization='North Health')
+        client = self.client_for(self.pharmacist('north', organization='North Health'))
+        self.assertEqual(self.ids('/api/locations/', client), sorted([self.warehouse.id, self.hospital.id]))
+
+        # An organization no location is tagged with yet restricts nothing.
+        client = self.client_for(self.pharmacist('south', organization='South Health'))
+        self.assertEqual(len(self.ids('/api/locations/', client)), 3)
+
+    def test_writes_must_reference_stock_in_scope(self):
+        payload = {'movement_type': 'adjustment', 'quantity_change': -1, 'created_by': self.user.id}
+        # The destination being in scope does not make someone else's stock writable.
+        response = self.scoped_client.post('/api/stock-movements/', {
+            **payload, 'inventory': self.stock.id, 'to_location': self.pharmacy.id,
+        }, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json(), {'detail': 'That location is outside your organization'})
+        response = self.scoped_client.post('/api/stock-movements/', {**payload, 'inventory': self.shelf.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        response = self.scoped_client.post('/api/stock-movements/transfer_stock/', {
+            'from_location': self.warehouse.id, 'to_location': self.pharmacy.id, 'batch': self.batch.id, 'quantity': 1,
+        }, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.quantity(self.warehouse), 500)
+
+    def test_new_batches_must_be_stocked_in_scope(self):
+        today = timezone.localdate()
+        batch = {
+            'medicine': self.medicine.id, 'manufacturer': self.manufacturer.id, 'batch_number': 'B-2',
+            'production_date': str(today), 'expiry_date': str(today + timedelta(days=180)), 'quantity': 10,
+        }
+        for url, payload in [
+            ('/api/production-batches/', {**batch, 'initial_location': self.warehouse.id}),
+            ('/api/production-batches/bulk_create/', [{**batch, 'initial_location': self.warehouse.id}]),
+            ('/api/production-batches/production_run/', {'initial_location': self.warehouse.id, 'batches': [batch]}),
+        ]:
+            with self.subTest(url=url):
+                response = self.scoped_client.post(url, payload, format='json')
+                self.assertEqual(response.status_code, 403)
+        self.assertFalse(ProductionBatch.objects.filter(batch_number='B-2').exists())
+
+        response = self.scoped_client.post('/api/production-batches/', {**batch, 'initial_location': self.pharmacy.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.quantity(self.pharmacy, ProductionBatch.objects.get(batch_number='B-2')), 10)
+
+    def test_forecasts_check_the_location(self):
+        response = self.scoped_client.post('/api/demand-forecasts/forecast_from_history/', {
+            'medicine_id': self.medicine.id, 'location_id': self.hospital.id,
+        }, format='json')
+        self.assertEqual(response.status_code, 403)
+        response = self.scoped_client.post('/api/demand-forecasts/upload_csv_forecast/', {
+            'file': SimpleUploadedFile('history.csv', b'date,demand\n2025-01-01,1\n'),
+            'medicine_id': self.medicine.id, 'location_id': self.hospital.id,
+        })
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(DemandForecast.objects.exists())
+
+    def test_users_cannot_pick_their_own_scope(self):
+        response = APIClient().post('/api/auth/register/', {
+            'username': 'newcomer', 'email': 'newcomer@example.com', 'password': 'staff-Passw0rd!', 'password2': 'staff-Passw0rd!',
+            'profile': {'role': 'pharmacist', 'organization': 'North Health', 'locations': [self.warehouse.id]},
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        profile = UserProfile.objects.get(user__username='newcomer')
+        self.assertEqual((profile.organization, list(profile.locations.all())), ('', []))
+
+
+@override_settings(THROTTLE={'RATES': {'staff': None, 'pharmacist': '3/min', 'user': '12/min', 'anon': '2/min'}})
+class ThrottleTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        clock = mock.patch('api.throttling.time.time', return_value=1_000_000.0)
+        self.now = clock.start()
+        self.addCleanup(clock.stop)
+
+    def statuses(self, client, url, count):
+        return [client.get(url).status_code for _ in range(count)]
+
+    def test_requests_beyond_the_rate_get_429_with_retry_after(self):
+        client = self.client_for(self.pharmacist())
+        self.assertEqual(self.statuses(client, '/api/medicines/', 3), [200, 200, 200])
+        response = client.get('/api/medicines/')
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '20'))
+
+        # One token is back after a third of a minute.
+        self.now.return_value += 20
+        self.assertEqual(self.statuses(client, '/api/medicines/', 2), [200, 429])
+
+    def test_expensive_actions_cost_more(self):
+        client = self.client_for(User.objects.create_user('no-profile'))
+        self.assertEqual(client.get('/api/inventory/export/').status_code, 200)
+        response = client.get('/api/inventory/export/')
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '40'))
+        self.assertEqual(self.statuses(client, '/api/medicines/', 3), [200, 200, 429])
+
+    def test_window_costs_grow_with_the_window(self):
+        client = self.client_for(User.objects.create_user('no-profile'))
+        # 1 + 365 // 30 = 13 tokens, capped at the bucket's 12.
+        self.assertEqual(client.get('/api/stock-movements/movement_history/?days=365').status_code, 200)
+        self.assertEqual(client.get('/api/medicines/').status_code, 429)
+
+    def test_staff_are_not_throttled_and_anonymous_users_are(self):
+        self.assertEqual(set(self.statuses(self.client, '/api/medicines/', 20)), {200})
+        self.assertEqual(self.statuses(APIClient(), '/api/auth/register/', 3)[-1], 429)
+
+
+class WasteRiskTests(ApiTestCase):
+    url = '/api/demand-forecasts/waste_risk/?days=30'
+
+    def setUp(self):
+        super().setUp()
+        waste._reports.clear()
+        today = timezone.localdate()
+        self.lines = {}
+        for name, location, days_left, quantity in (
+            ('A', self.pharmacy, 4, 80), ('B', self.pharmacy, 9, 40), ('C', self.pharmacy, 11, 60), ('D', self.hospital, 9, 30),
+        ):
+            batch = ProductionBatch.objects.create(
+                medicine=self.medicine, manufacturer=self.manufacturer, batch_number=f'W-{name}', quantity=quantity,
+                production_date=today - timedelta(days=300), expiry_date=today + timedelta(days=days_left),
+            )
+            self.lines[name] = Inventory.objects.create(batch=batch, location=location, quantity=quantity).id
+        # The pharmacy sells 10 a day by forecast, the hospital 2 a day by history.
+        DemandForecast.objects.create(
+            medicine=self.medicine, location=self.pharmacy, forecast_date=today, predicted_demand=10, confidence_level=0.9,
+        )
+        DailyMovementRollup.objects.create(
+            medicine=self.medicine, location=self.hospital, day=today - timedelta(days=3),
+            movement_type='distribution', units_out=2 * waste.HISTORY_DAYS, movements=1,
+        )
+
+    def test_stock_sells_first_expiry_first_out(self):
+        data = self.client.get(self.url).json()
+        waste_by_line = {row['id']: (row['projected_sold'], row['projected_waste'], row['demand_source']) for row in data['results']}
+        self.assertEqual(waste_by_line, {
+            # 10/day for 5 days: 50 of 80 sell.
+            self.lines['A']: (50, 30, 'forecast'),
+            # 100 by day 9, 50 already sold from A: all 40 sell.
+            self.lines['B']: (40, 0, 'forecast'),
+            # 120 by day 11, 90 already sold: 30 of 60 sell.
+            self.lines['C']: (30, 30, 'forecast'),
+            # 2/day for 10 days.
+            self.lines['D']: (20, 10, 'history'),
+        })
+        self.assertEqual(data['summary'], {'lines': 4, 'lines_at_risk': 3, 'projected_waste': 70})
+        self.assertEqual([row['id'] for row in data['results']], [self.lines[name] for name in 'ACDB'])
+
+    def test_ordering_and_conditional_requests(self):
+        rows = self.client.get(self.url + '&ordering=days_left').json()['results']
+        self.assertEqual([row['days_left'] for row in rows], [4, 9, 9, 11])
+        self.assertEqual(self.client.get(self.url + '&ordering=price').status_code, 400)
+
+        response = self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        Inventory.objects.filter(pk=self.lines['A']).update(quantity=50, last_updated=timezone.now())
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual((response.status_code, response.json()['summary']['projected_waste']), (200, 40))
+
+    def test_expiring_soon_is_paginated_soonest_first(self):
+        data = self.client.get('/api/demand-forecasts/expiring_soon/?days=30').json()
+        self.assertEqual(data['count'], 4)
+        self.assertEqual([(row['batch_number'], row['days_left'], row['status']) for row in data['results']], [
+            ('W-A', 4, 'critical'), ('W-B', 9, 'critical'), ('W-D', 9, 'critical'), ('W-C', 11, 'critical'),
+        ])
+
+
+class ArchiveTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        archive_settings = override_settings(ARCHIVE={'DIRECTORY': directory.name, 'HORIZON_DAYS': 365, 'CHUNK_SIZE': 2})
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+        self.directory = Path(directory.name)
+
+        old = timezone.now() - timedelta(days=420)
+        self.old_ids = []
+        for quantity in (30, 20, 10):
+            movement = StockMovement.objects.create(
+                inventory=self.stock, movement_type='transfer', quantity_change=-quantity, from_location=self.warehouse,
+                to_location=self.pharmacy, notes=f'Old transfer {quantity}', created_by=self.staff,
+            )
+            self.old_ids.append(movement.id)
+        StockMovement.objects.filter(pk__in=self.old_ids).update(created_at=old)
+        self.recent = StockMovement.objects.create(
+            inventory=self.stock, movement_type='transfer', quantity_change=-5, from_location=self.warehouse,
+            to_location=self.pharmacy, created_by=self.staff,
+        )
+        rollups.rebuild()
+
+    def rollup_rows(self):
+        return sorted(DailyMovementRollup.objects.values_list('location', 'day', 'movement_type', 'units_in', 'units_out', 'movements'))
+
+    def history(self, query=''):
+        return self.client.get(f'/api/stock-movements/movement_history/?days=500&location={self.pharmacy.id}{query}').json()
+
+    def test_round_trip(self):
+        rollup_rows = self.rollup_rows()
+        call_command('archive_movements', stdout=StringIO())
+
+        self.assertEqual(list(StockMovement.objects.values_list('id', flat=True)), [self.recent.id])
+        [shard] = MovementArchive.objects.all()
+        self.assertEqual(shard.row_count, 3)
+        self.assertTrue((self.directory / shard.path).exists())
+        # Rollups keep covering archived days, even through a rebuild.
+        self.assertEqual(self.rollup_rows(), rollup_rows)
+        rollups.rebuild()
+        self.assertEqual(self.rollup_rows(), rollup_rows)
+
+        self.assertEqual([row['id'] for row in self.history()], [self.recent.id])
+        rows = self.history('&include_archived=true')
+        self.assertEqual([row['id'] for row in rows], [*self.old_ids, self.recent.id])
+        self.assertEqual(
+            (rows[0]['quantity_change'], rows[0]['notes'], rows[0]['from_location_name'], rows[0]['medicine_name']),
+            (-30, 'Old transfer 30', 'Central Warehouse', 'Amoxicillin'),
+        )
+        rows = self.history('&include_archived=true&fields=quantity_change')
+        self.assertEqual(rows[0], {'id': self.old_ids[0], 'quantity_change': -30})
+
+    def test_archived_rows_respect_the_users_scope(self):
+        call_command('archive_movements', stdout=StringIO())
+        client = self.client_for(self.pharmacist(locations=[self.hospital]))
+        response = client.get('/api/stock-movements/movement_history/?days=500&include_archived=true')
+        self.assertEqual(response.json(), [])
+
+    def test_runs_can_be_repeated(self):
+        output = StringIO()
+        call_command('archive_movements', '--dry-run', stdout=output)
+        self.assertEqual(output.getvalue().split(), [f'{timezone.localdate(timezone.now() - timedelta(days=420)):%Y-%m}'])
+        self.assertEqual(StockMovement.objects.count(), 4)
+
+        call_command('archive_movements', stdout=StringIO())
+        self.assertEqual(archive.archive_movements(), {})
+        # Re-running an archived month leaves its shard as it was.
+        month = MovementArchive.objects.get().month
+        self.assertEqual(archive.archive_month(month), 0)
+        self.assertEqual(MovementArchive.objects.get().row_count, 3)
+
+
+class BootstrapTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.shelf = Inventory.objects.create(batch=self.batch, location=self.pharmacy, quantity=40)
+
+    def test_role_sections_limited_to_the_users_scope(self):
+        client = self.client_for(self.pharmacist(locations=[self.pharmacy]))
+        data = client.get('/api/bootstrap/').json()
+        self.assertEqual(set(data) - {'role', 'generated_at'}, set(bootstrap.ROLE_SECTIONS['pharmacist']))
+        self.assertEqual(data['role'], 'pharmacist')
+        self.assertEqual([row['id'] for row in data['locations']], [self.pharmacy.id])
+        self.assertEqual([row['id'] for row in data['inventory']['results']], [self.shelf.id])
+        self.assertEqual(
+            [(row['location'], row['current_stock']) for row in data['low_stock_alerts']], [('Main Street Pharmacy', 40)],
+        )
+        self.assertEqual(data['dashboard']['low_stock_alerts'], 1)
+
+    def test_sections_match_their_endpoints(self):
+        data = self.client.get('/api/bootstrap/?sections=dashboard,low_stock_alerts').json()
+        self.assertEqual(set(data), {'role', 'generated_at', 'dashboard', 'low_stock_alerts'})
+        self.assertEqual(data['low_stock_alerts'], self.client.get('/api/inventory/low_stock_alerts/').json())
+        stats = self.client.get('/api/inventory/dashboard_stats/').json()
+        self.assertEqual(data['dashboard'], stats)
+
+    def test_sync_async_and_bootstrap_share_the_low_stock_threshold(self):
+        # The async views authenticate through the session.
+        self.client.force_login(self.staff)
+        with mock.patch.object(dashboard, 'LOW_STOCK_THRESHOLD', 600):
+            counts = [
+                self.client.get('/api/bootstrap/?sections=dashboard').json()['dashboard']['low_stock_alerts'],
+                self.client.get('/api/inventory/dashboard_stats/').json()['low_stock_alerts'],
+                self.client.get('/api/async/inventory/dashboard_stats/').json()['low_stock_alerts'],
+                len(self.client.get('/api/async/inventory/low_stock_alerts/').json()),
+            ]
+        self.assertEqual(counts, [2, 2, 2, 2])
+
+    def test_responses_are_cached_per_user_and_sections(self):
+        first = self.client.get('/api/bootstrap/?sections=inventory')
+        self.assertEqual(first['X-Bootstrap-Cache'], 'miss')
+        Inventory.objects.create(batch=self.batch, location=self.hospital, quantity=1)
+        second = self.client.get('/api/bootstrap/?sections=inventory')
+        self.assertEqual(second['X-Bootstrap-Cache'], 'hit')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(self.client.get('/api/bootstrap/?sections=inventory,user')['X-Bootstrap-Cache'], 'miss')
+        other = self.client_for(User.objects.create_user('other-staff', is_staff=True))
+        self.assertEqual(other.get('/api/bootstrap/?sections=inventory').json()['inventory']['count'], 3)
+
+    def test_unknown_sections(self):
+        response = self.client.get('/api/bootstrap/?sections=user,orders')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('orders', response.json()['error'])
+
+
+class DemandAnomalyTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        # Series statistics live per process.
+        anomalies._stats = anomalies.SeriesStats()
+        self.today = timezone.localdate()
+        self.shelf = Inventory.objects.create(batch=self.batch, location=self.pharmacy, quantity=500)
+
+    def history(self, location, days, units=10):
+        DailyMovementRollup.objects.bulk_create([
+            DailyMovementRollup(
+                medicine=self.medicine, location=location, day=self.today - timedelta(days=ago),
+                movement_type='distribution', units_out=units, movements=1,
+            )
+            for ago in range(1, days + 1)
+        ])
+
+    def distribute(self, quantity, inventory=None):
+        StockMovement.objects.create(
+            inventory=inventory or self.shelf, movement_type='distribution', quantity_change=-quantity, created_by=self.staff,
+        )
+
+    def test_spikes_are_flagged_as_they_are_recorded(self):
+        self.history(self.pharmacy, 20)
+        self.distribute(12)
+        self.assertFalse(DemandAnomaly.objects.exists())
+
+        self.distribute(48)
+        flag = DemandAnomaly.objects.get()
+        # A flat history of 10 a day: threshold 10 + 4 * MIN_STD.
+        self.assertEqual((flag.day, flag.units, flag.expected, flag.threshold, flag.score), (self.today, 60, 10.0, 14.0, 50.0))
+
+        # Later movements raise the flag's units but keep its review status.
+        DemandAnomaly.objects.filter(pk=flag.pk).update(status='confirmed')
+        self.distribute(5)
+        flag.refresh_from_db()
+        self.assertEqual((flag.units, flag.status), (65, 'confirmed'))
+
+    def test_short_histories_and_small_days_are_not_flagged(self):
+        self.history(self.pharmacy, 10)
+        self.distribute(60)
+        hospital = Inventory.objects.create(batch=self.batch, location=self.hospital, quantity=500)
+        self.history(self.hospital, 20, units=0)
+        DailyMovementRollup.objects.filter(location=self.hospital, day=self.today - timedelta(days=20)).update(units_out=1)
+        self.distribute(9, hospital)
+        self.assertFalse(DemandAnomaly.objects.exists())
+
+    def test_a_spike_does_not_inflate_the_following_baseline(self):
+        self.history(self.pharmacy, 20)
+        DailyMovementRollup.objects.filter(location=self.pharmacy, day=self.today - timedelta(days=3)).update(units_out=500)
+        self.distribute(30)
+        # Folded in at the threshold of 14 (rather than 500, which would
+        # lift the mean to 59), then two days of 10: 10.4, 10.36, 10.324.
+        self.assertEqual(DemandAnomaly.objects.get().expected, 10.32)
+
+    def test_forecast_cleaning(self):
+        self.history(self.pharmacy, 20)
+        self.distribute(60)
+        series = rollups.demand_series(self.medicine.id, self.pharmacy.id, end=self.today)
+        self.assertEqual(series[-1], (self.today, 60))
+        self.assertEqual(anomalies.clean_series(self.medicine.id, self.pharmacy.id, series, 'winsorize')[-1], (self.today, 14))
+        self.assertEqual(anomalies.clean_series(self.medicine.id, self.pharmacy.id, series, 'exclude'), series[:-1])
+        self.assertEqual(anomalies.clean_series(self.medicine.id, self.pharmacy.id, series, 'keep'), series)
+
+        flag = DemandAnomaly.objects.get()
+        response = self.client.patch(f'/api/demand-anomalies/{flag.id}/', {'status': 'dismissed', 'units': 1}, format='json')
+        self.assertEqual(response.status_code, 200)
+        flag.refresh_from_db()
+        self.assertEqual((flag.status, flag.units), ('dismissed', 60))
+        self.assertEqual(anomalies.clean_series(self.medicine.id, self.pharmacy.id, series, 'winsorize'), series)
+
+    def test_list_is_scoped_and_filtered(self):
+        self.history(self.pharmacy, 20)
+        self.distribute(60)
+        self.assertEqual(len(self.client.get('/api/demand-anomalies/?status=open').json()['results']), 1)
+        self.assertEqual(self.client.get(f'/api/demand-anomalies/?location={self.hospital.id}').json()['results'], [])
+        client = self.client_for(self.pharmacist(locations=[self.hospital]))
+        self.assertEqual(client.get('/api/demand-anomalies/').json()['results'], [])
+        self.assertEqual(self.client.get('/api/demand-anomalies/?days=x').status_code, 400)
@@ -0,0 +1,116 @@
+"""
+Cost-based request throttling.
+
+Every user has a token bucket in the local cache, sized and refilled by the
+rate configured for their role (`THROTTLE['RATES']`, e.g. '300/min': 300
+tokens, refilled over a minute). A request spends tokens according to what
+it costs the server rather than counting as one: views name their expensive
+actions in `throttle_costs`, with either a fixed cost or a function of the
+request (see `window_cost`), and everything else costs `throttle_cost`,
+1 by default. A request the bucket cannot pay for is rejected with 429 and
+a `Retry-After` header giving the seconds until it could be paid.
+
+A cost above the bucket's capacity is charged as the whole capacity, so
+any single request can still go through on a full bucket. Buckets are per
+process with the default local-memory cache; configure a shared cache to
+enforce one budget across processes.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+from .models import UserProfile
+
+DEFAULTS = {
+    'CACHE': 'default',
+    # None leaves a role unthrottled. 'user' covers users without a profile.
+    'RATES': {
+        'staff': None,
+        'manufacturer': '600/min',
+        'stockist': '600/min',
+        'pharmacist': '300/min',
+        'user': '300/min',
+        'anon': '60/min',
+    },
+    'ROLE_CACHE_SECONDS': 300,
+}
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+_lock = threading.Lock()
+
+
+def get_setting(name):
+    return getattr(settings, 'THROTTLE', {}).get(name, DEFAULTS[name])
+
+
+def parse_rate(rate):
+    """'300/min' -> (300, 60)."""
+    if rate is None:
+        return None
+    tokens, period = rate.split('/')
+    return int(tokens), PERIODS[period[0]]
+
+
+def window_cost(param='days', default=30, days_per_token=30, base=1):
+    """A cost that grows with the time window a request scans: one extra token per `days_per_token` days."""
+    def cost(request):
+        try:
+            days = int(request.query_params.get(param, default))
+        except (TypeError, ValueError):
+            days = default
+        return base + max(days, 0) // days_per_token
+    return cost
+
+
+def request_cost(request, view):
+    costs = getattr(view, 'throttle_costs', {})
+    cost = costs.get(getattr(view, 'action', None), getattr(view, 'throttle_cost', 1))
+    return cost(request) if callable(cost) else cost
+
+
+class TokenBucketThrottle(BaseThrottle):
+    def __init__(self):
+        self.cache = caches[get_setting('CACHE')]
+        self.wait_seconds = None
+
+    def get_role(self, request):
+        user = request.user
+        if not user or not user.is_authenticated:
+            return 'anon'
+        if user.is_staff:
+            return 'staff'
+        key = f'throttle-role:{user.pk}'
+        role = self.cache.get(key)
+        if role is None:
+            role = UserProfile.objects.filter(user=user).values_list('role', flat=True).first() or 'user'
+            self.cache.set(key, role, get_setting('ROLE_CACHE_SECONDS'))
+        return role
+
+    def allow_request(self, request, view):
+        role = self.get_role(request)
+        rates = get_setting('RATES')
+        rate = parse_rate(rates.get(role, rates.get('user')))
+        if rate is None:
+            return True
+        capacity, period = rate
+        cost = min(request_cost(request, view), capacity)
+        ident = request.user.pk if role != 'anon' else self.get_ident(request)
+        key = f'throttle:{role}:{ident}'
+
+        with _lock:
+            now = time.time()
+            tokens, updated = self.cache.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * capacity / period)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self.cache.set(key, (tokens, now), period)
+        self.wait_seconds = None if allowed else (cost - tokens) * period / capacity
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
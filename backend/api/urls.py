@@ -6,24 +6,33 @@ from .views import (
     ManufacturerViewSet,
     ProductionBatchViewSet,
     LocationViewSet,
+    LocationEdgeViewSet,
     InventoryViewSet,
     ResupplyRequestViewSet,
     StockMovementViewSet,
     DemandForecastViewSet,
+    DemandAnomalyViewSet,
     UserViewSet,
     MyTokenObtainPairView,
-    RegisterView
+    RegisterView,
+    MetricsView,
+    SyncView,
+    SyncUploadView,
+    BootstrapView
 )
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'medicines', MedicineViewSet)
 router.register(r'manufacturers', ManufacturerViewSet)
 router.register(r'production-batches', ProductionBatchViewSet)
 router.register(r'locations', LocationViewSet)
+router.register(r'location-edges', LocationEdgeViewSet)
 router.register(r'inventory', InventoryViewSet)
 router.register(r'resupply-requests', ResupplyRequestViewSet)
 router.register(r'stock-movements', StockMovementViewSet)
 router.register(r'demand-forecasts', DemandForecastViewSet)
+router.register(r'demand-anomalies', DemandAnomalyViewSet)
 router.register(r'users', UserViewSet)
 
 urlpatterns = [
@@ -31,4 +40,13 @@ urlpatterns = [
     path('auth/login/', MyTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('auth/register/', RegisterView.as_view(), name='register'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('sync/', SyncView.as_view(), name='sync'),
+    path('sync/upload/', SyncUploadView.as_view(), name='sync_upload'),
+    path('bootstrap/', BootstrapView.as_view(), name='bootstrap'),
+    path('async/inventory/dashboard_stats/', async_views.dashboard_stats, name='async_dashboard_stats'),
+    path('async/inventory/low_stock_alerts/', async_views.low_stock_alerts, name='async_low_stock_alerts'),
+    path('async/demand-forecasts/expiring_soon/', async_views.expiring_soon, name='async_expiring_soon'),
+    path('async/demand-forecasts/search/', async_views.search, name='async_search'),
+    path('events/', async_views.events, name='events'),
 ]
\ No newline at end of file
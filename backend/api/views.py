@@ -1,23 +1,298 @@
 from django.shortcuts import render
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
 from rest_framework import viewsets, status, generics, permissions
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.views import APIView
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db.models import Sum, Count, Q
+from django.db import models, transaction
+from django.db.models import Sum, Count, Q, F
 from django.utils import timezone
 from datetime import datetime, timedelta
+import hashlib
 import json
 from rest_framework.decorators import action
-from rest_framework.parsers import MultiPartParser
-from .ai.forecasting import generate_forecast_from_csv
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.settings import api_settings
+from .ai.forecasting import FREQUENCIES, generate_forecast_from_csv, generate_forecast_from_series
 
-from .models import Medicine, Manufacturer, ProductionBatch, Location, Inventory, StockMovement, ResupplyRequest, DemandForecast
-from .serializers import MedicineSerializer, ManufacturerSerializer, ProductionBatchSerializer, LocationSerializer, InventorySerializer, ResupplyRequestSerializer, StockMovementSerializer, DemandForecastSerializer
+from .models import Medicine, Manufacturer, ProductionBatch, Location, LocationEdge, Inventory, StockMovement, ResupplyRequest, DemandForecast, DemandAnomaly, DailyMovementRollup, WeeklyMovementRollup
+from .serializers import MedicineSerializer, ManufacturerSerializer, ProductionBatchSerializer, LocationSerializer, LocationEdgeSerializer, InventorySerializer, ResupplyRequestSerializer, StockMovementSerializer, DemandForecastSerializer, DemandAnomalySerializer
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth.models import User
-from .serializers import UserSerializer, RegisterSerializer, MyTokenObtainPairSerializer
+from .serializers import UserSerializer, RegisterSerializer, MyTokenObtainPairSerializer, BulkListSerializer, ProductionRunListSerializer, ResupplyPlanRunSerializer, sparse_field_names
+from .renderers import COMPACT_RENDERER_CLASSES
+from .fast_serializers import InventoryValuesSerializer, StockMovementValuesSerializer
+from .routing import METRICS as ROUTING_METRICS, get_routing_table, suggest_redirections
+from .rebalancing import plan_rebalancing
+from .resupply import plan_resupply
+from .rollups import demand_series
+from .anomalies import CLEANING_MODES, clean_series, get_setting as anomaly_setting
+from .archive import archived_until, archived_movements, columns as archive_columns
+from .idempotency import idempotent
+from .scoping import request_scope, scope_queryset, in_scope
+from . import dashboard
+from .throttling import window_cost
+from .waste import ORDERINGS as WASTE_ORDERINGS, waste_risk_report
+from .bootstrap import SECTIONS as BOOTSTRAP_SECTIONS, bootstrap, get_setting as bootstrap_setting
+from .sync import DEFAULT_LIMIT as SYNC_DEFAULT_LIMIT, MAX_LIMIT as SYNC_MAX_LIMIT, MAX_UPLOAD_CHANGES, pull as sync_pull, apply_offline_changes
+from .exports import TABLES as EXPORT_TABLES, FORMATS as EXPORT_FORMATS, DEFAULT_CHUNK_SIZE as EXPORT_CHUNK_SIZE, MAX_CHUNK_SIZE as EXPORT_MAX_CHUNK_SIZE, stream_export
+from .metrics import registry as metrics_registry, timed_serialization, InstrumentedSerializerMixin
 from .permissions import IsManufacturer, IsStockist, IsPharmacist, IsManufacturerOrStockist, IsStockistOrPharmacist
 from .models import UserProfile
 
+class CompactListMixin:
+    """
+    Narrows list/retrieve querysets to the columns and joins the (possibly
+    sparse) serializer actually reads, and offers the compact columnar and
+    MessagePack renderers alongside JSON.
+    """
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, *COMPACT_RENDERER_CLASSES]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            paths = self.get_serializer().sparse_orm_paths()
+            if paths is not None:
+                only, related = paths
+                # Joins from the base queryset would clash with deferred columns.
+                queryset = queryset.select_related(None)
+                if related:
+                    queryset = queryset.select_related(*related)
+                queryset = queryset.only(*only)
+        return queryset
+
+class ScopedQuerysetMixin:
+    """
+    Limits the queryset to rows at the requesting user's locations (see
+    `api.scoping`). `scope_fields` are location lookups, any of which may
+    match; writes must reference at least one location in scope through
+    `write_scope_fields`, which default to the same lookups.
+    """
+    scope_fields = ()
+    write_scope_fields = None
+
+    def get_queryset(self):
+        return self.scoped(super().get_queryset(), *self.scope_fields)
+
+    def scoped(self, queryset, *fields):
+        return scope_queryset(queryset, request_scope(self.request), *fields)
+
+    def _check_write_scope(self, data, instance=None):
+        scope = request_scope(self.request)
+        if scope is None:
+            return
+        locations = []
+        for path in self.write_scope_fields or self.scope_fields:
+            first, *rest = path.split('__')
+            if first == 'id':
+                continue
+            value = data.get(first, getattr(instance, first, None))
+            for part in rest:
+                value = getattr(value, part, None)
+            if value is not None:
+                locations.append(getattr(value, 'pk', value))
+        if locations and not any(in_scope(scope, location) for location in locations):
+            raise PermissionDenied('That location is outside your organization')
+
+    def perform_create(self, serializer):
+        self._check_write_scope(serializer.validated_data)
+        super().perform_create(serializer)
+
+    def perform_update(self, serializer):
+        self._check_write_scope(serializer.validated_data, serializer.instance)
+        super().perform_update(serializer)
+
+    def perform_bulk_save(self, serializer):
+        for data in serializer.validated_data:
+            self._check_write_scope(data)
+        super().perform_bulk_save(serializer)
+
+class FastListMixin:
+    """
+    Serves `list` through a `ValuesSerializer` when the viewset declares one,
+    producing plain dicts from a single `values()` query instead of running
+    a ModelSerializer per object. Pagination and filtering are unchanged.
+    """
+    fast_serializer_class = None
+
+    def get_fast_serializer(self, queryset):
+        return self.fast_serializer_class(queryset, self.request.query_params)
+
+    def list(self, request, *args, **kwargs):
+        if self.fast_serializer_class is None:
+            return super().list(request, *args, **kwargs)
+        rows = self.get_fast_serializer(self.filter_queryset(self.get_queryset())).get_paginatable()
+        page = self.paginate_queryset(rows)
+        with timed_serialization():
+            data = list(page if page is not None else rows.rows)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+class BulkModelMixin:
+    """
+    Adds `bulk_create`, `bulk_update` and `bulk_upsert` list actions.
+
+    Each takes a JSON list of objects, validates it through `BulkListSerializer`
+    and persists the whole payload in one transaction. The response lists the
+    ids that were created and updated.
+    """
+    bulk_serializer_class = BulkListSerializer
+    bulk_max_items = 10000
+
+    def get_bulk_serializer(self, mode, data=None):
+        context = self.get_serializer_context()
+        return self.bulk_serializer_class(
+            child=self.get_serializer_class()(context=context),
+            data=self.request.data if data is None else data,
+            mode=mode,
+            partial=mode == 'update',
+            allow_empty=False,
+            max_length=self.bulk_max_items,
+            context=context,
+        )
+
+    def perform_bulk_save(self, serializer):
+        serializer.save()
+
+    def bulk_write(self, mode):
+        serializer = self.get_bulk_serializer(mode)
+        with transaction.atomic():
+            serializer.is_valid(raise_exception=True)
+            self.perform_bulk_save(serializer)
+        return Response({
+            'created': [obj.pk for obj in serializer.created],
+            'updated': [obj.pk for obj in serializer.updated],
+        }, status=status.HTTP_201_CREATED if serializer.created else status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'])
+    def bulk_create(self, request):
+        return self.bulk_write('create')
+
+    @action(detail=False, methods=['patch'])
+    def bulk_update(self, request):
+        return self.bulk_write('update')
+
+    @action(detail=False, methods=['post'])
+    def bulk_upsert(self, request):
+        return self.bulk_write('upsert')
+
+class ExportMixin:
+    """
+    Adds an `export` list action streaming the whole table, or the slice the
+    query parameters select, as CSV, Parquet or Arrow (`?file_format=`).
+    Rows are read in keyset-paginated chunks (`?chunk_size=`) and written to
+    the response as they are encoded, so memory stays bounded.
+    """
+    export_table = None
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        table = EXPORT_TABLES[self.export_table]
+        file_format = request.query_params.get('file_format', 'csv')
+        try:
+            chunk_size = int(request.query_params.get('chunk_size', EXPORT_CHUNK_SIZE))
+        except ValueError:
+            return Response({'error': 'chunk_size must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= chunk_size <= EXPORT_MAX_CHUNK_SIZE:
+            return Response({'error': f'chunk_size must be between 1 and {EXPORT_MAX_CHUNK_SIZE}'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            rows = table.values_queryset(request.query_params, self.get_queryset())
+            content = stream_export(rows, file_format, chunk_size)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        content_type, extension = EXPORT_FORMATS[file_format]
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{self.export_table}.{extension}"'
+        return response
+
+class IdempotentWritesMixin:
+    """
+    Honours the `Idempotency-Key` header on create, update and destroy, so
+    clients can retry them safely; custom write actions opt in with
+    `@idempotent`.
+    """
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    @idempotent
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+
+    @idempotent
+    def partial_update(self, request, *args, **kwargs):
+        return super().partial_update(request, *args, **kwargs)
+
+    @idempotent
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
+
+class MetricsView(APIView):
+    """Per-endpoint performance metrics in the Prometheus text format (admins only)."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(
+            metrics_registry.render_prometheus(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
+
+class SyncView(APIView):
+    """Rows changed and deleted since `?token=`, for offline-capable clients (see `api.sync`)."""
+
+    def get(self, request):
+        tables = request.query_params.get('tables')
+        try:
+            limit = int(request.query_params.get('limit', SYNC_DEFAULT_LIMIT))
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= limit <= SYNC_MAX_LIMIT:
+            return Response({'error': f'limit must be between 1 and {SYNC_MAX_LIMIT}'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            data = sync_pull(
+                request.query_params.get('token'),
+                tables.split(',') if tables else None,
+                request.query_params,
+                limit,
+                request_scope(request)
+            )
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data)
+
+class SyncUploadView(APIView):
+    """Apply a batch of stock changes queued offline; safe to resend."""
+    throttle_cost = 5
+
+    def post(self, request):
+        changes = request.data.get('changes') if isinstance(request.data, dict) else None
+        if not isinstance(changes, list) or not changes:
+            return Response({'error': 'changes must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(changes) > MAX_UPLOAD_CHANGES:
+            return Response({'error': f'At most {MAX_UPLOAD_CHANGES} changes per upload'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'results': apply_offline_changes(request.user, changes, request_scope(request))})
+
+class BootstrapView(APIView):
+    """Everything a page needs on first render, in one cached response (see `api.bootstrap`)."""
+
+    def get(self, request):
+        sections = None
+        if request.query_params.get('sections'):
+            sections = tuple(dict.fromkeys(request.query_params['sections'].split(',')))
+            unknown = [name for name in sections if name not in BOOTSTRAP_SECTIONS]
+            if unknown:
+                return Response({'error': f"Unknown sections: {', '.join(unknown)}; expected {', '.join(BOOTSTRAP_SECTIONS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        payload, cached = bootstrap(request, sections)
+        response = Response(payload)
+        response['X-Bootstrap-Cache'] = 'hit' if cached else 'miss'
+        patch_cache_control(response, private=True, max_age=bootstrap_setting('TTL_SECONDS'))
+        return response
+
 class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = MyTokenObtainPairSerializer
 
@@ -26,7 +301,7 @@ class RegisterView(generics.CreateAPIView):
     permission_classes = [permissions.AllowAny]
     serializer_class = RegisterSerializer
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(InstrumentedSerializerMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAdminUser]
@@ -36,91 +311,112 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(request.user)
         return Response(serializer.data)
 
-class MedicineViewSet(viewsets.ModelViewSet):
+class MedicineViewSet(InstrumentedSerializerMixin, CompactListMixin, BulkModelMixin, viewsets.ModelViewSet):
     queryset = Medicine.objects.all()
     serializer_class = MedicineSerializer
 
-class ManufacturerViewSet(viewsets.ModelViewSet):
+class ManufacturerViewSet(InstrumentedSerializerMixin, CompactListMixin, BulkModelMixin, viewsets.ModelViewSet):
     queryset = Manufacturer.objects.all()
     serializer_class = ManufacturerSerializer
 
-class ProductionBatchViewSet(viewsets.ModelViewSet):
+class ProductionBatchViewSet(InstrumentedSerializerMixin, ScopedQuerysetMixin, CompactListMixin, BulkModelMixin, viewsets.ModelViewSet):
     queryset = ProductionBatch.objects.all()
+    # Batches are shared across the network; only the location a new batch
+    # is stocked at must be in scope.
+    write_scope_fields = ('initial_location',)
     serializer_class = ProductionBatchSerializer
+    bulk_serializer_class = ProductionRunListSerializer
 
-    def create(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        batch = serializer.save()
+    def perform_create(self, serializer):
+        # The batch, its opening Inventory row and its production movement
+        # are written together or not at all.
+        with transaction.atomic():
+            super().perform_create(serializer)
+
+    @action(detail=False, methods=['post'])
+    def production_run(self, request):
+        """Create every batch of a production run, with its opening stock, in one transaction"""
+        batches = request.data.get('batches')
+        if not isinstance(batches, list):
+            return Response({'error': 'batches must be a list'}, status=status.HTTP_400_BAD_REQUEST)
         
-        StockMovement.objects.create(
-            inventory=None,
-            movement_type='production',
-            quantity_change=batch.quantity,
-            to_location_id=request.data.get('initial_location'),
-            notes=f"Initial production batch {batch.batch_number}",
-            created_by=request.user
-        )
+        initial_location = request.data.get('initial_location')
+        if initial_location is not None:
+            batches = [
+                {'initial_location': initial_location, **batch} if isinstance(batch, dict) else batch
+                for batch in batches
+            ]
+        
+        serializer = self.get_bulk_serializer('create', data=batches)
+        with transaction.atomic():
+            serializer.is_valid(raise_exception=True)
+            self.perform_bulk_save(serializer)
         
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response({
+            'batches': [batch.pk for batch in serializer.created],
+            'inventory': [inventory.pk for inventory in serializer.inventories],
+            'total_quantity': sum(batch.quantity for batch in serializer.created)
+        }, status=status.HTTP_201_CREATED)
 
-class LocationViewSet(viewsets.ModelViewSet):
+class LocationViewSet(InstrumentedSerializerMixin, ScopedQuerysetMixin, CompactListMixin, BulkModelMixin, viewsets.ModelViewSet):
     queryset = Location.objects.all()
+    scope_fields = ('id',)
     serializer_class = LocationSerializer
 
-class InventoryViewSet(viewsets.ModelViewSet):
+class LocationEdgeViewSet(InstrumentedSerializerMixin, ScopedQuerysetMixin, CompactListMixin, BulkModelMixin, viewsets.ModelViewSet):
+    queryset = LocationEdge.objects.select_related('from_location', 'to_location')
+    scope_fields = ('from_location', 'to_location')
+    serializer_class = LocationEdgeSerializer
+
+    @action(detail=False, methods=['get'])
+    def route(self, request):
+        """Shortest route between two locations by transit time or cost"""
+        metric = request.query_params.get('metric', 'transit_hours')
+        if metric not in ROUTING_METRICS:
+            return Response({'error': f"metric must be one of {', '.join(ROUTING_METRICS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            source = int(request.query_params['from'])
+            target = int(request.query_params['to'])
+        except (KeyError, ValueError):
+            return Response({'error': 'from and to location ids are required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        table = get_routing_table(metric)
+        path = table.path(source, target)
+        if path is None:
+            return Response({'error': 'No route between these locations'}, status=status.HTTP_404_NOT_FOUND)
+        # Hops outside the user's scope are listed without their names.
+        names = self.scoped(Location.objects.all(), 'id').in_bulk(path)
+        return Response({
+            'from_location': source,
+            'to_location': target,
+            metric: table.distance(source, target),
+            'route': [{'id': pk, 'name': names[pk].name if pk in names else None} for pk in path]
+        })
+
+class InventoryViewSet(InstrumentedSerializerMixin, ScopedQuerysetMixin, FastListMixin, CompactListMixin, ExportMixin, IdempotentWritesMixin, viewsets.ModelViewSet):
     queryset = Inventory.objects.all()
+    scope_fields = ('location',)
+    throttle_costs = {'export': 10}
     serializer_class = InventorySerializer
+    fast_serializer_class = InventoryValuesSerializer
+    export_table = 'inventory'
 
     @action(detail=False, methods=['get'])
     def dashboard_stats(self, request):
-        total_medicines = Medicine.objects.count()
-        low_stock_count = Inventory.objects.filter(
-            Q(quantity__lt=100) | Q(status='low_stock')
-        ).count()
-        in_transit_count = Inventory.objects.filter(status='in_transit').count()
-        
-        recent_activity = StockMovement.objects.select_related(
-            'inventory__batch__medicine', 'from_location', 'to_location'
-        ).order_by('-created_at')[:10]
-        
-        activity_data = []
-        for movement in recent_activity:
-            activity_data.append({
-                'timestamp': movement.created_at.strftime('%Y-%m-%d %H:%M'),
-                'event': movement.movement_type.replace('_', ' ').title(),
-                'medicine': movement.inventory.batch.medicine.name if movement.inventory else 'N/A',
-                'details': f"{abs(movement.quantity_change)} units",
-                'location': movement.to_location.name if movement.to_location else movement.from_location.name
-            })
-        
-        return Response({
-            'medicines_in_system': total_medicines,
-            'low_stock_alerts': low_stock_count,
-            'items_in_transit': in_transit_count,
-            'forecast_accuracy': 92.5,
-            'recent_activity': activity_data
-        })
+        scope = request_scope(request)
+        return Response(dashboard.stats(
+            Medicine.objects.count(),
+            dashboard.low_stock(scope).count(),
+            dashboard.in_transit(scope).count(),
+            dashboard.recent_activity(scope),
+        ))
 
     @action(detail=False, methods=['get'])
     def low_stock_alerts(self, request):
-        low_stock_items = Inventory.objects.filter(
-            Q(quantity__lt=100) | Q(status='low_stock')
-        ).select_related('batch__medicine', 'location')
-        
-        alerts = []
-        for item in low_stock_items:
-            alerts.append({
-                'medicine': item.batch.medicine.name,
-                'location': item.location.name,
-                'current_stock': item.quantity,
-                'batch_number': item.batch.batch_number,
-                'status': item.status
-            })
-        
-        return Response(alerts)
+        return Response([dashboard.alert_row(row) for row in dashboard.low_stock_alerts(request_scope(request))])
 
     @action(detail=False, methods=['post'])
+    @idempotent
     def update_stock(self, request):
         batch_number = request.data.get('batch_number')
         location_name = request.data.get('location')
@@ -129,42 +425,73 @@ class InventoryViewSet(viewsets.ModelViewSet):
         try:
             batch = ProductionBatch.objects.get(batch_number=batch_number)
             location = Location.objects.get(name=location_name)
-            inventory, created = Inventory.objects.get_or_create(
-                batch=batch,
-                location=location,
-                defaults={'quantity': new_quantity}
-            )
-            
-            if not created:
-                old_quantity = inventory.quantity
-                inventory.quantity = new_quantity
-                inventory.save()
-                
-                StockMovement.objects.create(
-                    inventory=inventory,
-                    movement_type='adjustment',
-                    quantity_change=new_quantity - old_quantity,
-                    notes="Manual stock update",
-                    created_by=request.user
+            if not in_scope(request_scope(request), location.pk):
+                return Response({'error': 'That location is outside your organization'}, status=status.HTTP_403_FORBIDDEN)
+            with transaction.atomic():
+                inventory, created = Inventory.objects.select_for_update().get_or_create(
+                    batch=batch,
+                    location=location,
+                    defaults={'quantity': new_quantity}
                 )
+                
+                if not created:
+                    old_quantity = inventory.quantity
+                    inventory.quantity = new_quantity
+                    inventory.save(update_fields=['quantity', 'last_updated'])
+                    
+                    StockMovement.objects.create(
+                        inventory=inventory,
+                        movement_type='adjustment',
+                        quantity_change=new_quantity - old_quantity,
+                        notes="Manual stock update",
+                        created_by=request.user
+                    )
             
             return Response({'success': True})
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-class ResupplyRequestViewSet(viewsets.ModelViewSet):
+class ResupplyRequestViewSet(InstrumentedSerializerMixin, ScopedQuerysetMixin, CompactListMixin, viewsets.ModelViewSet):
     queryset = ResupplyRequest.objects.all()
+    scope_fields = ('requesting_location',)
+    throttle_costs = {'plan': 10}
     serializer_class = ResupplyRequestSerializer
 
     def create(self, request, *args, **kwargs):
         request.data['requested_by'] = request.user.id
         return super().create(request, *args, **kwargs)
 
-class StockMovementViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'])
+    def plan(self, request):
+        """Create or merge requests for every series in scope projected to run short over the lead time"""
+        try:
+            lead_time_days = int(request.data.get('lead_time_days', 7))
+            safety_ratio = float(request.data.get('safety_ratio', 0.25))
+        except (TypeError, ValueError):
+            return Response({'error': 'lead_time_days must be an integer and safety_ratio a number'}, status=status.HTTP_400_BAD_REQUEST)
+        if lead_time_days < 1 or safety_ratio < 0:
+            return Response({'error': 'lead_time_days must be positive and safety_ratio non-negative'}, status=status.HTTP_400_BAD_REQUEST)
+        full = str(request.data.get('full', '')).lower() in ('1', 'true', 'yes')
+
+        run = plan_resupply(request.user, lead_time_days, safety_ratio, full, request_scope(request))
+        return Response(ResupplyPlanRunSerializer(run).data, status=status.HTTP_201_CREATED)
+
+class StockMovementViewSet(InstrumentedSerializerMixin, ScopedQuerysetMixin, FastListMixin, CompactListMixin, ExportMixin, IdempotentWritesMixin, viewsets.ModelViewSet):
     queryset = StockMovement.objects.all()
+    scope_fields = ('inventory__location', 'from_location', 'to_location')
+    # Movements are written against the stock they change.
+    write_scope_fields = ('inventory__location',)
+    throttle_costs = {
+        'export': 10,
+        'movement_history': window_cost('days', default=30, days_per_token=30),
+        'consumption': window_cost('days', default=90, days_per_token=365),
+    }
     serializer_class = StockMovementSerializer
+    fast_serializer_class = StockMovementValuesSerializer
+    export_table = 'stock-movements'
     
     @action(detail=False, methods=['post'])
+    @idempotent
     def transfer_stock(self, request):
         """Transfer stock between locations"""
         from_location_id = request.data.get('from_location')
@@ -175,34 +502,52 @@ class StockMovementViewSet(viewsets.ModelViewSet):
         
         if quantity <= 0:
             return Response({'error': 'Quantity must be positive'}, status=status.HTTP_400_BAD_REQUEST)
+        if not in_scope(request_scope(request), from_location_id):
+            return Response({'error': 'That location is outside your organization'}, status=status.HTTP_403_FORBIDDEN)
             
         try:
-            source_inventory = Inventory.objects.get(location_id=from_location_id, batch_id=batch_id)
-            
-            if source_inventory.quantity < quantity:
-                return Response({'error': 'Not enough stock available'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            source_inventory.quantity -= quantity
-            source_inventory.save()
-            
-            dest_inventory, created = Inventory.objects.get_or_create(
-                location_id=to_location_id,
-                batch_id=batch_id,
-                defaults={'quantity': 0, 'status': 'available'}
-            )
-            
-            dest_inventory.quantity += quantity
-            dest_inventory.save()
-            
-            movement = StockMovement.objects.create(
-                inventory=source_inventory,
-                movement_type='transfer',
-                quantity_change=-quantity,
-                from_location_id=from_location_id,
-                to_location_id=to_location_id,
-                notes=notes,
-                created_by=request.user
-            )
+            with transaction.atomic():
+                if not Inventory.objects.filter(location_id=from_location_id, batch_id=batch_id).exists():
+                    raise Inventory.DoesNotExist
+                Inventory.objects.get_or_create(
+                    location_id=to_location_id,
+                    batch_id=batch_id,
+                    defaults={'quantity': 0, 'status': 'available'}
+                )
+                # Lock both rows in one statement, in primary key order, so
+                # opposing transfers of a batch cannot deadlock and concurrent
+                # ones cannot both pass the availability check. Both sides are
+                # applied with F() so the increments never depend on a stale read.
+                locked = {
+                    str(row.location_id): row
+                    for row in Inventory.objects.select_for_update().filter(
+                        batch_id=batch_id, location_id__in=[from_location_id, to_location_id]
+                    ).order_by('pk')
+                }
+                source_inventory = locked[str(from_location_id)]
+                dest_inventory = locked[str(to_location_id)]
+                
+                if source_inventory.quantity < quantity:
+                    # Drop the destination row created above.
+                    transaction.set_rollback(True)
+                    return Response({'error': 'Not enough stock available'}, status=status.HTTP_400_BAD_REQUEST)
+                
+                Inventory.objects.filter(pk=source_inventory.pk).update(
+                    quantity=F('quantity') - quantity, last_updated=timezone.now()
+                )
+                Inventory.objects.filter(pk=dest_inventory.pk).update(
+                    quantity=F('quantity') + quantity, last_updated=timezone.now()
+                )
+                
+                movement = StockMovement.objects.create(
+                    inventory=source_inventory,
+                    movement_type='transfer',
+                    quantity_change=-quantity,
+                    from_location_id=from_location_id,
+                    to_location_id=to_location_id,
+                    notes=notes,
+                    created_by=request.user
+                )
             
             return Response({
                 'success': True,
@@ -215,18 +560,52 @@ class StockMovementViewSet(viewsets.ModelViewSet):
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=False, methods=['get'])
+    def consumption(self, request):
+        """Daily or weekly unit totals from the movement rollups"""
+        period = request.query_params.get('period', 'day')
+        if period not in ('day', 'week'):
+            return Response({'error': 'period must be day or week'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            days = int(request.query_params.get('days', 90))
+        except ValueError:
+            return Response({'error': 'days must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        movement_types = request.query_params.get('movement_type', 'distribution').split(',')
+
+        field = 'day' if period == 'day' else 'week_start'
+        model = DailyMovementRollup if period == 'day' else WeeklyMovementRollup
+        rows = self.scoped(model.objects.all(), 'location').filter(
+            movement_type__in=movement_types,
+            **{f'{field}__gte': timezone.localdate() - timedelta(days=days)}
+        )
+        if request.query_params.get('medicine'):
+            rows = rows.filter(medicine_id=request.query_params['medicine'])
+        if request.query_params.get('location'):
+            rows = rows.filter(location_id=request.query_params['location'])
+
+        data = rows.values(field).annotate(
+            units_in=Sum('units_in'), units_out=Sum('units_out'), movements=Sum('movements')
+        ).order_by(field)
+        return Response([
+            {'period': row[field], 'units_in': row['units_in'], 'units_out': row['units_out'], 'movements': row['movements']}
+            for row in data
+        ])
+
     @action(detail=False, methods=['get'])
     def movement_history(self, request):
-        """Get movement history for a specific batch or location"""
+        """Get movement history for a specific batch or location; `?include_archived=true` adds archived months"""
         batch_id = request.query_params.get('batch')
         location_id = request.query_params.get('location')
-        days = int(request.query_params.get('days', 30))
+        try:
+            days = int(request.query_params.get('days', 30))
+        except ValueError:
+            return Response({'error': 'days must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
         
         from django.utils import timezone
         from datetime import timedelta
         start_date = timezone.now() - timedelta(days=days)
         
-        queryset = StockMovement.objects.filter(created_at__gte=start_date)
+        queryset = self.get_queryset().filter(created_at__gte=start_date)
         
         if batch_id:
             queryset = queryset.filter(inventory__batch_id=batch_id)
@@ -237,13 +616,29 @@ class StockMovementViewSet(viewsets.ModelViewSet):
                 models.Q(to_location_id=location_id)
             )
         
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        with timed_serialization():
+            data = self.get_fast_serializer(queryset).data
 
-class DemandForecastViewSet(viewsets.ModelViewSet):
+        include_archived = request.query_params.get('include_archived', '').lower() in ('1', 'true', 'yes')
+        boundary = archived_until() if include_archived else None
+        if boundary is not None and timezone.localdate(start_date) < boundary:
+            hot_ids = {row['id'] for row in data if 'id' in row}
+            archived = archived_movements(
+                start_date, None, batch_id, location_id, request_scope(request),
+                sparse_field_names(archive_columns(), request.query_params)
+            )
+            # A row can briefly be in both while an archive run is deleting it.
+            data = [row for row in archived if row.get('id') not in hot_ids] + data
+        return Response(data)
+
+class DemandForecastViewSet(InstrumentedSerializerMixin, ScopedQuerysetMixin, CompactListMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = DemandForecast.objects.all()
+    scope_fields = ('location',)
+    # A Prophet fit is the most expensive thing the API does.
+    throttle_costs = {'upload_csv_forecast': 25, 'forecast_from_history': 25, 'rebalance': 10, 'waste_risk': 5, 'export': 10}
     serializer_class = DemandForecastSerializer
-    parser_classes = [MultiPartParser]
+    export_table = 'demand-forecasts'
+    parser_classes = [JSONParser, MultiPartParser]
 
     @action(detail=False, methods=['post'])
     def generate_forecast(self, request):
@@ -275,32 +670,100 @@ class DemandForecastViewSet(viewsets.ModelViewSet):
 
         if not file:
             return Response({'error': 'No CSV file uploaded'}, status=400)
+        if not in_scope(request_scope(request), location_id):
+            return Response({'error': 'That location is outside your organization'}, status=status.HTTP_403_FORBIDDEN)
+        options, error = self._forecast_options(request)
+        if error:
+            return error
 
         try:
             csv_content = file.read().decode('utf-8')
-            forecasted_data = generate_forecast_from_csv(csv_content)
+            forecasted_data = generate_forecast_from_csv(csv_content, **options)
 
-            # Save predictions to database
-            saved = []
-            for row in forecasted_data:
-                obj, created = DemandForecast.objects.update_or_create(
-                    medicine_id=medicine_id,
-                    location_id=location_id,
-                    forecast_date=row['ds'],
-                    defaults={
-                        'predicted_demand': row['yhat'],
-                        'confidence_level': 0.95
-                    }
-                )
-                saved.append({
-                    'date': row['ds'],
-                    'predicted_demand': row['yhat']
-                })
+            saved = self._save_forecasts(medicine_id, location_id, forecasted_data, **options)
+            return Response({**options, 'forecast': saved})
+        except Exception as e:
+            return Response({'error': str(e)}, status=500)
 
-            return Response({'forecast': saved})
+    @action(detail=False, methods=['post'])
+    def forecast_from_history(self, request):
+        """Forecast demand from the recorded daily distribution rollups, no CSV needed"""
+        medicine_id = request.data.get('medicine_id')
+        location_id = request.data.get('location_id')
+        try:
+            history_days = int(request.data.get('history_days', 365))
+        except (TypeError, ValueError):
+            return Response({'error': 'history_days must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        anomalies = request.data.get('anomalies', anomaly_setting('FORECAST_CLEANING'))
+        if anomalies not in CLEANING_MODES:
+            return Response({'error': f"anomalies must be one of {', '.join(CLEANING_MODES)}"}, status=status.HTTP_400_BAD_REQUEST)
+        options, error = self._forecast_options(request)
+        if error:
+            return error
+        if not medicine_id or not location_id:
+            return Response({'error': 'medicine_id and location_id are required'}, status=status.HTTP_400_BAD_REQUEST)
+        if not in_scope(request_scope(request), location_id):
+            return Response({'error': 'That location is outside your organization'}, status=status.HTTP_403_FORBIDDEN)
+
+        start = timezone.localdate() - timedelta(days=history_days)
+        # Flagged demand spikes are clipped (or dropped) before fitting.
+        series = clean_series(medicine_id, location_id, demand_series(medicine_id, location_id, start=start), anomalies)
+        if sum(1 for _, units in series if units) < 2:
+            return Response({'error': 'Not enough recorded demand to forecast'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            forecasted_data = generate_forecast_from_series(series, **options)
+            saved = self._save_forecasts(medicine_id, location_id, forecasted_data, **options)
+            return Response({**options, 'history_days': len(series), 'anomalies': anomalies, 'forecast': saved})
         except Exception as e:
             return Response({'error': str(e)}, status=500)
 
+    def _forecast_options(self, request):
+        """Read and validate the periods, frequency and interval_width parameters."""
+        try:
+            periods = int(request.data.get('periods', 7))
+            interval_width = float(request.data.get('interval_width', 0.95))
+        except (TypeError, ValueError):
+            return None, Response({'error': 'periods must be an integer and interval_width a number'}, status=status.HTTP_400_BAD_REQUEST)
+        frequency = request.data.get('frequency', 'daily')
+        if frequency not in FREQUENCIES:
+            return None, Response({'error': f"frequency must be one of {', '.join(FREQUENCIES)}"}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= periods <= 365:
+            return None, Response({'error': 'periods must be between 1 and 365'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < interval_width < 1:
+            return None, Response({'error': 'interval_width must be between 0 and 1'}, status=status.HTTP_400_BAD_REQUEST)
+        return {'periods': periods, 'frequency': frequency, 'interval_width': interval_width}, None
+
+    def _save_forecasts(self, medicine_id, location_id, forecasted_data, periods=7, frequency='daily', interval_width=0.95):
+        # Forecasts are stored per day; a weekly prediction is spread evenly
+        # over the seven days of its week.
+        days = 7 if frequency == 'weekly' else 1
+        forecasts = []
+        saved = []
+        for row in forecasted_data:
+            for offset in range(days):
+                forecasts.append(DemandForecast(
+                    medicine_id=medicine_id,
+                    location_id=location_id,
+                    forecast_date=(row['ds'] + timedelta(days=offset)).date(),
+                    predicted_demand=round(row['yhat'] / days),
+                    predicted_lower=round(row['yhat_lower'] / days),
+                    predicted_upper=round(row['yhat_upper'] / days),
+                    confidence_level=interval_width
+                ))
+            saved.append({
+                'date': row['ds'],
+                'predicted_demand': row['yhat'],
+                'predicted_lower': row['yhat_lower'],
+                'predicted_upper': row['yhat_upper']
+            })
+        DemandForecast.objects.bulk_create(
+            forecasts, batch_size=500, update_conflicts=True,
+            unique_fields=['medicine', 'location', 'forecast_date'],
+            update_fields=['predicted_demand', 'predicted_lower', 'predicted_upper', 'confidence_level', 'updated_at']
+        )
+        return saved
+
     def _calculate_demand(self, historical_data, medicine, location):
         relevant_data = [
             item for item in historical_data 
@@ -316,37 +779,32 @@ class DemandForecastViewSet(viewsets.ModelViewSet):
         current_stock = request.data.get('current_stock', {})
         demand_forecasts = request.data.get('demand_forecasts', {})
         threshold = float(request.data.get('threshold', 0.2))
-        
-        suggestions = []
-        for location, stock_data in current_stock.items():
-            for medicine, quantity in stock_data.items():
-                demand = demand_forecasts.get(location, {}).get(medicine, 0)
-                
-                if demand > 0:
-                    ratio = quantity / demand
-                    if ratio > (1 + threshold):
-                        surplus = quantity - demand
-                        
-                        for other_location, other_stock in current_stock.items():
-                            if other_location != location:
-                                other_demand = demand_forecasts.get(other_location, {}).get(medicine, 0)
-                                other_quantity = other_stock.get(medicine, 0)
-                                
-                                if other_demand > 0 and (other_quantity / other_demand) < (1 - threshold):
-                                    need = other_demand - other_quantity
-                                    transfer_amount = min(surplus, need)
-                                    
-                                    suggestions.append({
-                                        'from_location': location,
-                                        'to_location': other_location,
-                                        'medicine': medicine,
-                                        'suggested_quantity': transfer_amount,
-                                        'reason': f"Surplus at {location}, shortage at {other_location}"
-                                    })
-                                    break
-        
+        metric = request.data.get('metric', 'transit_hours')
+        if metric not in ROUTING_METRICS:
+            return Response({'error': f"metric must be one of {', '.join(ROUTING_METRICS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        suggestions = suggest_redirections(current_stock, demand_forecasts, threshold, metric)
         return Response({'suggestions': suggestions})
 
+    @action(detail=False, methods=['get'])
+    def rebalance(self, request):
+        """Transfer plan across the user's locations that minimises stock-outs, then transport cost"""
+        try:
+            horizon_days = int(request.query_params.get('horizon_days', 14))
+            reserve = float(request.query_params.get('reserve', 0.2))
+            max_sources = int(request.query_params.get('max_sources', 10))
+            medicines = [int(pk) for pk in request.query_params.get('medicines', '').split(',') if pk]
+        except ValueError:
+            return Response({'error': 'horizon_days, max_sources and medicines must be integers, reserve a number'}, status=status.HTTP_400_BAD_REQUEST)
+        metric = request.query_params.get('metric', 'cost')
+        if metric not in ROUTING_METRICS:
+            return Response({'error': f"metric must be one of {', '.join(ROUTING_METRICS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        if horizon_days < 1 or max_sources < 1 or reserve < 0:
+            return Response({'error': 'horizon_days and max_sources must be positive, reserve non-negative'}, status=status.HTTP_400_BAD_REQUEST)
+
+        plan = plan_rebalancing(horizon_days, reserve, metric, max_sources, medicines or None, request_scope(request))
+        return Response(plan)
+
     @action(detail=False, methods=['get'])
     def search(self, request):
         """Search inventory by medicine name, batch number, or location"""
@@ -355,44 +813,83 @@ class DemandForecastViewSet(viewsets.ModelViewSet):
         if not query:
             return Response({'error': 'Search query is required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        results = Inventory.objects.filter(
+        results = self.scoped(Inventory.objects.all(), 'location').filter(
             models.Q(batch__medicine__name__icontains=query) |
             models.Q(batch__batch_number__icontains=query) |
             models.Q(location__name__icontains=query)
         ).select_related('batch__medicine', 'location')
         
-        serializer = self.get_serializer(results, many=True)
+        serializer = InventorySerializer(results, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
 
     @action(detail=False, methods=['get'])
     def expiring_soon(self, request):
-        """Get inventory items that are expiring soon"""
-        days = int(request.query_params.get('days', 90))
-        
-        from django.utils import timezone
-        from datetime import timedelta
-        expiry_threshold = timezone.now().date() + timedelta(days=days)
-        
-        expiring_items = Inventory.objects.filter(
-            batch__expiry_date__lte=expiry_threshold,
-            batch__expiry_date__gte=timezone.now().date(),
-            quantity__gt=0
-        ).select_related('batch__medicine', 'location')
-        
-        items = []
-        for item in expiring_items:
-            days_left = (item.batch.expiry_date - timezone.now().date()).days
-            items.append({
-                'id': item.id,
-                'medicine': item.batch.medicine.name,
-                'batch_number': item.batch.batch_number,
-                'location': item.location.name,
-                'quantity': item.quantity,
-                'expiry_date': item.batch.expiry_date,
-                'days_left': days_left,
-                'status': 'critical' if days_left < 30 else 'warning'
-            })
-        
-        items.sort(key=lambda x: x['days_left'])
+        """Get inventory items that are expiring soon, soonest first"""
+        try:
+            days = int(request.query_params.get('days', dashboard.EXPIRING_DAYS))
+        except ValueError:
+            return Response({'error': 'days must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
         
-        return Response(items)
\ No newline at end of file
+        today = timezone.now().date()
+        expiring_items = dashboard.expiring(request_scope(request), today, days)
+        page = self.paginate_queryset(expiring_items)
+        items = [dashboard.expiring_row(item, today) for item in (page if page is not None else expiring_items)]
+        if page is not None:
+            return self.get_paginated_response(items)
+        return Response(items)
+
+    @action(detail=False, methods=['get'])
+    def waste_risk(self, request):
+        """Inventory lines ranked by the units projected to expire unsold (see `api.waste`)"""
+        try:
+            horizon_days = int(request.query_params.get('days', 180))
+            medicines = [int(pk) for pk in request.query_params.get('medicines', '').split(',') if pk]
+        except ValueError:
+            return Response({'error': 'days and medicines must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if horizon_days < 0:
+            return Response({'error': 'days must not be negative'}, status=status.HTTP_400_BAD_REQUEST)
+        ordering = request.query_params.get('ordering', '-projected_waste')
+        if ordering.lstrip('-') not in WASTE_ORDERINGS:
+            return Response({'error': f"ordering must be one of {', '.join(WASTE_ORDERINGS)}, optionally prefixed with '-'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        report = waste_risk_report(request_scope(request), horizon_days, medicines or None)
+        # A page only changes with the report's data, so it is keyed by the
+        # report's signature and the query that selected it.
+        etag = '"{}"'.format(hashlib.blake2b(f'{report.signature}{request.get_full_path()}'.encode(), digest_size=16).hexdigest())
+        if request.headers.get('If-None-Match') == etag:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            page = self.paginate_queryset(report.ordered(ordering))
+            response = self.get_paginated_response(page)
+            response.data['summary'] = report.summary()
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, max_age=60)
+        return response
+
+
+class DemandAnomalyViewSet(InstrumentedSerializerMixin, ScopedQuerysetMixin, CompactListMixin, viewsets.ModelViewSet):
+    """
+    Demand spikes flagged by the streaming detector (see `api.anomalies`).
+    Flags are read-only apart from their review status and notes; a
+    dismissed flag no longer affects forecasts.
+    """
+    queryset = DemandAnomaly.objects.select_related('medicine', 'location')
+    scope_fields = ('location',)
+    serializer_class = DemandAnomalySerializer
+    http_method_names = ['get', 'patch', 'head', 'options']
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        params = self.request.query_params
+        if self.action == 'list':
+            try:
+                for param in ('medicine', 'location'):
+                    if params.get(param):
+                        queryset = queryset.filter(**{param: int(params[param])})
+                if params.get('days'):
+                    queryset = queryset.filter(day__gte=timezone.localdate() - timedelta(days=int(params['days'])))
+            except ValueError:
+                raise ValidationError({'error': 'medicine, location and days must be integers'})
+            if params.get('status'):
+                queryset = queryset.filter(status=params['status'])
+        return queryset.order_by('-day', '-score', 'id')
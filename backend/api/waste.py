@@ -0,0 +1,191 @@
+"""
+Waste-risk report: how much stock is projected to expire unsold.
+
+Each inventory line is projected against the daily demand for its
+(medicine, location): the mean daily forecast over the next
+`DEMAND_WINDOW_DAYS` where forecasts exist, and otherwise the mean daily
+distribution over the last `HISTORY_DAYS` from the movement rollups.
+
+Lines at one (medicine, location) share that demand first-expiry-first-out.
+With q the batch quantities and t the selling days left, both in expiry
+order, the units sold from the first i batches by the i-th expiry are
+
+    S_i = min(S_{i-1} + q_i, rate * t_i)
+        = Q_i + min(0, min_{j <= i} (rate * t_j - Q_j))     (Q = cumsum q)
+
+so the whole report is a sort, two cumulative sums and one cumulative
+minimum per group, computed for every line at once with NumPy. A batch's
+projected waste is its quantity less S_i - S_{i-1}.
+
+Reports are cached per scope and parameters against a signature of the
+inventory, forecasts and rollups they read, so repeated requests (paging,
+re-sorting) reuse the same arrays until the data changes.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from .models import Inventory, DemandForecast, DailyMovementRollup
+from .scoping import scope_queryset
+
+DEMAND_WINDOW_DAYS = 28
+HISTORY_DAYS = 28
+MAX_CACHED_REPORTS = 64
+
+ORDERINGS = ('projected_waste', 'waste_ratio', 'days_left', 'quantity', 'daily_demand', 'expiry_date')
+
+_reports = OrderedDict()
+_lock = threading.Lock()
+
+
+class WasteReport:
+    def __init__(self, signature, rows, columns):
+        self.signature = signature
+        self.rows = rows
+        self.columns = columns
+
+    def ordered(self, ordering='-projected_waste'):
+        """Rows sorted by one of `ORDERINGS`, descending with a leading '-', ties by id."""
+        descending = ordering.startswith('-')
+        column = self.columns[ordering.lstrip('-')]
+        order = np.lexsort((self.columns['id'], -column if descending else column))
+        return [self.rows[i] for i in order]
+
+    def summary(self):
+        waste = self.columns['projected_waste']
+        return {
+            'lines': len(self.rows),
+            'lines_at_risk': int(np.count_nonzero(waste)),
+            'projected_waste': int(waste.sum()),
+        }
+
+
+def _pair_keys(medicines, locations):
+    return (np.asarray(medicines, dtype=np.int64) << 32) | np.asarray(locations, dtype=np.int64)
+
+
+def _demand_rates(pairs, scope, today):
+    """Mean daily demand per (medicine, location) key, and whether it came from a forecast."""
+    forecasts = scope_queryset(DemandForecast.objects.all(), scope, 'location').filter(
+        forecast_date__range=(today, today + timedelta(days=DEMAND_WINDOW_DAYS - 1))
+    ).values_list('medicine_id', 'location_id').annotate(total=Sum('predicted_demand'), days=Count('id'))
+    history = scope_queryset(DailyMovementRollup.objects.all(), scope, 'location').filter(
+        movement_type='distribution', day__gte=today - timedelta(days=HISTORY_DAYS), day__lt=today
+    ).values_list('medicine_id', 'location_id').annotate(total=Sum('units_out'))
+
+    rates = np.zeros(len(pairs))
+    sources = np.full(len(pairs), 'none', dtype=object)
+    for rows, source in ((history, 'history'), (forecasts, 'forecast')):
+        rows = list(rows)
+        if not rows:
+            continue
+        data = np.array(rows, dtype=float).reshape(len(rows), -1)
+        keys = _pair_keys(data[:, 0].astype(np.int64), data[:, 1].astype(np.int64))
+        daily = data[:, 2] / (data[:, 3] if source == 'forecast' else HISTORY_DAYS)
+        order = np.argsort(keys)
+        keys, daily = keys[order], daily[order]
+        index = np.clip(np.searchsorted(keys, pairs), 0, len(keys) - 1)
+        found = keys[index] == pairs
+        # Forecasts run second, so they take precedence over history.
+        rates[found] = daily[index[found]]
+        sources[found] = source
+    return rates, sources
+
+
+def _signature(lines, scope, horizon_days, medicines, today):
+    parts = [scope and sorted(scope), horizon_days, medicines and sorted(medicines), today.isoformat()]
+    for queryset, aggregates in (
+        (lines, {'latest': Max('last_updated')}),
+        (DemandForecast.objects.filter(forecast_date__gte=today), {'latest': Max('updated_at')}),
+        # Rollup rows are updated in place, so their totals are the version.
+        (DailyMovementRollup.objects.filter(day__gte=today - timedelta(days=HISTORY_DAYS)), {'units': Sum('units_out')}),
+    ):
+        parts.append(tuple(queryset.aggregate(count=Count('id'), **aggregates).values()))
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+def waste_risk_report(scope=None, horizon_days=180, medicines=None):
+    """
+    The `WasteReport` for stocked, unexpired lines expiring within
+    `horizon_days`, limited to the location `scope` (see `api.scoping`) and
+    to `medicines` when given.
+    """
+    today = timezone.localdate()
+    lines = scope_queryset(Inventory.objects.all(), scope, 'location').filter(
+        quantity__gt=0, batch__expiry_date__gte=today,
+        batch__expiry_date__lte=today + timedelta(days=horizon_days)
+    )
+    if medicines:
+        lines = lines.filter(batch__medicine_id__in=medicines)
+    signature = _signature(lines, scope, horizon_days, medicines, today)
+    key = (scope and frozenset(scope), horizon_days, medicines and frozenset(medicines))
+    with _lock:
+        cached = _reports.get(key)
+        if cached is not None and cached.signature == signature:
+            _reports.move_to_end(key)
+            return cached
+
+    records = list(lines.values(
+        'id', 'quantity', 'location_id', 'batch__medicine_id', 'batch__expiry_date',
+        'batch__medicine__name', 'batch__batch_number', 'location__name'
+    ))
+    ids = np.array([row['id'] for row in records], dtype=np.int64)
+    quantity = np.array([row['quantity'] for row in records], dtype=float)
+    days_left = np.array([(row['batch__expiry_date'] - today).days for row in records], dtype=float)
+    pairs = _pair_keys([row['batch__medicine_id'] for row in records], [row['location_id'] for row in records])
+    rates, sources = _demand_rates(pairs, scope, today)
+
+    # First-expiry-first-out within each (medicine, location).
+    order = np.lexsort((ids, days_left, pairs))
+    group = pairs[order]
+    starts = np.r_[True, group[1:] != group[:-1]] if len(group) else np.zeros(0, dtype=bool)
+    group_index = np.cumsum(starts) - 1
+    cumulative = np.cumsum(quantity[order])
+    cumulative -= np.r_[0, cumulative][np.flatnonzero(starts)][group_index]
+    # Stock expiring today can still sell today.
+    capacity = rates[order] * (days_left[order] + 1) - cumulative
+    # A running minimum that restarts per group: shift every later group
+    # below all earlier values, take one cumulative minimum, shift back.
+    spread = (np.ptp(capacity) + 1) if len(capacity) else 0
+    offset = group_index * spread
+    running = np.minimum.accumulate(capacity - offset) + offset
+    sold_through = np.floor(cumulative + np.minimum(running, 0))
+    sold = sold_through - np.where(starts, 0, np.r_[0, sold_through[:-1]])
+
+    waste = np.empty_like(quantity)
+    waste[order] = quantity[order] - sold
+    waste = np.clip(np.rint(waste), 0, None)
+    ratio = np.divide(waste, quantity, out=np.zeros_like(waste), where=quantity > 0)
+
+    rows = [
+        {
+            'id': row['id'],
+            'medicine': row['batch__medicine__name'],
+            'batch_number': row['batch__batch_number'],
+            'location': row['location__name'],
+            'quantity': row['quantity'],
+            'expiry_date': row['batch__expiry_date'],
+            'days_left': int(days_left[i]),
+            'daily_demand': round(float(rates[i]), 2),
+            'demand_source': sources[i],
+            'projected_sold': row['quantity'] - int(waste[i]),
+            'projected_waste': int(waste[i]),
+            'waste_ratio': round(float(ratio[i]), 3),
+        }
+        for i, row in enumerate(records)
+    ]
+    report = WasteReport(signature, rows, {
+        'id': ids, 'projected_waste': waste, 'waste_ratio': ratio, 'days_left': days_left,
+        'quantity': quantity, 'daily_demand': rates, 'expiry_date': days_left,
+    })
+    with _lock:
+        _reports[key] = report
+        _reports.move_to_end(key)
+        while len(_reports) > MAX_CACHED_REPORTS:
+            _reports.popitem(last=False)
+    return report
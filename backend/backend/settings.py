@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from corsheaders.defaults import default_headers
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -44,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -77,12 +81,61 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# The backend is chosen through the environment so production can run on
+# PostgreSQL while local development keeps the bundled SQLite file:
+#
+#   DB_ENGINE=postgresql DB_NAME=pharmaflow DB_USER=... DB_PASSWORD=... \
+#   DB_HOST=... DB_PORT=5432 DB_POOL_MAX_SIZE=20 python manage.py runserver
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE in ('postgresql', 'postgres'):
+    DB_POOL_ENABLED = os.environ.get('DB_POOL', 'true').lower() in ('1', 'true', 'yes')
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'pharmaflow'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Django's psycopg pool and persistent connections are mutually
+            # exclusive: with the pool on, connections go back to the pool at
+            # the end of each request instead of being kept by the thread.
+            'CONN_MAX_AGE': 0 if DB_POOL_ENABLED else int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+                    'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 20)),
+                    'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+                } if DB_POOL_ENABLED else False,
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # WAL lets readers proceed while a writer holds the lock, and
+                # synchronous=NORMAL is durable enough under WAL while avoiding
+                # an fsync per commit.
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA busy_timeout=%d;' % int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+                ),
+                # Take the write lock at BEGIN so concurrent stock writers queue
+                # on busy_timeout instead of failing with "database is locked"
+                # when a read transaction tries to upgrade.
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -133,6 +186,9 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'api.throttling.TokenBucketThrottle',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20
 }
@@ -158,3 +214,69 @@ SIMPLE_JWT = {
 CORS_ALLOW_ALL_ORIGINS = True
 
 CORS_ALLOW_CREDENTIALS = True
+
+# Browsers must be allowed to send the header that makes write retries safe.
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+
+# Stored responses of requests sent with an Idempotency-Key header.
+IDEMPOTENCY = {
+    'TTL_SECONDS': int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 3600)),
+}
+
+# Delta sync (/api/sync/): tokens older than the tombstone retention get a
+# full resync, and caught-up tokens re-read the last OVERLAP_SECONDS.
+SYNC = {
+    'TOMBSTONE_RETENTION_DAYS': 30,
+    'OVERLAP_SECONDS': 5,
+}
+
+# Server-sent inventory events (/api/events/, ASGI only). Every process polls
+# the event table once per POLL_SECONDS for all of its connected clients.
+PUSH = {
+    'POLL_SECONDS': 1.0,
+    'RETENTION_SECONDS': 600,
+}
+
+# /api/bootstrap/ payloads are cached per user for TTL_SECONDS.
+BOOTSTRAP = {
+    'TTL_SECONDS': int(os.environ.get('BOOTSTRAP_TTL_SECONDS', 30)),
+}
+
+# Streaming demand anomaly detection (see api.anomalies): a day's
+# distribution more than Z_THRESHOLD exponentially weighted standard
+# deviations above its series' mean is flagged, and flagged days are
+# winsorized before forecast_from_history fits ('exclude' drops them,
+# 'keep' ignores the flags).
+ANOMALIES = {
+    'Z_THRESHOLD': float(os.environ.get('ANOMALY_Z_THRESHOLD', 4.0)),
+    'MIN_UNITS': int(os.environ.get('ANOMALY_MIN_UNITS', 10)),
+    'FORECAST_CLEANING': os.environ.get('ANOMALY_FORECAST_CLEANING', 'winsorize'),
+}
+
+# Stock movements older than HORIZON_DAYS are moved, a month at a time, into
+# shard files under DIRECTORY by the archive_movements command.
+ARCHIVE = {
+    'DIRECTORY': Path(os.environ.get('ARCHIVE_DIR', BASE_DIR / 'archive')),
+    'HORIZON_DAYS': int(os.environ.get('ARCHIVE_HORIZON_DAYS', 365)),
+}
+
+# Token-bucket throttling per user, sized by role. Expensive endpoints cost
+# more than one token (see api.throttling); None leaves a role unthrottled.
+THROTTLE = {
+    'RATES': {
+        'staff': None,
+        'manufacturer': os.environ.get('THROTTLE_RATE_MANUFACTURER', '600/min'),
+        'stockist': os.environ.get('THROTTLE_RATE_STOCKIST', '600/min'),
+        'pharmacist': os.environ.get('THROTTLE_RATE_PHARMACIST', '300/min'),
+        'user': '300/min',
+        'anon': '60/min',
+    },
+}
+
+# Per-endpoint performance metrics, exposed to admins at /api/metrics/.
+# Lower SAMPLE_RATE to cut instrumentation overhead on busy deployments.
+PERF_METRICS = {
+    'ENABLED': os.environ.get('PERF_METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+    'SAMPLE_RATE': float(os.environ.get('PERF_METRICS_SAMPLE_RATE', 1.0)),
+    'WINDOW_SECONDS': 300,
+}
@@ -37,6 +37,13 @@ export interface User {
   };
 }
 
+export interface Bootstrap {
+  role: string | null;
+  generated_at: string;
+  user?: User;
+  [section: string]: unknown;
+}
+
 class ApiService {
   private getHeaders(includeAuth = true): HeadersInit {
     const headers: HeadersInit = {
@@ -107,6 +114,21 @@ class ApiService {
     return response.json();
   }
 
+  // Everything the current page needs on first render, in one request.
+  // Pass `sections` to ask for a subset; the default follows the user's role.
+  async getBootstrap(sections?: string[]): Promise<Bootstrap> {
+    const query = sections && sections.length ? `?sections=${sections.join(',')}` : '';
+    const response = await fetch(`${API_URL}/bootstrap/${query}`, {
+      headers: this.getHeaders(),
+    });
+
+    if (!response.ok) {
+      throw new Error('Failed to fetch bootstrap data');
+    }
+
+    return response.json();
+  }
+
   // Add more API methods for other endpoints as needed
   async getMedicines() {
     const response = await fetch(`${API_URL}/medicines/`, {